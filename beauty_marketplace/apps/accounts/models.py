@@ -21,6 +21,11 @@ class User(AbstractUser):
     
     def __str__(self):
         return self.username
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date_joined', '-id'], name='user_joined_newest_idx'),
+        ]
 
 
 class UserProfile(models.Model):
@@ -55,6 +60,11 @@ class UserKYC(models.Model):
     
     def __str__(self):
         return f"{self.user.username}'s KYC ({self.status})"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-submitted_at', '-id'], name='kyc_status_submitted_idx'),
+        ]
 
 
 class UserVerification(models.Model):
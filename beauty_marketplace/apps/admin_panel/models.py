@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 from apps.accounts.models import User
 from apps.community.models import CommunityPost, CommunityMessage
@@ -16,6 +17,7 @@ class AdminAction(models.Model):
         ('user_ban', 'User Ban'),
         ('ad_approval', 'Ad Approval'),
         ('ad_rejection', 'Ad Rejection'),
+        ('order_status_change', 'Order Status Change'),
     )
     
     admin_user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -59,6 +61,12 @@ class Report(models.Model):
     
     def __str__(self):
         return f"Report by {self.reported_by.username} - {self.report_type}"
+    
+    class Meta:
+        indexes = [
+            # Moderators only list open reports, a small and shrinking subset
+            models.Index(fields=['-created_at', '-id'], condition=Q(is_resolved=False), name='report_open_newest_idx'),
+        ]
 
 
 class SystemSetting(models.Model):
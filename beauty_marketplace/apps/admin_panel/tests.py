@@ -1,10 +1,16 @@
 from django.test import TestCase, Client
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.utils import timezone
 
 from .models import AdminAction, Report, SystemSetting
 from apps.community.models import CommunityPost, CommunityMessage
+from apps.accounts.models import UserKYC
+from apps.advertisements.models import Advertisement
+from apps.orders.models import Order, OrderStatus
+from apps.products.models import Category, Product
+from apps.products.managers import DatabaseOptimizer
 
 User = get_user_model()
 
@@ -236,3 +242,119 @@ class AdminPanelActionTests(TestCase):
         report.refresh_from_db()
         self.assertTrue(report.is_resolved)
         self.assertEqual(report.resolved_by, self.admin_user)
+
+
+
+class AdminPanelQueryPlanTests(TestCase):
+    """
+    EXPLAIN the pages the admin list views read and fail if any scans a table or sorts
+    """
+    
+    @classmethod
+    def setUpTestData(cls):
+        users = [
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', phone='')
+            for i in range(20)
+        ]
+        User.objects.create_user(
+            username='adminuser', email='admin@example.com', phone='', password='testpass123', user_type='admin'
+        )
+        Report.objects.bulk_create([
+            Report(
+                reported_by=users[i % 20],
+                report_type='post',
+                content_id=i,
+                report_reason='spam',
+                is_resolved=i % 4 != 0
+            )
+            for i in range(200)
+        ])
+        UserKYC.objects.bulk_create([
+            UserKYC(user=user, status=('pending', 'verified', 'rejected')[i % 3]) for i, user in enumerate(users)
+        ])
+        category = Category.objects.create(name='Skincare')
+        Product.objects.bulk_create([
+            Product(seller=users[i % 20], category=category, name=f'Product {i}', description='Test', price=10)
+            for i in range(200)
+        ])
+        Advertisement.objects.bulk_create([
+            Advertisement(title=f'Ad {i}', created_by=users[i % 20]) for i in range(200)
+        ])
+    
+    def setUp(self):
+        self.client.login(username='adminuser', password='testpass123')
+    
+    def assertPagesUseIndexes(self, url, params=None):
+        with DatabaseOptimizer.capture_page_querysets() as querysets:
+            self.client.get(url, params)
+        self.assertTrue(querysets, f'{url} read no pages')
+        for queryset in querysets:
+            self.assertEqual(DatabaseOptimizer.plan_problems(queryset), [], DatabaseOptimizer.explain(queryset))
+    
+    def test_moderation_queues_use_indexes(self):
+        """Test that the open report queue and every KYC status queue walk an index in order"""
+        self.assertPagesUseIndexes(reverse('admin_panel:community_moderation'))
+        for status in ('pending', 'verified', 'rejected'):
+            with self.subTest(status=status):
+                self.assertPagesUseIndexes(reverse('admin_panel:kyc_review'), {'status': status})
+    
+    def test_management_lists_use_indexes(self):
+        """Test that the user, product approval and advertisement lists walk an index in order"""
+        for name in ('user_management', 'product_approval', 'advertisement_management'):
+            with self.subTest(view=name):
+                self.assertPagesUseIndexes(reverse(f'admin_panel:{name}'))
+
+
+class BulkOrderStatusTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.buyer = User.objects.create_user(
+            username='testuser', email='test@example.com', phone='', password='testpass123'
+        )
+        self.admin_user = User.objects.create_user(
+            username='adminuser', email='admin@example.com', phone='', password='testpass123', user_type='admin'
+        )
+        for number in range(1, 4):
+            Order.objects.create(
+                user=self.buyer,
+                order_number=f'ORD-{number}',
+                total_amount=10,
+                delivery_address='1 Test Street',
+                status='processing'
+            )
+    
+    def upload(self, content, name='orders.jsonl'):
+        return self.client.post(reverse('admin_panel:bulk_order_status'), {
+            'file': SimpleUploadedFile(name, content),
+            'notes': 'Courier pickup',
+        })
+    
+    def test_bulk_order_status_requires_admin(self):
+        """Test that only admins can change order statuses in bulk"""
+        self.client.login(username='testuser', password='testpass123')
+        response = self.upload(b'{"order_number": "ORD-1", "status": "shipped"}\n')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.get(order_number='ORD-1').status, 'processing')
+    
+    def test_bulk_order_status_reports_each_row(self):
+        """Test that an uploaded file is applied and the report lists the rejected rows"""
+        self.client.login(username='adminuser', password='testpass123')
+        response = self.upload(
+            b'{"order_number": "ORD-1", "status": "shipped"}\n'
+            b'{"order_number": "ORD-2", "status": "shipped"}\n'
+            b'{"order_number": "ORD-3", "status": "pending"}\n'
+            b'not json\n'
+        )
+        
+        report = response.json()
+        self.assertEqual(report['updated'], {'shipped': 2})
+        self.assertEqual(report['rows_failed'], 2)
+        self.assertEqual(report['errors'][0], {'line': 3, 'message': 'ORD-3 cannot go from processing to pending'})
+        self.assertEqual(OrderStatus.objects.filter(notes='Courier pickup').count(), 2)
+        self.assertEqual(AdminAction.objects.get().description, 'Bulk status change of 2 orders: 2 shipped')
+    
+    def test_bulk_order_status_rejects_other_files(self):
+        """Test that files other than CSV or JSONL are turned away"""
+        self.client.login(username='adminuser', password='testpass123')
+        response = self.upload(b'order_number', name='orders.txt')
+        self.assertEqual(response.status_code, 400)
@@ -27,6 +27,9 @@ urlpatterns = [
     path('ads/', views.advertisement_management, name='advertisement_management'),
     path('ads/<int:ad_id>/', views.advertisement_detail, name='advertisement_detail'),
     
+    # Orders
+    path('orders/status/', views.bulk_order_status, name='bulk_order_status'),
+    
     # Analytics
     path('analytics/', views.analytics_dashboard, name='analytics_dashboard'),
 ]
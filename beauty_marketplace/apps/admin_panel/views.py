@@ -1,16 +1,21 @@
+import csv
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib import messages
 from django.http import JsonResponse
 from django.db.models import Q
-from django.core.paginator import Paginator
 from django.utils import timezone
+from django.views.decorators.http import require_POST
 
 from apps.accounts.models import User, UserKYC
 from apps.products.models import Product
+from apps.products.imports import detect_format
+from apps.products.pagination import KeysetPaginator
 from apps.community.models import CommunityPost, CommunityMessage
 from apps.advertisements.models import Advertisement
 from apps.orders.models import Order
+from apps.orders.status import OrderStatusTransitions
 from apps.analytics.models import RevenueReport, UserSignup
 
 from .models import Report, AdminAction
@@ -75,9 +80,8 @@ def user_management(request):
         )
     
     # Paginate results
-    paginator = Paginator(users, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(users, 20, ('-date_joined', '-id'))
+    page_obj = paginator.get_page(request.GET)
     
     context = {
         'page_obj': page_obj,
@@ -139,9 +143,8 @@ def kyc_review(request):
         )
     
     # Paginate results
-    paginator = Paginator(kyc_submissions, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(kyc_submissions, 20, ('-submitted_at', '-id'))
+    page_obj = paginator.get_page(request.GET)
     
     context = {
         'page_obj': page_obj,
@@ -217,9 +220,8 @@ def product_approval(request):
         )
     
     # Paginate results
-    paginator = Paginator(products, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(products, 20, ('-created_at', '-id'))
+    page_obj = paginator.get_page(request.GET)
     
     context = {
         'page_obj': page_obj,
@@ -289,9 +291,8 @@ def community_moderation(request):
         )
     
     # Paginate results
-    paginator = Paginator(reports, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(reports, 20, ('-created_at', '-id'))
+    page_obj = paginator.get_page(request.GET)
     
     context = {
         'page_obj': page_obj,
@@ -389,9 +390,8 @@ def advertisement_management(request):
         )
     
     # Paginate results
-    paginator = Paginator(ads, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(ads, 20, ('-created_at', '-id'))
+    page_obj = paginator.get_page(request.GET)
     
     context = {
         'page_obj': page_obj,
@@ -466,3 +466,38 @@ def analytics_dashboard(request):
     }
     
     return render(request, 'admin_panel/analytics_dashboard.html', context)
+
+
+@require_POST
+@user_passes_test(is_admin)
+def bulk_order_status(request):
+    # Operations upload a CSV or JSONL file of order_number,status rows
+    upload = request.FILES.get('file')
+    file_format = detect_format(upload.name) if upload else None
+    if file_format is None:
+        return JsonResponse({'error': 'Please upload a .csv or .jsonl file.'}, status=400)
+    
+    notes = request.POST.get('notes', '').strip() or f'Bulk status change by {request.user.username}'
+    try:
+        report = OrderStatusTransitions(notes=notes).run_file(upload, file_format)
+    except (UnicodeDecodeError, csv.Error):
+        return JsonResponse(
+            {'error': 'The file could not be read. Please upload UTF-8 encoded CSV or JSONL.'}, status=400
+        )
+    
+    if report.orders_updated:
+        AdminAction.objects.create(
+            admin_user=request.user,
+            action_type='order_status_change',
+            description=f"Bulk status change of {report.orders_updated} orders: "
+                        + ', '.join(f'{count} {status}' for status, count in sorted(report.updated.items()))
+        )
+    
+    return JsonResponse({
+        'updated': report.updated,
+        'unchanged': report.unchanged,
+        'rows_failed': report.rows_failed,
+        'refunds_due': report.refunds_due,
+        'errors': [{'line': line_number, 'message': message} for line_number, message in sorted(report.errors)],
+        'errors_truncated': report.errors_truncated,
+    })
@@ -26,6 +26,11 @@ class Advertisement(models.Model):
     
     def __str__(self):
         return self.title
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='ad_newest_idx'),
+        ]
 
 
 class AdvertisementSlot(models.Model):
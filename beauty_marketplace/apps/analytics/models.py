@@ -27,6 +27,11 @@ class ProductView(models.Model):
     
     def __str__(self):
         return f"View of {self.product.name}"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created_at'], name='productview_product_time_idx'),
+        ]
 
 
 class SearchQuery(models.Model):
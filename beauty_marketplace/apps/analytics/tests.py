@@ -4,6 +4,9 @@ from django.urls import reverse
 from django.utils import timezone
 
 from .models import UserActivity, ProductView, SearchQuery, RevenueReport, UserSignup
+from apps.products.managers import DatabaseOptimizer
+from apps.products.models import Category, Product
+from apps.products.stats import ProductStatsEngine
 
 User = get_user_model()
 
@@ -229,3 +232,25 @@ class AnalyticsDataCollectionTests(TestCase):
         # Check that the signup count was incremented
         signup = UserSignup.objects.get(date=timezone.now().date())
         self.assertGreater(signup.signup_count, 0)
+
+
+
+class AnalyticsQueryPlanTests(TestCase):
+    """
+    EXPLAIN the product view rollup's query and fail if it reads the table in full
+    """
+    
+    def test_daily_view_counts_use_index(self):
+        """Test that recounting a few products' recent daily views is served by an index"""
+        seller = User.objects.create_user(username='seller', email='seller@example.com', phone='', user_type='seller')
+        category = Category.objects.create(name='Skincare')
+        products = [
+            Product.objects.create(seller=seller, category=category, name=f'Product {i}', description='Test', price=10)
+            for i in range(5)
+        ]
+        ProductView.objects.bulk_create([ProductView(product=products[i % 5]) for i in range(200)])
+        
+        counts = ProductStatsEngine.daily_view_counts(
+            [products[0].pk, products[1].pk], timezone.now() - timezone.timedelta(days=30)
+        )
+        self.assertEqual(DatabaseOptimizer.plan_problems(counts), [], DatabaseOptimizer.explain(counts))
@@ -30,6 +30,11 @@ class CommunityPost(models.Model):
     
     def __str__(self):
         return self.title
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', '-created_at', '-id'], name='post_room_newest_idx'),
+        ]
 
 
 class CommunityMessage(models.Model):
@@ -5,6 +5,7 @@ from django.utils import timezone
 
 from .models import CommunityRoom, CommunityPost, CommunityMessage
 from apps.accounts.models import UserVerification
+from apps.products.managers import DatabaseOptimizer
 
 User = get_user_model()
 
@@ -219,3 +220,25 @@ class CommunityAdultContentTests(TestCase):
         self.client.login(email='unverified@example.com', password='testpass123')
         response = self.client.get(reverse('community:room_detail', args=[self.adult_room.id]))
         self.assertEqual(response.status_code, 302)  # Redirect to age verification
+
+
+
+class CommunityQueryPlanTests(TestCase):
+    """
+    EXPLAIN the page the room view reads and fail if it scans the table or sorts
+    """
+    
+    def test_room_posts_use_index(self):
+        """Test that a room's newest posts walk an index in order"""
+        user = User.objects.create_user(username='poster', email='poster@example.com', phone='', password='testpass123')
+        rooms = [CommunityRoom.objects.create(name=f'Room {i}', created_by=user) for i in range(5)]
+        CommunityPost.objects.bulk_create([
+            CommunityPost(room=rooms[i % 5], user=user, title=f'Post {i}', content='Test content')
+            for i in range(200)
+        ])
+        
+        self.client.login(username='poster', password='testpass123')
+        with DatabaseOptimizer.capture_page_querysets() as querysets:
+            self.client.get(reverse('community:room_detail', args=[rooms[0].id]))
+        self.assertEqual(len(querysets), 1)
+        self.assertEqual(DatabaseOptimizer.plan_problems(querysets[0]), [], DatabaseOptimizer.explain(querysets[0]))
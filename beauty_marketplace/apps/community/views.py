@@ -8,6 +8,7 @@ from django.utils import timezone
 
 from .models import CommunityRoom, CommunityPost, CommunityMessage
 from apps.accounts.models import User, UserVerification
+from apps.products.pagination import KeysetPaginator
 
 
 def community_home(request):
@@ -88,9 +89,8 @@ def room_detail(request, room_id):
     posts = CommunityPost.objects.filter(room=room).order_by('-created_at')
     
     # Paginate results
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(posts, 10, ('-created_at', '-id'))
+    page_obj = paginator.get_page(request.GET)
     
     context = {
         'room': room,
@@ -1 +1,40 @@
-  
+from django.conf import settings
+from django.contrib import admin, messages
+
+from .models import Order
+from .status import OrderStatusTransitions
+
+
+def _transition_action(status):
+    def action(modeladmin, request, queryset):
+        order_numbers = queryset.order_by('pk').values_list('order_number', flat=True).iterator(
+            chunk_size=settings.ORDER_STATUS_BATCH_SIZE
+        )
+        report = OrderStatusTransitions(notes=f'Marked {status} by {request.user.username}').run(
+            (position, order_number, status) for position, order_number in enumerate(order_numbers, start=1)
+        )
+
+        if report.orders_updated:
+            modeladmin.message_user(request, f'{report.orders_updated} orders marked {status}.', messages.SUCCESS)
+        if report.refunds_due:
+            modeladmin.message_user(
+                request, f'{report.refunds_due} cancelled orders were already paid and need a refund.', messages.WARNING
+            )
+        if report.rows_failed:
+            modeladmin.message_user(
+                request, f'{report.rows_failed} orders cannot be marked {status} from their current status.',
+                messages.WARNING
+            )
+
+    action.__name__ = f'mark_{status}'
+    action.short_description = f'Mark selected orders {status}'
+    return action
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('order_number', 'user', 'status', 'total_amount', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('order_number',)
+    raw_id_fields = ('user',)
+    actions = [_transition_action(status) for status in ('processing', 'shipped', 'delivered', 'cancelled')]
@@ -0,0 +1,560 @@
+from contextlib import contextmanager
+from decimal import Decimal
+import json
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the Redis commands the cart store uses
+
+    Used when CART_REDIS_URL is not set (tests and single-process
+    development). Values are returned as strings, like a client created with
+    decode_responses=True.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = {}
+        self._expires = {}
+
+    def _get(self, key, default=None):
+        deadline = self._expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key, default)
+
+    def _mapping(self, key):
+        # Hashes, sets and sorted sets are all dicts (field -> value, member -> '' or score)
+        value = self._get(key)
+        if value is None:
+            value = self._data[key] = {}
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def mget(self, keys):
+        with self._lock:
+            return [self._get(key) for key in keys]
+
+    def set(self, key, value, nx=False, px=None, ex=None):
+        with self._lock:
+            if nx and self._get(key) is not None:
+                return None
+            self._data[key] = str(value)
+            self._expires.pop(key, None)
+            if px or ex:
+                self._expires[key] = time.monotonic() + (px / 1000 if px else ex)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            deleted = 0
+            for key in keys:
+                if self._get(key) is not None:
+                    deleted += 1
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+            return deleted
+
+    def incrby(self, key, amount=1):
+        with self._lock:
+            self._data[key] = str(int(self._get(key, 0)) + amount)
+            return int(self._data[key])
+
+    def decrby(self, key, amount=1):
+        return self.incrby(key, -amount)
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if self._get(key) is None:
+                return False
+            self._expires[key] = time.monotonic() + seconds
+            return True
+
+    def hget(self, key, field):
+        with self._lock:
+            return self._get(key, {}).get(str(field))
+
+    def hmget(self, key, *fields):
+        with self._lock:
+            values = self._get(key, {})
+            return [values.get(str(field)) for field in fields]
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._get(key, {}))
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            values = self._mapping(key)
+            items = dict(mapping or {})
+            if field is not None:
+                items[field] = value
+            added = sum(1 for name in items if str(name) not in values)
+            values.update((str(name), str(item)) for name, item in items.items())
+            return added
+
+    def hsetnx(self, key, field, value):
+        with self._lock:
+            values = self._mapping(key)
+            if str(field) in values:
+                return 0
+            values[str(field)] = str(value)
+            return 1
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            values = self._mapping(key)
+            values[str(field)] = str(int(values.get(str(field), 0)) + amount)
+            return int(values[str(field)])
+
+    def zadd(self, key, mapping, nx=False):
+        with self._lock:
+            members = self._mapping(key)
+            added = 0
+            for member, score in mapping.items():
+                member = str(member)
+                if member not in members:
+                    added += 1
+                elif nx:
+                    continue
+                members[member] = float(score)
+            return added
+
+    def zrem(self, key, *members):
+        with self._lock:
+            values = self._get(key, {})
+            return sum(1 for member in members if values.pop(str(member), None) is not None)
+
+    def zrangebyscore(self, key, min, max, start=None, num=None):
+        with self._lock:
+            low = float('-inf') if min == '-inf' else float(min)
+            high = float('inf') if max == '+inf' else float(max)
+            members = sorted(
+                (score, member) for member, score in self._get(key, {}).items() if low <= score <= high
+            )
+            members = [member for _, member in members]
+            if start is not None:
+                members = members[start:start + num]
+            return members
+
+    def zcard(self, key):
+        with self._lock:
+            return len(self._get(key, {}))
+
+    def sadd(self, key, *members):
+        with self._lock:
+            values = self._mapping(key)
+            added = sum(1 for member in members if str(member) not in values)
+            values.update((str(member), '') for member in members)
+            return added
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._get(key, {}))
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+
+class LocalPipeline:
+    """
+    Queues commands and runs them together under the store lock, like MULTI/EXEC
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._client._lock:
+            commands, self._commands = self._commands, []
+            return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._commands = []
+
+
+class CartLine:
+    """
+    One product in a cart, with the name, price and image it had when added
+    """
+
+    def __init__(self, product_id, quantity, name='', price='0', image='', category=''):
+        self.product_id = product_id
+        self.quantity = quantity
+        self.name = name
+        self.price = Decimal(price)
+        self.image = image
+        self.category = category
+
+    def total_price(self):
+        return self.quantity * self.price
+
+    @classmethod
+    def snapshot(cls, product):
+        """
+        JSON snapshot of what a cart line shows about a product
+        """
+        image = product.primary_image
+        return json.dumps({
+            'name': product.name,
+            'price': str(product.price),
+            'image': image.src if image else '',
+            'category': product.category.name,
+        })
+
+
+class CartSummary:
+    """
+    Subtotal, number of lines and number of units in a cart
+    """
+
+    def __init__(self, subtotal='0', line_count=0, item_count=0):
+        self.subtotal = Decimal(subtotal)
+        self.line_count = line_count
+        self.item_count = item_count
+
+    @classmethod
+    def from_lines(cls, lines):
+        return cls(sum((line.total_price() for line in lines), Decimal('0')), len(lines),
+                   sum(line.quantity for line in lines))
+
+    @classmethod
+    def from_database(cls, user_id):
+        """
+        Summary of the user's saved cart, in one aggregate query
+        """
+        from .models import CartItem
+
+        totals = CartItem.objects.filter(user_id=user_id).aggregate(
+            subtotal=Sum(ExpressionWrapper(F('quantity') * F('product__price'), output_field=DecimalField())),
+            line_count=Count('product', distinct=True),
+            item_count=Sum('quantity'),
+        )
+        return cls(totals['subtotal'] or 0, totals['line_count'], totals['item_count'] or 0)
+
+    def to_json(self, version):
+        return json.dumps({
+            'version': version,
+            'subtotal': str(self.subtotal),
+            'line_count': self.line_count,
+            'item_count': self.item_count,
+        })
+
+
+class CartStore:
+    """
+    Shopping carts held in Redis, one hash per user, written behind to CartItem
+
+    A cart hash holds ``q:<product id>`` quantities, changed with HINCRBY so
+    concurrent adds never lose units, and ``p:<product id>`` snapshots of the
+    product name, price and image, so the cart renders without touching the
+    database. Lines at zero are left in place rather than deleted, which keeps
+    every write a single atomic command.
+
+    CartItem is the durable copy. A cart missing from Redis is loaded from it,
+    and every write marks the cart dirty; ``flush()`` (run from the
+    ``flush_carts`` command) writes carts that have been dirty for
+    CART_WRITE_BEHIND_DELAY seconds in batches. Carts that are checked out or
+    emptied sooner never reach the database.
+
+    Every write also sets a new ``version``; the cached ``summary`` field
+    records the version it was computed from and is ignored once they differ.
+    """
+
+    DIRTY_KEY = 'cart:dirty'
+    LOADED_FIELD = 'loaded'
+    VERSION_FIELD = 'version'
+    SUMMARY_FIELD = 'summary'
+
+    _client = None
+    _client_lock = threading.Lock()
+
+    @classmethod
+    def client(cls):
+        with cls._client_lock:
+            if cls._client is None:
+                if settings.CART_REDIS_URL:
+                    import redis
+
+                    cls._client = redis.Redis.from_url(settings.CART_REDIS_URL, decode_responses=True)
+                else:
+                    cls._client = LocalRedis()
+            return cls._client
+
+    @staticmethod
+    def key(user_id):
+        return f'cart:{user_id}'
+
+    @classmethod
+    def _touch(cls, pipe, user_id):
+        # Keep the cart alive, outdate its summary and queue it for the write-behind flush
+        pipe.hset(cls.key(user_id), cls.VERSION_FIELD, uuid.uuid4().hex)
+        pipe.expire(cls.key(user_id), settings.CART_TTL)
+        pipe.zadd(cls.DIRTY_KEY, {str(user_id): time.time()}, nx=True)
+
+    @classmethod
+    def _ensure_loaded(cls, user_id):
+        """
+        Load the user's saved cart from CartItem if Redis doesn't hold it
+        """
+        from apps.products.models import Product
+        from .models import CartItem
+
+        client = cls.client()
+        if client.hget(cls.key(user_id), cls.LOADED_FIELD):
+            return
+
+        quantities = {}
+        for product_id, quantity in CartItem.objects.filter(user_id=user_id).values_list('product_id', 'quantity'):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        products = Product.objects.with_card_data().filter(pk__in=list(quantities)).in_bulk()
+
+        pipe = client.pipeline()
+        for product_id, quantity in quantities.items():
+            if product_id in products:
+                # HSETNX, so units added by a concurrent request are not overwritten
+                pipe.hsetnx(cls.key(user_id), f'q:{product_id}', quantity)
+                pipe.hsetnx(cls.key(user_id), f'p:{product_id}', CartLine.snapshot(products[product_id]))
+        pipe.hset(cls.key(user_id), mapping={cls.LOADED_FIELD: 1, cls.VERSION_FIELD: uuid.uuid4().hex})
+        pipe.expire(cls.key(user_id), settings.CART_TTL)
+        pipe.execute()
+
+    @classmethod
+    def add(cls, user_id, product, quantity=1):
+        """
+        Add units of a product and refresh its snapshot; returns the new quantity
+        """
+        cls._ensure_loaded(user_id)
+        pipe = cls.client().pipeline()
+        pipe.hincrby(cls.key(user_id), f'q:{product.pk}', quantity)
+        pipe.hset(cls.key(user_id), f'p:{product.pk}', CartLine.snapshot(product))
+        cls._touch(pipe, user_id)
+        return pipe.execute()[0]
+
+    @classmethod
+    def set_quantity(cls, user_id, product_id, quantity):
+        """
+        Set a line's quantity; zero removes it
+        """
+        cls._ensure_loaded(user_id)
+        client = cls.client()
+        if quantity > 0 and not client.hget(cls.key(user_id), f'p:{product_id}'):
+            return False  # Not in the cart
+        pipe = client.pipeline()
+        pipe.hset(cls.key(user_id), f'q:{product_id}', max(quantity, 0))
+        cls._touch(pipe, user_id)
+        pipe.execute()
+        return True
+
+    @classmethod
+    def clear(cls, user_id):
+        pipe = cls.client().pipeline()
+        pipe.delete(cls.key(user_id))
+        pipe.hset(cls.key(user_id), cls.LOADED_FIELD, 1)
+        cls._touch(pipe, user_id)
+        pipe.execute()
+
+    @classmethod
+    def get_lines(cls, user_id):
+        """
+        Return the cart's CartLines in the order their products were first added
+        """
+        values = cls.client().hgetall(cls.key(user_id))
+        if cls.LOADED_FIELD not in values:
+            cls._ensure_loaded(user_id)
+            values = cls.client().hgetall(cls.key(user_id))
+        return cls.parse(values)
+
+    @classmethod
+    def summary(cls, user_id):
+        """
+        Return the cart's CartSummary; a cached one costs a single HMGET and no queries
+        """
+        client = cls.client()
+        version, cached = client.hmget(cls.key(user_id), cls.VERSION_FIELD, cls.SUMMARY_FIELD)
+        if cached:
+            values = json.loads(cached)
+            if values.pop('version') == version:
+                return CartSummary(**values)
+
+        values = client.hgetall(cls.key(user_id))
+        if cls.LOADED_FIELD in values:
+            version = values.get(cls.VERSION_FIELD)
+            summary = CartSummary.from_lines(cls.parse(values))
+        else:
+            # Not loaded yet: summarize the saved copy rather than loading every snapshot
+            summary = CartSummary.from_database(user_id)
+
+        # Written with the version it was computed from, so a write in between outdates it
+        pipe = client.pipeline()
+        pipe.hset(cls.key(user_id), cls.SUMMARY_FIELD, summary.to_json(version))
+        pipe.expire(cls.key(user_id), settings.CART_TTL)
+        pipe.execute()
+        return summary
+
+    @classmethod
+    def refresh(cls, user_id, lines):
+        """
+        Re-snapshot the products of these lines and return the refreshed lines; removed products drop out
+        """
+        from apps.products.models import Product
+
+        products = Product.objects.with_card_data().filter(pk__in=[line.product_id for line in lines]).in_bulk()
+        refreshed = []
+        pipe = cls.client().pipeline()
+        for line in lines:
+            product = products.get(line.product_id)
+            if product is None:
+                pipe.hset(cls.key(user_id), f'q:{line.product_id}', 0)
+                continue
+            snapshot = CartLine.snapshot(product)
+            pipe.hset(cls.key(user_id), f'p:{line.product_id}', snapshot)
+            refreshed.append(CartLine(line.product_id, line.quantity, **json.loads(snapshot)))
+        cls._touch(pipe, user_id)
+        pipe.execute()
+        return refreshed
+
+    @staticmethod
+    def parse(values):
+        lines = []
+        for field, quantity in values.items():
+            if not field.startswith('q:') or int(quantity) <= 0:
+                continue
+            product_id = int(field[2:])
+            snapshot = json.loads(values.get(f'p:{product_id}') or '{}')
+            lines.append(CartLine(product_id, int(quantity), **snapshot))
+        return lines
+
+    @classmethod
+    def remove_ordered(cls, user_id, quantities):
+        """
+        Take ordered {product_id: quantity} out of the cart, keeping units added since it was read
+        """
+        pipe = cls.client().pipeline()
+        for product_id, quantity in quantities.items():
+            pipe.hincrby(cls.key(user_id), f'q:{product_id}', -quantity)
+        cls._touch(pipe, user_id)
+        pipe.execute()
+
+    @classmethod
+    @contextmanager
+    def checkout_lock(cls, user_id):
+        """
+        Hold the user's checkout lock for the block; yields False if another checkout holds it
+        """
+        lock_key = f'{cls.key(user_id)}:checkout'
+        token = uuid.uuid4().hex
+        client = cls.client()
+        acquired = client.set(lock_key, token, nx=True, px=settings.CART_CHECKOUT_LOCK_TIMEOUT * 1000)
+        try:
+            yield bool(acquired)
+        finally:
+            # Leave the lock alone if it expired and another checkout took it over
+            if acquired and client.get(lock_key) == token:
+                client.delete(lock_key)
+
+    @classmethod
+    def flush(cls, delay=None, batch_size=None):
+        """
+        Write carts dirty for at least ``delay`` seconds to CartItem; returns the number of carts written
+        """
+        delay = settings.CART_WRITE_BEHIND_DELAY if delay is None else delay
+        batch_size = batch_size or settings.CART_FLUSH_BATCH_SIZE
+        client = cls.client()
+        written = 0
+        while True:
+            user_ids = client.zrangebyscore(cls.DIRTY_KEY, '-inf', time.time() - delay, start=0, num=batch_size)
+            if not user_ids:
+                return written
+            # Claim before reading: a write made after this re-queues the cart
+            pipe = client.pipeline()
+            for user_id in user_ids:
+                pipe.zrem(cls.DIRTY_KEY, user_id)
+            claimed = [int(user_id) for user_id, removed in zip(user_ids, pipe.execute()) if removed]
+
+            pipe = client.pipeline()
+            for user_id in claimed:
+                pipe.hgetall(cls.key(user_id))
+            carts = {
+                user_id: {line.product_id: line.quantity for line in cls.parse(values)}
+                for user_id, values in zip(claimed, pipe.execute())
+                if values  # An expired cart keeps its saved copy
+            }
+            cls._write(carts)
+            written += len(carts)
+
+    @staticmethod
+    def _write(carts):
+        """
+        Make CartItem match {user_id: {product_id: quantity}} for these users
+        """
+        from apps.accounts.models import User
+        from apps.products.models import Product
+        from .models import CartItem
+
+        if not carts:
+            return
+        live_users = set(User.objects.filter(pk__in=list(carts)).values_list('pk', flat=True))
+        product_ids = {product_id for lines in carts.values() for product_id in lines}
+        live_products = set(Product.objects.filter(pk__in=list(product_ids)).values_list('pk', flat=True))
+
+        with transaction.atomic():
+            existing = {}
+            stale = []
+            for item in CartItem.objects.filter(user_id__in=list(carts)).order_by('id'):
+                if (item.user_id, item.product_id) in existing:
+                    stale.append(item.pk)  # Duplicate rows from before the cart store
+                else:
+                    existing[(item.user_id, item.product_id)] = item
+
+            now = timezone.now()
+            created, updated = [], []
+            for user_id, lines in carts.items():
+                if user_id not in live_users:
+                    continue
+                for product_id, quantity in lines.items():
+                    if product_id not in live_products:
+                        continue
+                    item = existing.pop((user_id, product_id), None)
+                    if item is None:
+                        created.append(CartItem(user_id=user_id, product_id=product_id, quantity=quantity))
+                    elif item.quantity != quantity:
+                        item.quantity, item.updated_at = quantity, now
+                        updated.append(item)
+
+            stale.extend(item.pk for item in existing.values())
+            CartItem.objects.bulk_create(created)
+            CartItem.objects.bulk_update(updated, ['quantity', 'updated_at'])
+            CartItem.objects.filter(pk__in=stale).delete()
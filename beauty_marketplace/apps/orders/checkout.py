@@ -0,0 +1,181 @@
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+import logging
+
+from apps.products.models import Product
+from apps.products.utils import ProductCache
+
+from .cart import CartStore
+from .models import CartItem, Order, OrderItem, OrderStatus, Payment
+from .payments import PaymentQueue
+from .reservations import StockReservations
+from .utils import OrderNumberGenerator
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutError(Exception):
+    """
+    The cart cannot be turned into an order; the message is shown to the buyer
+    """
+
+
+class InsufficientStock(CheckoutError):
+    """
+    Some cart lines ask for more units than are in stock
+    """
+
+    def __init__(self, shortages):
+        self.shortages = shortages  # [(product, requested, available)]
+        names = ', '.join(
+            f"{product.name} (only {available} left)" if product.is_active and available else product.name
+            for product, _, available in shortages
+        )
+        super().__init__(f"Not enough stock for: {names}. Please update your cart.")
+
+
+class CheckoutService:
+    """
+    Turns a buyer's cart into an order in a single transaction
+
+    The cart is read from the cart store while holding the buyer's checkout
+    lock, so a double submit is turned away instead of ordering twice. The
+    buyer's stock holds are topped up to the cart first; when units cannot be
+    held the checkout fails there, without touching the product rows, so a
+    flash sale's losing buyers never queue on its hot row. Products are locked in primary key order, so concurrent checkouts always
+    take locks in the same order and cannot deadlock. Stock is taken with
+    conditional ``quantity >= n`` updates, so it never goes negative even
+    where row locks are unavailable, and any shortage rolls the whole order
+    back. The order's payment is created pending and charged by the
+    PaymentQueue after commit, so no gateway call holds up the request.
+    """
+
+    @staticmethod
+    def place_order(user, delivery_address, payment_method='credit_card'):
+        """
+        Create the order for the user's cart, take its stock and empty the cart; returns the Order
+        """
+        if payment_method not in dict(Payment.METHOD_CHOICES):
+            raise CheckoutError('Please choose a payment method.')
+        with CartStore.checkout_lock(user.pk) as locked:
+            if not locked:
+                raise CheckoutError('Your order is already being placed.')
+            lines = CartStore.get_lines(user.pk)
+            if not lines:
+                raise CheckoutError('Your cart is empty.')
+            return CheckoutService._place(user, delivery_address, payment_method, lines)
+
+    @staticmethod
+    def _place(user, delivery_address, payment_method, lines):
+        requested = {}  # product id -> units, in lock order
+        for line in sorted(lines, key=lambda line: line.product_id):
+            requested[line.product_id] = requested.get(line.product_id, 0) + line.quantity
+
+        shortages = StockReservations.hold(user.pk, requested)
+        if shortages:
+            products = Product.objects.in_bulk(list(shortages))
+            raise InsufficientStock([
+                (CheckoutService.product_or_placeholder(products, product_id), requested[product_id], available)
+                for product_id, available in shortages.items()
+            ])
+
+        with transaction.atomic():
+            # Take the stock first: the decrements lock the product rows, and on SQLite,
+            # where select_for_update does nothing, they take the write lock before any read
+            CheckoutService.take_stock(requested)
+            products = Product.objects.filter(pk__in=list(requested)).in_bulk()
+
+            total_amount = sum(products[product_id].price * quantity for product_id, quantity in requested.items())
+            order = Order.objects.create(
+                user=user,
+                order_number=OrderNumberGenerator.generate(),
+                total_amount=total_amount,
+                delivery_address=delivery_address,
+                status='pending'
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product_id=product_id,
+                    quantity=quantity,
+                    unit_price=products[product_id].price,
+                    total_price=products[product_id].price * quantity
+                )
+                for product_id, quantity in requested.items()
+            ])
+            OrderStatus.objects.create(order=order, status='pending', notes='Order created')
+            payment = Payment.objects.create(
+                order=order,
+                payment_method=payment_method,
+                amount=total_amount,
+                idempotency_key=f'{order.order_number}-payment'
+            )
+            PaymentQueue.enqueue(payment.pk)
+
+            # The saved copy of the ordered lines; the write-behind flush rewrites anything left
+            CartItem.objects.filter(user=user, product_id__in=list(requested)).delete()
+
+            # Only the units that were ordered; anything added meanwhile stays in the cart
+            transaction.on_commit(lambda: CartStore.remove_ordered(user.pk, requested))
+            transaction.on_commit(lambda: StockReservations.consume(user.pk, requested))
+            transaction.on_commit(lambda: CheckoutService._stock_changed(list(requested)))
+
+        logger.info(f"Order {order.order_number} placed by user {user.pk} for {len(requested)} products")
+        return order
+
+    @staticmethod
+    def take_stock(requested):
+        """
+        Decrement stock for {product_id: quantity}, or raise InsufficientStock for every line short of it
+
+        Must run inside the checkout transaction, which the exception rolls back.
+        Each decrement locks its product row, so pass the products in id order.
+        """
+        now = timezone.now()
+        short = {}
+        for product_id, quantity in requested.items():
+            taken = Product.objects.filter(
+                pk=product_id, is_active=True, quantity__gte=quantity
+            ).update(quantity=F('quantity') - quantity, updated_at=now)
+            if not taken:
+                short[product_id] = quantity
+
+        if short:
+            products = Product.objects.in_bulk(list(short))
+            shortages = []
+            for product_id, quantity in short.items():
+                product = CheckoutService.product_or_placeholder(products, product_id)
+                shortages.append((product, quantity, product.quantity if product.is_active else 0))
+            raise InsufficientStock(shortages)
+
+    @staticmethod
+    def return_stock(order_ids):
+        """
+        Put cancelled orders' units back on sale; must run inside the cancelling transaction
+        """
+        returned = dict(
+            OrderItem.objects.filter(order_id__in=order_ids).values('product_id')
+            .annotate(units=Sum('quantity')).values_list('product_id', 'units')
+        )
+        if not returned:
+            return
+        product_ids = sorted(returned)  # Same lock order as checkout
+
+        now = timezone.now()
+        for product_id in product_ids:
+            Product.objects.filter(pk=product_id).update(quantity=F('quantity') + returned[product_id], updated_at=now)
+
+        transaction.on_commit(lambda: StockReservations.resync(product_ids))
+        transaction.on_commit(lambda: CheckoutService._stock_changed(product_ids))
+
+    @staticmethod
+    def product_or_placeholder(products, product_id):
+        return products.get(product_id) or Product(pk=product_id, name='A removed product', is_active=False)
+
+    @staticmethod
+    def _stock_changed(product_ids):
+        # Stock is shown on product pages; the updates above bypass the save signals
+        with ProductCache.coalesce_invalidations():
+            for product_id in product_ids:
+                ProductCache.invalidate_product_cache(product_id)
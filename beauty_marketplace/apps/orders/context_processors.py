@@ -0,0 +1,13 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import CartStore
+
+
+def cart_summary(request):
+    """
+    The signed-in user's CartSummary for the header, read only if a template uses it
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'cart_summary': SimpleLazyObject(lambda: CartStore.summary(user.pk))}
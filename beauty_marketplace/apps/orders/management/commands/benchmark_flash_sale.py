@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.accounts.models import User
+from apps.orders.cart import CartStore
+from apps.orders.checkout import CheckoutService, InsufficientStock
+from apps.orders.reservations import StockReservations
+from apps.products.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Load test checkouts of a single hot product by many concurrent buyers (needs PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=500, help='Buyers racing for the product')
+        parser.add_argument('--stock', type=int, default=50, help='Units on sale')
+        parser.add_argument('--threads', type=int, default=32, help='Concurrent requests')
+
+    def handle(self, *args, **options):
+        buyers_count, stock = options['buyers'], options['stock']
+        seller = User.objects.create_user(
+            username='flash-sale-benchmark-seller',
+            email='flash-sale-benchmark@example.com',
+            phone='',
+            password=None,
+            user_type='seller'
+        )
+        category = Category.objects.create(name='Flash sale benchmark')
+        buyers = User.objects.bulk_create([
+            User(username=f'flash-sale-benchmark-{i}', email=f'flash-sale-benchmark-{i}@example.com', phone='')
+            for i in range(buyers_count)
+        ])
+        try:
+            product = Product.objects.create(
+                seller=seller, category=category, name='Flash sale benchmark product',
+                description='Synthetic product', price=Decimal('9.99'), quantity=stock
+            )
+            product = Product.objects.with_card_data().get(pk=product.pk)
+            for buyer in buyers:
+                CartStore.add(buyer.pk, product, 1)
+
+            # Holds alone: how fast the fast store settles the race
+            seconds, latencies, outcomes = self.run(
+                options['threads'], buyers, lambda buyer: StockReservations.hold(buyer.pk, {product.pk: 1})
+            )
+            self.report('holds', seconds, latencies, held=outcomes.count({}), refused=buyers_count - outcomes.count({}))
+            for buyer in buyers:
+                StockReservations.release(buyer.pk)
+
+            # Full checkouts: holds, then the order transaction for the buyers holding units
+            def checkout(buyer):
+                try:
+                    CheckoutService.place_order(buyer, 'Benchmark Street 1')
+                    return 'ordered'
+                except InsufficientStock:
+                    return 'sold out'
+
+            seconds, latencies, outcomes = self.run(options['threads'], buyers, checkout)
+            self.report('checkouts', seconds, latencies,
+                        ordered=outcomes.count('ordered'), sold_out=outcomes.count('sold out'))
+            product.refresh_from_db()
+            self.stdout.write(f'Units left: {product.quantity} (expected {max(stock - buyers_count, 0)})')
+        finally:
+            pipe = CartStore.client().pipeline()
+            for buyer in buyers:
+                pipe.delete(CartStore.key(buyer.pk), StockReservations.holds_key(buyer.pk))
+                pipe.zrem(CartStore.DIRTY_KEY, str(buyer.pk))
+                pipe.zrem(StockReservations.EXPIRY_KEY, str(buyer.pk))
+            pipe.execute()
+            User.objects.filter(pk__in=[buyer.pk for buyer in buyers] + [seller.pk]).delete()
+            category.delete()
+
+        self.stdout.write(self.style.SUCCESS('Benchmark finished; synthetic data deleted.'))
+
+    def run(self, threads, buyers, attempt):
+        def timed(buyer):
+            started = time.perf_counter()
+            outcome = attempt(buyer)
+            latency = (time.perf_counter() - started) * 1000
+            connection.close()  # Worker threads each opened their own connection
+            return outcome, latency
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(timed, buyers))
+        seconds = time.perf_counter() - started
+        return seconds, sorted(latency for _, latency in results), [outcome for outcome, _ in results]
+
+    def report(self, label, seconds, latencies, **counts):
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        details = ', '.join(f'{name.replace("_", " ")} {count}' for name, count in counts.items())
+        self.stdout.write(
+            f'{label:>9}: {len(latencies) / seconds:8.0f}/s | p50 {statistics.median(latencies):7.2f}ms | '
+            f'p95 {p95:7.2f}ms | {details}'
+        )
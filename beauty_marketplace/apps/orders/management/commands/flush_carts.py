@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from apps.orders.cart import CartStore
+
+
+class Command(BaseCommand):
+    help = 'Save carts changed in the cart store to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delay', type=int, help='Only save carts first changed at least this many seconds ago (default: CART_WRITE_BEHIND_DELAY)')
+        parser.add_argument('--batch-size', type=int, help='Carts written per batch (default: CART_FLUSH_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        written = CartStore.flush(delay=options['delay'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Saved {written} carts.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.orders.models import Payment
+from apps.orders.payments import PaymentQueue
+
+
+class Command(BaseCommand):
+    help = 'Attempt pending payments whose retry is due, including ones left behind by a restart'
+
+    def handle(self, *args, **options):
+        due = Payment.objects.filter(status='pending', next_attempt_at__lte=timezone.now()).order_by('next_attempt_at')
+
+        outcomes = {'completed': 0, 'pending': 0, 'failed': 0, 'refund_due': 0}
+        for payment_id in due.values_list('id', flat=True).iterator(chunk_size=500):
+            status = PaymentQueue.process(payment_id)
+            if status is not None:
+                outcomes[status] += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Completed {outcomes['completed']} payments, {outcomes['pending']} will be retried, "
+            f"{outcomes['failed']} failed, {outcomes['refund_due']} charged after cancellation need a refund."
+        ))
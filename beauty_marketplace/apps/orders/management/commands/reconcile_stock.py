@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from apps.orders.reservations import StockReservations
+
+
+class Command(BaseCommand):
+    help = 'Give back lapsed stock holds and correct hold counters that drifted from product stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Products checked per query (default: STOCK_RECONCILE_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        released, corrected = StockReservations.reconcile(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Released the holds of {released} users; corrected {corrected} product counters.'
+        ))
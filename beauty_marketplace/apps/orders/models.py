@@ -37,6 +37,11 @@ class Order(models.Model):
     
     def __str__(self):
         return f"Order {self.order_number} by {self.user.username}"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_newest_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -69,16 +74,32 @@ class Payment(models.Model):
         ('pending', 'Pending'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
+        ('refund_due', 'Refund Due'),  # Charged for an order that was cancelled
         ('refunded', 'Refunded'),
     )
     
+    METHOD_CHOICES = (
+        ('credit_card', 'Credit Card'),
+        ('paypal', 'PayPal'),
+        ('bank_transfer', 'Bank Transfer'),
+    )
+    
     order = models.OneToOneField(Order, on_delete=models.CASCADE)
-    payment_method = models.CharField(max_length=50)
+    payment_method = models.CharField(max_length=50, choices=METHOD_CHOICES)
     transaction_id = models.CharField(max_length=100, blank=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    idempotency_key = models.CharField(max_length=64, unique=True)  # Sent with every charge attempt
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)  # When a pending payment is next due
+    last_error = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"Payment for {self.order.order_number} - {self.status}"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='payment_due_idx'),
+        ]
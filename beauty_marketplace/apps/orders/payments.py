@@ -0,0 +1,256 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import random
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+import logging
+
+from .models import Order, OrderStatus, Payment
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentError(Exception):
+    """
+    The gateway did not take the payment
+    """
+
+
+class PaymentDeclined(PaymentError):
+    """
+    The gateway refused the payment for good; retrying will not help
+    """
+
+
+class TransientPaymentError(PaymentError):
+    """
+    The gateway could not be reached or failed; the charge may be retried
+    """
+
+
+class PaymentGateway:
+    """
+    What the payment queue needs from a payment provider
+    """
+
+    def charge(self, payment):
+        """
+        Charge payment.amount and return the provider's transaction id
+
+        Must be idempotent on payment.idempotency_key: a retried charge returns
+        the first charge's transaction id instead of charging again. Raises
+        PaymentDeclined for final refusals and TransientPaymentError for
+        anything worth retrying.
+        """
+        raise NotImplementedError
+
+
+class LocalGateway(PaymentGateway):
+    """
+    In-process stand-in that approves every charge, for development and tests
+
+    ``script()`` queues the outcomes of the next charges, e.g.
+    ``LocalGateway.script(TransientPaymentError('timeout'), None)`` fails
+    one charge and approves the next.
+    """
+
+    _lock = threading.Lock()
+    _charges = {}  # idempotency key -> transaction id
+    _outcomes = []
+
+    @classmethod
+    def script(cls, *outcomes):
+        with cls._lock:
+            cls._outcomes.extend(outcomes)
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._charges.clear()
+            cls._outcomes.clear()
+
+    @classmethod
+    def charges(cls):
+        with cls._lock:
+            return dict(cls._charges)
+
+    def charge(self, payment):
+        with self._lock:
+            if payment.idempotency_key in self._charges:
+                return self._charges[payment.idempotency_key]
+            outcome = self._outcomes.pop(0) if self._outcomes else None
+            if outcome is not None:
+                raise outcome
+            transaction_id = self._charges[payment.idempotency_key] = f'local_{uuid.uuid4().hex}'
+            return transaction_id
+
+
+class PaymentQueue:
+    """
+    Charges payments on background threads, outside the request that placed the order
+
+    Checkout creates a pending Payment and enqueues it once its transaction
+    commits, so the buyer gets the order page at once while a worker calls the
+    gateway. Each attempt first claims the payment with a conditional update
+    that pushes ``next_attempt_at`` past PAYMENT_CLAIM_TIMEOUT, so only one
+    worker charges it at a time. Transient failures are retried with
+    exponential backoff and jitter under the same idempotency key, so a
+    retried charge is never taken twice. The ``process_payments`` command
+    picks up payments whose retry is due, including ones left behind by a
+    restart.
+
+    A completed payment moves the order to processing; a declined one, or one
+    out of attempts, cancels the order and puts its stock back. A payment
+    whose order was cancelled before its charge went through is failed without
+    charging it, and one charged while its order was being cancelled is kept
+    as refund_due with its transaction id.
+    """
+
+    _lock = threading.Lock()
+    _executor = None
+
+    @staticmethod
+    def gateway():
+        if not settings.PAYMENT_GATEWAY:
+            raise ImproperlyConfigured('PAYMENT_GATEWAY must name the PaymentGateway that charges payments.')
+        return import_string(settings.PAYMENT_GATEWAY)()
+
+    @staticmethod
+    def _pool():
+        with PaymentQueue._lock:
+            if PaymentQueue._executor is None:
+                PaymentQueue._executor = ThreadPoolExecutor(
+                    max_workers=settings.PAYMENT_QUEUE_WORKERS, thread_name_prefix='payments'
+                )
+            return PaymentQueue._executor
+
+    @staticmethod
+    def enqueue(payment_id):
+        """
+        Charge this payment once the current transaction commits
+        """
+        def submit():
+            if settings.PAYMENT_QUEUE_ASYNC:
+                PaymentQueue._pool().submit(PaymentQueue._process_in_thread, payment_id)
+            else:
+                PaymentQueue.process(payment_id)
+
+        transaction.on_commit(submit)
+
+    @staticmethod
+    def _retry_later(payment_id, delay):
+        if not settings.PAYMENT_QUEUE_ASYNC:
+            return  # process_payments picks it up
+        timer = threading.Timer(delay, lambda: PaymentQueue._pool().submit(PaymentQueue._process_in_thread, payment_id))
+        timer.daemon = True
+        timer.start()
+
+    @staticmethod
+    def _process_in_thread(payment_id):
+        try:
+            PaymentQueue.process(payment_id)
+        except Exception:
+            logger.exception(f"Payment queue failed for payment {payment_id}")
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def retry_delay(attempts):
+        """
+        Seconds to wait after a payment's nth failed attempt: doubling, capped, with jitter
+        """
+        delay = min(settings.PAYMENT_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.PAYMENT_RETRY_MAX_DELAY)
+        return random.uniform(delay / 2, delay)
+
+    @staticmethod
+    def process(payment_id):
+        """
+        Make one attempt at a due payment; returns its status, or None if it was not due
+        """
+        now = timezone.now()
+        claimed = Payment.objects.filter(pk=payment_id, status='pending', next_attempt_at__lte=now).update(
+            attempts=F('attempts') + 1,
+            next_attempt_at=now + timedelta(seconds=settings.PAYMENT_CLAIM_TIMEOUT),
+            updated_at=now
+        )
+        if not claimed:
+            return None  # Paid, failed, or another worker is on it
+        payment = Payment.objects.select_related('order').get(pk=payment_id)
+        if payment.order.status == 'cancelled':
+            return PaymentQueue.fail(payment, 'Order cancelled')  # Cancelled while waiting for a retry
+
+        try:
+            transaction_id = PaymentQueue.gateway().charge(payment)
+        except PaymentDeclined as e:
+            return PaymentQueue.fail(payment, str(e))
+        except Exception as e:
+            if not isinstance(e, TransientPaymentError):
+                logger.exception(f"Unexpected error charging payment {payment_id}")
+            if payment.attempts >= settings.PAYMENT_MAX_ATTEMPTS:
+                return PaymentQueue.fail(payment, f'Gave up after {payment.attempts} attempts: {e}')
+            delay = PaymentQueue.retry_delay(payment.attempts)
+            Payment.objects.filter(pk=payment_id, status='pending').update(
+                next_attempt_at=timezone.now() + timedelta(seconds=delay),
+                last_error=str(e)[:255],
+                updated_at=timezone.now()
+            )
+            logger.warning(f"Payment {payment_id} attempt {payment.attempts} failed, retrying in {delay:.0f}s: {e}")
+            PaymentQueue._retry_later(payment_id, delay)
+            return 'pending'
+
+        return PaymentQueue.complete(payment, transaction_id)
+
+    @staticmethod
+    def complete(payment, transaction_id):
+        with transaction.atomic():
+            now = timezone.now()
+            # Locked like a bulk cancellation locks it, so the order cannot be cancelled under us
+            order_status = Order.objects.select_for_update().filter(pk=payment.order_id).values_list(
+                'status', flat=True
+            ).first()
+            if order_status == 'cancelled':
+                # Cancelled while the charge was in flight: keep the transaction id so the money can be returned
+                Payment.objects.filter(pk=payment.pk, status__in=('pending', 'failed')).update(
+                    status='refund_due', transaction_id=transaction_id,
+                    last_error='Order cancelled while the payment was being charged', updated_at=now
+                )
+                logger.warning(f"Payment {payment.pk} charged for cancelled order {payment.order.order_number}; refund due")
+                return 'refund_due'
+
+            updated = Payment.objects.filter(pk=payment.pk, status='pending').update(
+                status='completed', transaction_id=transaction_id, last_error='', updated_at=now
+            )
+            if updated and Order.objects.filter(pk=payment.order_id, status='pending').update(
+                status='processing', updated_at=now
+            ):
+                OrderStatus.objects.create(order_id=payment.order_id, status='processing', notes='Payment received')
+
+        logger.info(f"Payment {payment.pk} for order {payment.order.order_number} completed: {transaction_id}")
+        return 'completed'
+
+    @staticmethod
+    def fail(payment, reason):
+        from .checkout import CheckoutService  # Checkout enqueues payments
+
+        with transaction.atomic():
+            now = timezone.now()
+            updated = Payment.objects.filter(pk=payment.pk, status='pending').update(
+                status='failed', last_error=reason[:255], updated_at=now
+            )
+            if updated and Order.objects.filter(pk=payment.order_id, status='pending').update(
+                status='cancelled', updated_at=now
+            ):
+                OrderStatus.objects.create(
+                    order_id=payment.order_id, status='cancelled', notes=f'Payment failed: {reason}'
+                )
+                CheckoutService.return_stock([payment.order_id])
+
+        logger.warning(f"Payment {payment.pk} for order {payment.order.order_number} failed: {reason}")
+        return 'failed'
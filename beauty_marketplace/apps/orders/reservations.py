@@ -0,0 +1,206 @@
+import time
+
+from django.conf import settings
+import logging
+
+from apps.products.models import Product
+
+from .cart import CartStore
+
+logger = logging.getLogger(__name__)
+
+
+class StockReservations:
+    """
+    Short-lived holds on product stock, kept in the cart store's Redis
+
+    ``stock:<product id>`` counts the units still free to hold: the product's
+    stock less every active hold. Holds are taken with DECRBY and given back
+    when that drives the counter below zero, so buyers racing for the last
+    units of a product are settled in Redis and only buyers holding their
+    units go on to lock the product row at checkout. A user's holds live in
+    ``stock:holds:<user id>`` and lapse together STOCK_HOLD_TTL seconds
+    after they last changed.
+
+    The database stays authoritative: checkout still takes stock with
+    conditional updates, and ``reconcile()`` (run from the
+    ``reconcile_stock`` command) gives back lapsed holds and corrects
+    counters that drifted from Product.quantity.
+    """
+
+    HELD_KEY = 'stock:held'  # product id -> units held across all users
+    EXPIRY_KEY = 'stock:hold_expiry'  # user id -> when their holds lapse
+    PRODUCTS_KEY = 'stock:products'  # product ids that have a counter
+
+    @staticmethod
+    def counter_key(product_id):
+        return f'stock:{product_id}'
+
+    @staticmethod
+    def holds_key(user_id):
+        return f'stock:holds:{user_id}'
+
+    @classmethod
+    def _ensure_counters(cls, client, product_ids):
+        """
+        Start counters missing from Redis at the product's stock less what is already held
+        """
+        counters = client.mget([cls.counter_key(product_id) for product_id in product_ids])
+        missing = [product_id for product_id, counter in zip(product_ids, counters) if counter is None]
+        if not missing:
+            return
+
+        quantities = dict(Product.objects.filter(pk__in=missing, is_active=True).values_list('pk', 'quantity'))
+        held = client.hmget(cls.HELD_KEY, *missing)
+        pipe = client.pipeline()
+        for product_id, units in zip(missing, held):
+            # NX: another worker may have started it meanwhile, and may already have taken holds from it
+            pipe.set(cls.counter_key(product_id), quantities.get(product_id, 0) - int(units or 0), nx=True)
+        pipe.sadd(cls.PRODUCTS_KEY, *missing)
+        pipe.execute()
+
+    @classmethod
+    def _change(cls, client, user_id, product_id, units):
+        # Move units from the free counter to the user's hold (or back, for negative units)
+        pipe = client.pipeline()
+        pipe.decrby(cls.counter_key(product_id), units)
+        pipe.hincrby(cls.holds_key(user_id), product_id, units)
+        pipe.hincrby(cls.HELD_KEY, product_id, units)
+        return pipe.execute()[0]
+
+    @classmethod
+    def hold(cls, user_id, quantities):
+        """
+        Make the user's holds match {product_id: units}, taking or giving back the difference
+
+        Returns {product_id: units the user could hold} for products that
+        cannot be held in full; those holds are left as they were. Every call
+        restarts the lapse time of all the user's holds.
+        """
+        if not quantities:
+            return {}
+        client = CartStore.client()
+        product_ids = list(quantities)
+        cls._ensure_counters(client, product_ids)
+
+        shortages = {}
+        current = client.hmget(cls.holds_key(user_id), *product_ids)
+        for product_id, held in zip(product_ids, current):
+            held = int(held or 0)
+            change = quantities[product_id] - held
+            if change <= 0:
+                if change:
+                    cls._change(client, user_id, product_id, change)
+                continue
+            free = cls._change(client, user_id, product_id, change)
+            if free < 0:
+                cls._change(client, user_id, product_id, -change)
+                shortages[product_id] = max(free + change, 0) + held
+
+        client.zadd(cls.EXPIRY_KEY, {str(user_id): time.time() + settings.STOCK_HOLD_TTL})
+        return shortages
+
+    @classmethod
+    def consume(cls, user_id, quantities):
+        """
+        Turn holds into sold {product_id: units} once the order's stock decrements have committed
+        """
+        if not quantities:
+            return
+        client = CartStore.client()
+        product_ids = list(quantities)
+        current = client.hmget(cls.holds_key(user_id), *product_ids)
+        pipe = client.pipeline()
+        for product_id, held in zip(product_ids, current):
+            units = min(quantities[product_id], int(held or 0))
+            pipe.hincrby(cls.holds_key(user_id), product_id, -units)
+            pipe.hincrby(cls.HELD_KEY, product_id, -units)
+            if quantities[product_id] > units:
+                # Sold without a hold (it lapsed): those units were still counted as free
+                pipe.decrby(cls.counter_key(product_id), quantities[product_id] - units)
+        pipe.execute()
+
+    @classmethod
+    def release(cls, user_id):
+        """
+        Give back all of a user's holds
+        """
+        client = CartStore.client()
+        pipe = client.pipeline()
+        pipe.hgetall(cls.holds_key(user_id))
+        pipe.delete(cls.holds_key(user_id))
+        pipe.zrem(cls.EXPIRY_KEY, str(user_id))
+        holds = pipe.execute()[0]
+
+        pipe = client.pipeline()
+        for product_id, units in holds.items():
+            if int(units) > 0:
+                pipe.incrby(cls.counter_key(product_id), int(units))
+                pipe.hincrby(cls.HELD_KEY, product_id, -int(units))
+        pipe.execute()
+
+    @classmethod
+    def expire_holds(cls):
+        """
+        Give back the holds of users whose holds have lapsed; returns the number of users
+        """
+        client = CartStore.client()
+        expired = client.zrangebyscore(cls.EXPIRY_KEY, '-inf', time.time())
+        released = 0
+        for user_id in expired:
+            # Claim first, so two reconcilers never give the same holds back twice
+            if client.zrem(cls.EXPIRY_KEY, user_id):
+                cls.release(user_id)
+                released += 1
+        return released
+
+    @classmethod
+    def resync(cls, product_ids):
+        """
+        Correct the counters of these products from Product.quantity; returns how many were off
+        """
+        client = CartStore.client()
+        pipe = client.pipeline()
+        for product_id in product_ids:
+            pipe.get(cls.counter_key(product_id))
+        pipe.hmget(cls.HELD_KEY, *product_ids)
+        *counters, held = pipe.execute()
+        tracked = [
+            (product_id, int(counter), int(units or 0))
+            for product_id, counter, units in zip(product_ids, counters, held)
+            if counter is not None
+        ]
+        if not tracked:
+            return 0
+
+        quantities = dict(
+            Product.objects.filter(pk__in=[product_id for product_id, _, _ in tracked], is_active=True)
+            .values_list('pk', 'quantity')
+        )
+        corrected = 0
+        pipe = client.pipeline()
+        for product_id, counter, units in tracked:
+            # Relative, so holds taken since the counters were read are kept
+            drift = quantities.get(product_id, 0) - units - counter
+            if drift:
+                pipe.incrby(cls.counter_key(product_id), drift)
+                corrected += 1
+        pipe.execute()
+        return corrected
+
+    @classmethod
+    def reconcile(cls, batch_size=None):
+        """
+        Give back lapsed holds and correct counters that drifted from the database; returns (released, corrected)
+        """
+        batch_size = batch_size or settings.STOCK_RECONCILE_BATCH_SIZE
+        released = cls.expire_holds()
+        product_ids = sorted(int(product_id) for product_id in CartStore.client().smembers(cls.PRODUCTS_KEY))
+
+        corrected = 0
+        for start in range(0, len(product_ids), batch_size):
+            corrected += cls.resync(product_ids[start:start + batch_size])
+
+        if corrected:
+            logger.info(f"Stock reconcile corrected {corrected} product counters")
+        return released, corrected
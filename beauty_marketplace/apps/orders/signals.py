@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from apps.products.models import Product
+
+from .reservations import StockReservations
+
+
+@receiver(post_init, sender=Product)
+def remember_product_stock(sender, instance, **kwargs):
+    """
+    Remember the stored stock and status so saves know if stock holds need resyncing
+    """
+    instance._stored_stock = (instance.__dict__.get('quantity'), instance.__dict__.get('is_active'))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def resync_stock_counter(sender, instance, raw=False, created=False, **kwargs):
+    """
+    Restocks, deactivations and deletions change how many units buyers can hold;
+    new products have no hold counter yet
+    """
+    if raw or created:
+        return
+    stock = (instance.quantity, instance.is_active)
+    if kwargs['signal'] is post_delete or stock != instance._stored_stock:
+        product_id = instance.pk
+        transaction.on_commit(lambda: StockReservations.resync([product_id]))
+    instance._stored_stock = stock
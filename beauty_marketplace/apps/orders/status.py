@@ -0,0 +1,157 @@
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+import logging
+
+from apps.products.imports import read_rows
+
+from .checkout import CheckoutService
+from .models import Order, OrderStatus, Payment
+
+logger = logging.getLogger(__name__)
+
+# Statuses an order may move to from each status
+ORDER_TRANSITIONS = {
+    'pending': ('processing', 'cancelled'),
+    'processing': ('shipped', 'cancelled'),
+    'shipped': ('delivered',),
+    'delivered': (),
+    'cancelled': (),
+}
+
+
+class TransitionReport:
+    """
+    Counts and the first few rejected rows of a bulk status change
+    """
+
+    def __init__(self, max_errors):
+        self.updated = {}  # status -> orders moved to it
+        self.unchanged = 0
+        self.rows_failed = 0
+        self.refunds_due = 0  # cancelled orders that had already been paid
+        self.errors = []  # (line number, message), capped at max_errors
+        self._max_errors = max_errors
+
+    def add_error(self, line_number, message):
+        self.rows_failed += 1
+        if len(self.errors) < self._max_errors:
+            self.errors.append((line_number, message))
+
+    @property
+    def orders_updated(self):
+        return sum(self.updated.values())
+
+    @property
+    def errors_truncated(self):
+        return self.rows_failed > len(self.errors)
+
+
+class OrderStatusTransitions:
+    """
+    Move many orders to new statuses, e.g. every order of a courier pickup to shipped
+
+    Rows of (line number, order number, status) are read in batches, so
+    memory stays flat however many there are. Each batch runs in one
+    transaction: the orders are locked and validated against
+    ORDER_TRANSITIONS in memory, each status is applied with a single UPDATE,
+    and the history rows are written with bulk_create. Invalid rows only
+    reject themselves. Cancelling returns the order's stock and stops its
+    payment if it has not been charged yet; a paid order's payment is marked
+    refund_due, and one being charged at that moment is left to the payment
+    queue, which flags it the same way.
+    """
+
+    def __init__(self, notes='', batch_size=None, max_errors=None):
+        self.notes = notes
+        self.batch_size = batch_size or settings.ORDER_STATUS_BATCH_SIZE
+        self.report = TransitionReport(max_errors or settings.ORDER_STATUS_MAX_ERRORS)
+
+    def run(self, rows):
+        """
+        Apply every row and return the TransitionReport
+        """
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            self._apply_batch(batch)
+
+        logger.info(
+            'Bulk order status change: %s, %d unchanged, %d rows rejected, %d refunds due',
+            self.report.updated, self.report.unchanged, self.report.rows_failed, self.report.refunds_due
+        )
+        return self.report
+
+    def run_file(self, stream, file_format):
+        """
+        Apply a CSV or JSONL file with order_number and status columns; returns the TransitionReport
+        """
+        return self.run(self._file_rows(stream, file_format))
+
+    def _file_rows(self, stream, file_format):
+        for line_number, row, error in read_rows(stream, file_format):
+            if error:
+                self.report.add_error(line_number, error)
+                continue
+            order_number = str(row.get('order_number') or '').strip()
+            if not order_number:
+                self.report.add_error(line_number, 'order_number is required')
+                continue
+            yield line_number, order_number, str(row.get('status') or '').strip().lower()
+
+    def _apply_batch(self, batch):
+        order_numbers = {order_number for _, order_number, _ in batch}
+        with transaction.atomic():
+            current = {
+                order_number: [pk, status]
+                for pk, order_number, status in Order.objects.select_for_update().filter(
+                    order_number__in=order_numbers
+                ).order_by('pk').values_list('pk', 'order_number', 'status')
+            }
+
+            changes = {}  # order id -> final status in this batch
+            history = []
+            for line_number, order_number, status in batch:
+                if status not in ORDER_TRANSITIONS:
+                    self.report.add_error(line_number, f'unknown status "{status}"')
+                    continue
+                order = current.get(order_number)
+                if order is None:
+                    self.report.add_error(line_number, f'unknown order "{order_number}"')
+                    continue
+                if order[1] == status:
+                    self.report.unchanged += 1
+                    continue
+                if status not in ORDER_TRANSITIONS[order[1]]:
+                    self.report.add_error(line_number, f'{order_number} cannot go from {order[1]} to {status}')
+                    continue
+                order[1] = changes[order[0]] = status  # A later row for the same order starts from here
+                history.append(OrderStatus(order_id=order[0], status=status, notes=self.notes))
+
+            by_status = {}
+            for order_id, status in changes.items():
+                by_status.setdefault(status, []).append(order_id)
+
+            # updated_at drives the incremental sales stats, which .update() would not set
+            now = timezone.now()
+            for status, order_ids in by_status.items():
+                Order.objects.filter(pk__in=order_ids).update(status=status, updated_at=now)
+                self.report.updated[status] = self.report.updated.get(status, 0) + len(order_ids)
+            for entry in history:
+                entry.created_at = now
+            OrderStatus.objects.bulk_create(history, batch_size=self.batch_size)
+
+            cancelled = by_status.get('cancelled')
+            if cancelled:
+                # A claimed payment is being charged right now; PaymentQueue.complete() flags it for refund
+                Payment.objects.filter(order_id__in=cancelled, status='pending', next_attempt_at__lte=now).update(
+                    status='failed', last_error='Order cancelled', updated_at=now
+                )
+                self.report.refunds_due += Payment.objects.filter(order_id__in=cancelled, status='completed').update(
+                    status='refund_due', last_error='Order cancelled after payment', updated_at=now
+                )
+                CheckoutService.return_stock(cancelled)
@@ -1,10 +1,33 @@
-from django.test import TestCase, Client
+import io
+import multiprocessing
+import os
+import random
+import re
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.contrib import admin
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
 from django.urls import reverse
 from django.utils import timezone
 
+from .cart import CartStore
+from .checkout import CheckoutError, CheckoutService, InsufficientStock
+from .context_processors import cart_summary
 from .models import CartItem, Order, OrderItem, OrderStatus, Payment
+from .payments import LocalGateway, PaymentDeclined, PaymentQueue, TransientPaymentError
+from .reservations import StockReservations
+from .status import OrderStatusTransitions
+from .utils import OrderNumberGenerator, hostname_hash
 from apps.products.models import Category, Product
+from apps.products.managers import DatabaseOptimizer
 
 User = get_user_model()
 
@@ -121,6 +144,7 @@ class OrdersModelTests(TestCase):
 
 class OrdersViewTests(TestCase):
     def setUp(self):
+        CartStore.client().flushdb()
         self.client = Client()
         self.user = User.objects.create_user(
             username='testuser',
@@ -161,7 +185,8 @@ class OrdersViewTests(TestCase):
             'quantity': 2
         })
         self.assertEqual(response.status_code, 302)  # Redirect after successful addition
-        self.assertTrue(CartItem.objects.filter(user=self.user, product=self.product).exists())
+        self.assertEqual([(line.product_id, line.quantity) for line in CartStore.get_lines(self.user.pk)],
+                         [(self.product.id, 2)])
     
     def test_update_cart_item_view_authenticated_post(self):
         """Test that an authenticated user can update cart items"""
@@ -171,12 +196,11 @@ class OrdersViewTests(TestCase):
             quantity=1
         )
         self.client.login(email='test@example.com', password='testpass123')
-        response = self.client.post(reverse('orders:update_cart_item', args=[cart_item.id]), {
+        response = self.client.post(reverse('orders:update_cart_item', args=[self.product.id]), {
             'quantity': 3
         })
         self.assertEqual(response.status_code, 302)  # Redirect after successful update
-        cart_item.refresh_from_db()
-        self.assertEqual(cart_item.quantity, 3)
+        self.assertEqual([line.quantity for line in CartStore.get_lines(self.user.pk)], [3])
     
     def test_remove_from_cart_view_authenticated_post(self):
         """Test that an authenticated user can remove items from cart"""
@@ -186,8 +210,10 @@ class OrdersViewTests(TestCase):
             quantity=1
         )
         self.client.login(email='test@example.com', password='testpass123')
-        response = self.client.post(reverse('orders:remove_from_cart', args=[cart_item.id]))
+        response = self.client.post(reverse('orders:remove_from_cart', args=[self.product.id]))
         self.assertEqual(response.status_code, 302)  # Redirect after successful removal
+        self.assertEqual(CartStore.get_lines(self.user.pk), [])
+        CartStore.flush(delay=0)
         self.assertFalse(CartItem.objects.filter(id=cart_item.id).exists())
     
     def test_checkout_view_authenticated_with_items(self):
@@ -236,3 +262,883 @@ class OrdersViewTests(TestCase):
         response = self.client.get(reverse('orders:order_detail', args=[order.id]))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Order Details')
+
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        CartStore.client().flushdb()
+        self.buyer = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            phone='',
+            password='testpass123'
+        )
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.category = Category.objects.create(name='Skincare')
+        self.serum = self.create_product('Serum', '30.00', 5)
+        self.toner = self.create_product('Toner', '12.50', 2)
+    
+    def create_product(self, name, price, quantity):
+        return Product.objects.create(
+            seller=self.seller,
+            category=self.category,
+            name=name,
+            description='Test description',
+            price=Decimal(price),
+            quantity=quantity
+        )
+    
+    def test_checkout_creates_order_and_takes_stock(self):
+        """Test that checkout writes the order in bulk, decrements stock and empties the cart"""
+        CartItem.objects.create(user=self.buyer, product=self.toner, quantity=2)
+        CartItem.objects.create(user=self.buyer, product=self.serum, quantity=3)
+        
+        # Two queries load the saved cart into the cart store and one starts the stock counters
+        with self.assertNumQueries(14):
+            order = CheckoutService.place_order(self.buyer, '1 Test Street')
+        
+        self.assertEqual(order.total_amount, Decimal('115.00'))
+        self.assertEqual(OrderNumberGenerator.decode(order.order_number)[2], os.getpid())
+        self.assertEqual(
+            list(order.items.order_by('product_id').values_list('product_id', 'quantity', 'total_price')),
+            [(self.serum.id, 3, Decimal('90.00')), (self.toner.id, 2, Decimal('25.00'))]
+        )
+        self.assertEqual(list(order.status_history.values_list('status', flat=True)), ['pending'])
+        self.assertEqual(
+            dict(Product.objects.values_list('name', 'quantity')), {'Serum': 2, 'Toner': 0}
+        )
+        self.assertFalse(CartItem.objects.filter(user=self.buyer).exists())
+    
+    def test_shortage_rolls_back_the_whole_order(self):
+        """Test that one short line leaves stock, cart and orders untouched"""
+        CartItem.objects.create(user=self.buyer, product=self.serum, quantity=1)
+        CartItem.objects.create(user=self.buyer, product=self.toner, quantity=3)
+        
+        with self.assertRaises(InsufficientStock) as raised:
+            CheckoutService.place_order(self.buyer, '1 Test Street')
+        
+        self.assertEqual([(p.name, requested, available) for p, requested, available in raised.exception.shortages],
+                         [('Toner', 3, 2)])
+        self.assertIn('Toner (only 2 left)', str(raised.exception))
+        self.assertEqual(dict(Product.objects.values_list('name', 'quantity')), {'Serum': 5, 'Toner': 2})
+        self.assertEqual(CartItem.objects.filter(user=self.buyer).count(), 2)
+        self.assertFalse(Order.objects.exists())
+    
+    def test_inactive_products_cannot_be_bought(self):
+        """Test that products taken off sale since they were added to the cart fail checkout"""
+        CartItem.objects.create(user=self.buyer, product=self.serum, quantity=1)
+        self.serum.is_active = False
+        self.serum.save()
+        
+        with self.assertRaises(InsufficientStock):
+            CheckoutService.place_order(self.buyer, '1 Test Street')
+        with self.assertRaisesMessage(CheckoutError, 'Your cart is empty.'):
+            CheckoutService.place_order(self.seller, '1 Test Street')
+    
+    def test_checkout_view_reports_shortages(self):
+        """Test that the checkout view sends the buyer back to the cart on a shortage"""
+        CartItem.objects.create(user=self.buyer, product=self.toner, quantity=5)
+        self.client.force_login(self.buyer)
+        response = self.client.post(reverse('orders:process_checkout'), {'delivery_address': '1 Test Street'})
+        self.assertRedirects(response, reverse('orders:cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    """
+    Many buyers check out the last units of one product at the same time
+    
+    Runs on every backend: PostgreSQL queues the writers on the product's row
+    lock and SQLite on its database write lock, which the test settings keep
+    in a file so other threads wait for it instead of failing.
+    """
+    
+    BUYERS = 12
+    STOCK = 5
+    
+    def setUp(self):
+        CartStore.client().flushdb()
+        seller = User.objects.create_user(
+            username='testseller', email='seller@example.com', phone='', password='testpass123', user_type='seller'
+        )
+        self.product = Product.objects.create(
+            seller=seller,
+            category=Category.objects.create(name='Skincare'),
+            name='Limited Serum',
+            description='Test description',
+            price=Decimal('30.00'),
+            quantity=self.STOCK
+        )
+    
+    def run_at_once(self, target, count):
+        """Run target(i) for i in range(count) on that many threads released together"""
+        start = threading.Barrier(count)
+        
+        def run(i):
+            try:
+                start.wait()
+                target(i)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    
+    def test_conditional_decrements_never_oversell(self):
+        """Test that concurrent stock decrements, with no holds in front of them, take exactly the stock there is"""
+        outcomes = []
+        
+        def take_one(i):
+            try:
+                with transaction.atomic():
+                    CheckoutService.take_stock({self.product.pk: 1})
+                outcomes.append('taken')
+            except InsufficientStock:
+                outcomes.append('sold out')
+            except Exception as e:
+                outcomes.append(repr(e))
+        
+        self.run_at_once(take_one, self.BUYERS)
+        
+        self.assertEqual(sorted(outcomes), ['sold out'] * (self.BUYERS - self.STOCK) + ['taken'] * self.STOCK)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 0)
+    
+    def test_concurrent_checkouts_never_oversell(self):
+        """Test that concurrent checkouts of one product sell exactly the stock there is"""
+        product = self.product
+        buyers = [
+            User.objects.create_user(username=f'buyer{i}', email=f'buyer{i}@example.com', phone='')
+            for i in range(self.BUYERS)
+        ]
+        CartItem.objects.bulk_create([CartItem(user=buyer, product=product, quantity=1) for buyer in buyers])
+        
+        outcomes = []
+        
+        def checkout(i):
+            try:
+                CheckoutService.place_order(buyers[i], '1 Test Street')
+                outcomes.append('ordered')
+            except InsufficientStock:
+                outcomes.append('sold out')
+            except Exception as e:
+                outcomes.append(repr(e))
+        
+        # Payments are charged by the queue's workers, not by the buyers' threads
+        with override_settings(PAYMENT_QUEUE_ASYNC=True), mock.patch.object(PaymentQueue, '_pool'):
+            self.run_at_once(checkout, self.BUYERS)
+        
+        self.assertEqual(sorted(outcomes), ['ordered'] * self.STOCK + ['sold out'] * (self.BUYERS - self.STOCK))
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 0)
+        self.assertEqual(OrderItem.objects.filter(product=product).count(), self.STOCK)
+        self.assertEqual(CartItem.objects.count(), self.BUYERS - self.STOCK)
+
+
+class CartStoreTests(TestCase):
+    def setUp(self):
+        CartStore.client().flushdb()
+        self.buyer = User.objects.create_user(
+            username='testuser', email='test@example.com', phone='', password='testpass123'
+        )
+        seller = User.objects.create_user(
+            username='testseller', email='seller@example.com', phone='', password='testpass123', user_type='seller'
+        )
+        category = Category.objects.create(name='Skincare')
+        self.serum, self.toner = [
+            Product.objects.create(
+                seller=seller, category=category, name=name, description='Test description',
+                price=Decimal(price), quantity=50
+            )
+            for name, price in (('Serum', '30.00'), ('Toner', '12.50'))
+        ]
+    
+    def add(self, user, product, quantity=1):
+        return CartStore.add(user.pk, Product.objects.with_card_data().get(pk=product.pk), quantity)
+    
+    def test_concurrent_adds_keep_every_unit(self):
+        """Test that adds racing on one cart line never lose units"""
+        serum = Product.objects.with_card_data().get(pk=self.serum.pk)
+        CartStore.get_lines(self.buyer.pk)  # Load the (empty) saved cart before the threads start
+        
+        def add_units():
+            for _ in range(25):
+                CartStore.add(self.buyer.pk, serum)
+        
+        threads = [threading.Thread(target=add_units) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual([line.quantity for line in CartStore.get_lines(self.buyer.pk)], [200])
+    
+    def test_cart_renders_from_snapshots(self):
+        """Test that reading a cart takes no database queries and shows the price it was added at"""
+        self.add(self.buyer, self.serum, 2)
+        Product.objects.filter(pk=self.serum.pk).update(price=Decimal('35.00'))
+        
+        with self.assertNumQueries(0):
+            lines = CartStore.get_lines(self.buyer.pk)
+        self.assertEqual([(line.name, line.price, line.category, line.total_price()) for line in lines],
+                         [('Serum', Decimal('30.00'), 'Skincare', Decimal('60.00'))])
+        self.assertEqual([line.price for line in CartStore.refresh(self.buyer.pk, lines)], [Decimal('35.00')])
+    
+    def test_flush_writes_only_carts_that_persist(self):
+        """Test that carts are saved after the write-behind delay, and checked out or emptied ones never are"""
+        shopper = User.objects.create_user(username='shopper', email='shopper@example.com', phone='')
+        quitter = User.objects.create_user(username='quitter', email='quitter@example.com', phone='')
+        self.add(shopper, self.serum, 2)
+        self.add(shopper, self.toner)
+        self.add(quitter, self.toner)
+        CartStore.clear(quitter.pk)
+        self.add(self.buyer, self.serum)
+        with self.captureOnCommitCallbacks(execute=True):
+            CheckoutService.place_order(self.buyer, '1 Test Street')
+        
+        self.assertEqual(CartStore.flush(delay=60), 0)
+        self.assertFalse(CartItem.objects.exists())
+        
+        CartStore.flush(delay=0)
+        self.assertEqual(
+            sorted(CartItem.objects.values_list('user_id', 'product_id', 'quantity')),
+            [(shopper.pk, self.serum.pk, 2), (shopper.pk, self.toner.pk, 1)]
+        )
+        
+        CartStore.set_quantity(shopper.pk, self.serum.pk, 0)
+        self.assertEqual(CartStore.flush(delay=0), 1)
+        self.assertEqual(list(CartItem.objects.values_list('product_id', flat=True)), [self.toner.pk])
+    
+    def test_cart_missing_from_the_store_is_loaded_from_the_database(self):
+        """Test that a cart lost from the store comes back from CartItem, duplicate rows merged"""
+        CartItem.objects.create(user=self.buyer, product=self.serum, quantity=1)
+        CartItem.objects.create(user=self.buyer, product=self.serum, quantity=2)
+        CartItem.objects.create(user=self.buyer, product=self.toner, quantity=1)
+        
+        self.add(self.buyer, self.toner)
+        lines = {line.name: line.quantity for line in CartStore.get_lines(self.buyer.pk)}
+        self.assertEqual(lines, {'Serum': 3, 'Toner': 2})
+        
+        CartStore.flush(delay=0)
+        self.assertEqual(
+            sorted(CartItem.objects.values_list('product_id', 'quantity')), [(self.serum.pk, 3), (self.toner.pk, 2)]
+        )
+    
+    def test_second_checkout_is_turned_away(self):
+        """Test that a checkout started while another holds the cart fails instead of ordering twice"""
+        self.add(self.buyer, self.serum)
+        
+        with CartStore.checkout_lock(self.buyer.pk) as locked:
+            self.assertTrue(locked)
+            with self.assertRaisesMessage(CheckoutError, 'Your order is already being placed.'):
+                CheckoutService.place_order(self.buyer, '1 Test Street')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            CheckoutService.place_order(self.buyer, '1 Test Street')
+        self.assertEqual(CartStore.get_lines(self.buyer.pk), [])
+        self.assertEqual(Order.objects.count(), 1)
+    
+    def test_summary_of_a_saved_cart_takes_one_query_then_none(self):
+        """Test that an unloaded cart is summarized in one aggregate query and then served from the store"""
+        CartItem.objects.create(user=self.buyer, product=self.serum, quantity=2)
+        CartItem.objects.create(user=self.buyer, product=self.toner, quantity=3)
+        
+        with self.assertNumQueries(1):
+            summary = CartStore.summary(self.buyer.pk)
+        self.assertEqual((summary.subtotal, summary.line_count, summary.item_count), (Decimal('97.50'), 2, 5))
+        with self.assertNumQueries(0):
+            summary = CartStore.summary(self.buyer.pk)
+        self.assertEqual((summary.subtotal, summary.line_count, summary.item_count), (Decimal('97.50'), 2, 5))
+    
+    def test_cart_changes_outdate_the_summary(self):
+        """Test that every kind of cart change is reflected in the next summary"""
+        self.add(self.buyer, self.serum)
+        self.assertEqual(CartStore.summary(self.buyer.pk).item_count, 1)
+        
+        self.add(self.buyer, self.toner, 2)
+        summary = CartStore.summary(self.buyer.pk)
+        self.assertEqual((summary.subtotal, summary.line_count, summary.item_count), (Decimal('55.00'), 2, 3))
+        
+        CartStore.set_quantity(self.buyer.pk, self.toner.pk, 0)
+        self.assertEqual(CartStore.summary(self.buyer.pk).subtotal, Decimal('30.00'))
+        
+        CartStore.clear(self.buyer.pk)
+        summary = CartStore.summary(self.buyer.pk)
+        self.assertEqual((summary.subtotal, summary.line_count, summary.item_count), (Decimal('0'), 0, 0))
+    
+    def test_context_processor_reads_the_cached_summary(self):
+        """Test that the header cart summary costs no queries once cached, and nothing for anonymous users"""
+        self.add(self.buyer, self.serum, 4)
+        CartStore.summary(self.buyer.pk)
+        request = RequestFactory().get('/')
+        
+        request.user = self.buyer
+        with self.assertNumQueries(0):
+            self.assertEqual(cart_summary(request)['cart_summary'].item_count, 4)
+        
+        request.user = AnonymousUser()
+        self.assertEqual(cart_summary(request), {})
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        CartStore.client().flushdb()
+        self.buyer = User.objects.create_user(
+            username='testuser', email='test@example.com', phone='', password='testpass123'
+        )
+        seller = User.objects.create_user(
+            username='testseller', email='seller@example.com', phone='', password='testpass123', user_type='seller'
+        )
+        self.product = Product.objects.create(
+            seller=seller,
+            category=Category.objects.create(name='Skincare'),
+            name='Limited Serum',
+            description='Test description',
+            price=Decimal('30.00'),
+            quantity=10
+        )
+    
+    def free_units(self):
+        return int(CartStore.client().get(StockReservations.counter_key(self.product.pk)))
+    
+    def test_racing_holds_never_oversell(self):
+        """Test that many buyers holding the last units at once get exactly the stock there is"""
+        self.assertEqual(StockReservations.hold(1000, {self.product.pk: 1}), {})
+        start = threading.Barrier(40)
+        outcomes = []
+        
+        def hold(user_id):
+            start.wait()
+            outcomes.append(StockReservations.hold(user_id, {self.product.pk: 1}))
+        
+        threads = [threading.Thread(target=hold, args=(user_id,)) for user_id in range(1001, 1041)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(outcomes.count({}), 9)
+        self.assertEqual(outcomes.count({self.product.pk: 0}), 31)
+        self.assertEqual(self.free_units(), 0)
+    
+    def test_holds_are_topped_up_and_given_back(self):
+        """Test that holds follow the cart quantity, and lapsed holds return their units"""
+        StockReservations.hold(self.buyer.pk, {self.product.pk: 3})
+        StockReservations.hold(self.buyer.pk, {self.product.pk: 5})
+        self.assertEqual(self.free_units(), 5)
+        self.assertEqual(StockReservations.hold(self.buyer.pk, {self.product.pk: 12}), {self.product.pk: 10})
+        StockReservations.hold(self.buyer.pk, {self.product.pk: 2})
+        self.assertEqual(self.free_units(), 8)
+        
+        self.assertEqual(StockReservations.reconcile(), (0, 0))
+        with mock.patch('apps.orders.reservations.time.time', return_value=time.time() + 3600):
+            self.assertEqual(StockReservations.reconcile(), (1, 0))
+        self.assertEqual(self.free_units(), 10)
+    
+    def test_checkout_turns_holds_into_sales(self):
+        """Test that a checkout sells its held units and leaves the counter in step with the database"""
+        CartStore.add(self.buyer.pk, Product.objects.with_card_data().get(pk=self.product.pk), 4)
+        StockReservations.hold(self.buyer.pk, {self.product.pk: 4})
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            CheckoutService.place_order(self.buyer, '1 Test Street')
+        
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 6)
+        self.assertEqual(self.free_units(), 6)
+        self.assertEqual(CartStore.client().hgetall(StockReservations.holds_key(self.buyer.pk)),
+                         {str(self.product.pk): '0'})
+        self.assertEqual(StockReservations.reconcile(), (0, 0))
+    
+    def test_sold_out_checkout_is_turned_away_before_the_order_transaction(self):
+        """Test that a buyer who cannot hold units fails without locking the product row"""
+        StockReservations.hold(1000, {self.product.pk: 9})
+        CartStore.add(self.buyer.pk, Product.objects.with_card_data().get(pk=self.product.pk), 2)
+        
+        # The cart is already in the store; the one query names the product in the error
+        with self.assertNumQueries(1):
+            with self.assertRaises(InsufficientStock) as raised:
+                CheckoutService.place_order(self.buyer, '1 Test Street')
+        self.assertIn('Limited Serum (only 1 left)', str(raised.exception))
+    
+    def test_stock_changes_resync_the_counter(self):
+        """Test that restocks through the model resync at once and other changes at the next reconcile"""
+        StockReservations.hold(self.buyer.pk, {self.product.pk: 4})
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.quantity = 20
+            self.product.save()
+        self.assertEqual(self.free_units(), 16)
+        
+        Product.objects.filter(pk=self.product.pk).update(is_active=False)
+        self.assertEqual(StockReservations.reconcile(), (0, 1))
+        self.assertEqual(self.free_units(), -4)
+        self.assertEqual(StockReservations.hold(1000, {self.product.pk: 1}), {self.product.pk: 0})
+    
+    def test_add_to_cart_refuses_units_that_cannot_be_held(self):
+        """Test that adding more than can be held leaves the cart as it was"""
+        StockReservations.hold(1000, {self.product.pk: 8})
+        self.client.force_login(self.buyer)
+        
+        self.client.post(reverse('orders:add_to_cart'), {'product_id': self.product.pk, 'quantity': 2})
+        response = self.client.post(reverse('orders:add_to_cart'), {'product_id': self.product.pk, 'quantity': 1},
+                                    follow=True)
+        
+        self.assertContains(response, 'only 2 of Limited Serum are available')
+        self.assertEqual([line.quantity for line in CartStore.get_lines(self.buyer.pk)], [2])
+
+
+class PaymentQueueTests(TestCase):
+    def setUp(self):
+        CartStore.client().flushdb()
+        LocalGateway.reset()
+        self.buyer = User.objects.create_user(
+            username='testuser', email='test@example.com', phone='', password='testpass123'
+        )
+        seller = User.objects.create_user(
+            username='testseller', email='seller@example.com', phone='', password='testpass123', user_type='seller'
+        )
+        self.product = Product.objects.create(
+            seller=seller,
+            category=Category.objects.create(name='Skincare'),
+            name='Serum',
+            description='Test description',
+            price=Decimal('30.00'),
+            quantity=10
+        )
+        CartStore.add(self.buyer.pk, Product.objects.with_card_data().get(pk=self.product.pk), 2)
+    
+    def place_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = CheckoutService.place_order(self.buyer, '1 Test Street', 'paypal')
+        return order, Payment.objects.get(order=order)
+    
+    def make_due(self, payment):
+        Payment.objects.filter(pk=payment.pk).update(next_attempt_at=timezone.now())
+    
+    def test_checkout_queues_the_payment_instead_of_charging_it(self):
+        """Test that checkout returns with a pending payment that a worker then charges"""
+        with override_settings(PAYMENT_QUEUE_ASYNC=True), mock.patch.object(PaymentQueue, '_pool') as pool:
+            order, payment = self.place_order()
+        pool.return_value.submit.assert_called_once_with(PaymentQueue._process_in_thread, payment.pk)
+        self.assertEqual((order.status, payment.status, payment.payment_method), ('pending', 'pending', 'paypal'))
+        self.assertEqual(payment.amount, Decimal('60.00'))
+        
+        self.assertEqual(PaymentQueue.process(payment.pk), 'completed')
+        self.assertIsNone(PaymentQueue.process(payment.pk))
+        payment.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual(payment.transaction_id, LocalGateway.charges()[payment.idempotency_key])
+        self.assertEqual(order.status, 'processing')
+        self.assertEqual(list(order.status_history.order_by('id').values_list('status', flat=True)),
+                         ['pending', 'processing'])
+    
+    def test_transient_failures_are_retried_under_one_idempotency_key(self):
+        """Test that failed attempts wait for their retry and the eventual charge is taken once"""
+        LocalGateway.script(TransientPaymentError('gateway timeout'), TransientPaymentError('gateway timeout'))
+        order, payment = self.place_order()
+        
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.attempts, payment.last_error), ('pending', 1, 'gateway timeout'))
+        self.assertGreater(payment.next_attempt_at, timezone.now())
+        self.assertIsNone(PaymentQueue.process(payment.pk))  # Not due yet
+        
+        self.make_due(payment)
+        self.assertEqual(PaymentQueue.process(payment.pk), 'pending')
+        self.make_due(payment)
+        self.assertEqual(PaymentQueue.process(payment.pk), 'completed')
+        
+        payment.refresh_from_db()
+        self.assertEqual(payment.attempts, 3)
+        self.assertEqual(LocalGateway.charges(), {payment.idempotency_key: payment.transaction_id})
+        self.assertEqual(PaymentQueue.gateway().charge(payment), payment.transaction_id)
+    
+    def test_declined_payment_cancels_the_order_and_returns_stock(self):
+        """Test that a declined payment cancels its order and puts the units back on sale"""
+        LocalGateway.script(PaymentDeclined('card declined'))
+        order, payment = self.place_order()
+        
+        payment.refresh_from_db()
+        order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((payment.status, payment.last_error), ('failed', 'card declined'))
+        self.assertEqual(order.status, 'cancelled')
+        self.assertEqual(order.status_history.order_by('id').last().notes, 'Payment failed: card declined')
+        self.assertEqual(self.product.quantity, 10)
+        self.assertEqual(CartStore.client().get(StockReservations.counter_key(self.product.pk)), '10')
+    
+    def test_payment_fails_after_its_last_attempt(self):
+        """Test that a payment out of attempts fails instead of retrying forever"""
+        LocalGateway.script(TransientPaymentError('gateway timeout'), TransientPaymentError('gateway timeout'))
+        with override_settings(PAYMENT_MAX_ATTEMPTS=2):
+            order, payment = self.place_order()
+            self.make_due(payment)
+            self.assertEqual(PaymentQueue.process(payment.pk), 'failed')
+        
+        payment.refresh_from_db()
+        self.assertEqual(payment.last_error, 'Gave up after 2 attempts: gateway timeout')
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'cancelled')
+    
+    def test_gateway_must_be_configured(self):
+        """Test that payments are never charged through a gateway nobody configured"""
+        with override_settings(PAYMENT_GATEWAY=None), self.assertRaises(ImproperlyConfigured):
+            PaymentQueue.gateway()
+    
+    @override_settings(PAYMENT_RETRY_BASE_DELAY=2, PAYMENT_RETRY_MAX_DELAY=10)
+    def test_retry_delay_doubles_up_to_the_cap(self):
+        """Test that retries back off exponentially, with jitter below the cap"""
+        with mock.patch('apps.orders.payments.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([PaymentQueue.retry_delay(attempts) for attempts in range(1, 6)], [2, 4, 8, 10, 10])
+        self.assertTrue(5 <= PaymentQueue.retry_delay(4) <= 10)
+    
+    def test_order_page_polls_the_payment_status(self):
+        """Test that the order page shows a pending payment and its status endpoint reports progress"""
+        with override_settings(PAYMENT_QUEUE_ASYNC=True), mock.patch.object(PaymentQueue, '_pool'):
+            order, payment = self.place_order()
+        self.client.force_login(self.buyer)
+        
+        response = self.client.get(reverse('orders:order_detail', args=[order.id]))
+        self.assertContains(response, reverse('orders:order_status', args=[order.id]))
+        self.assertEqual(self.client.get(reverse('orders:order_status', args=[order.id])).json()['payment_status'],
+                         'pending')
+        
+        PaymentQueue.process(payment.pk)
+        self.assertEqual(
+            self.client.get(reverse('orders:order_status', args=[order.id])).json(),
+            {'status': 'processing', 'status_display': 'Processing', 'payment_status': 'completed'}
+        )
+        self.client.force_login(User.objects.get(username='testseller'))
+        self.assertEqual(self.client.get(reverse('orders:order_status', args=[order.id])).status_code, 404)
+    
+    def test_command_counts_orders_cancelled_during_the_charge(self):
+        """Test that process_payments flags a charge for refund when its order is cancelled mid-charge and carries on"""
+        with override_settings(PAYMENT_QUEUE_ASYNC=True), mock.patch.object(PaymentQueue, '_pool'):
+            cancelled, cancelled_payment = self.place_order()
+            CartStore.add(self.buyer.pk, Product.objects.with_card_data().get(pk=self.product.pk), 1)
+            order, payment = self.place_order()
+        self.make_due(cancelled_payment)
+        self.make_due(payment)  # Due after the cancelled one, so the command must carry on past it
+        
+        charge = LocalGateway.charge
+        
+        def cancel_then_charge(gateway, payment):
+            if payment.pk == cancelled_payment.pk:
+                Order.objects.filter(pk=cancelled.pk).update(status='cancelled')
+            return charge(gateway, payment)
+        
+        out = io.StringIO()
+        with mock.patch.object(LocalGateway, 'charge', cancel_then_charge):
+            call_command('process_payments', stdout=out)
+        
+        self.assertIn('Completed 1 payments', out.getvalue())
+        self.assertIn('1 charged after cancellation need a refund', out.getvalue())
+        cancelled_payment.refresh_from_db()
+        payment.refresh_from_db()
+        self.assertEqual(cancelled_payment.status, 'refund_due')
+        self.assertEqual(cancelled_payment.transaction_id, LocalGateway.charges()[cancelled_payment.idempotency_key])
+        self.assertEqual(payment.status, 'completed')
+
+
+class OrderStatusTransitionTests(TestCase):
+    def setUp(self):
+        CartStore.client().flushdb()
+        self.buyer = User.objects.create_user(
+            username='testuser', email='test@example.com', phone='', password='testpass123'
+        )
+        seller = User.objects.create_user(
+            username='testseller', email='seller@example.com', phone='', password='testpass123', user_type='seller'
+        )
+        self.product = Product.objects.create(
+            seller=seller,
+            category=Category.objects.create(name='Skincare'),
+            name='Serum',
+            description='Test description',
+            price=Decimal('30.00'),
+            quantity=10
+        )
+    
+    def create_order(self, order_number, status='pending', quantity=1):
+        order = Order.objects.create(
+            user=self.buyer,
+            order_number=order_number,
+            total_amount=self.product.price * quantity,
+            delivery_address='1 Test Street',
+            status=status
+        )
+        OrderItem.objects.create(
+            order=order,
+            product=self.product,
+            quantity=quantity,
+            unit_price=self.product.price,
+            total_price=self.product.price * quantity
+        )
+        Payment.objects.create(
+            order=order, payment_method='credit_card', amount=order.total_amount,
+            idempotency_key=f'{order_number}-payment'
+        )
+        return order
+    
+    def statuses(self):
+        return dict(Order.objects.values_list('order_number', 'status'))
+    
+    def test_each_status_is_applied_with_one_update(self):
+        """Test that a batch locks its orders once, updates once per status and writes history in one insert"""
+        for number in range(1, 5):
+            self.create_order(f'ORD-{number}', status='processing' if number > 2 else 'pending')
+        rows = [(1, 'ORD-1', 'processing'), (2, 'ORD-2', 'processing'), (3, 'ORD-3', 'shipped'), (4, 'ORD-4', 'shipped')]
+        
+        # Savepoint, select for update, one update per status, history insert, release
+        with self.assertNumQueries(6):
+            report = OrderStatusTransitions(notes='Courier pickup').run(rows)
+        
+        self.assertEqual(report.updated, {'processing': 2, 'shipped': 2})
+        self.assertEqual(self.statuses(), {'ORD-1': 'processing', 'ORD-2': 'processing',
+                                           'ORD-3': 'shipped', 'ORD-4': 'shipped'})
+        self.assertEqual(OrderStatus.objects.filter(notes='Courier pickup').count(), 4)
+    
+    def test_invalid_rows_are_rejected_and_the_rest_applied(self):
+        """Test that unknown orders, unknown statuses and disallowed transitions only reject their own row"""
+        self.create_order('ORD-1')
+        self.create_order('ORD-2', status='delivered')
+        self.create_order('ORD-3', status='shipped')
+        
+        report = OrderStatusTransitions().run([
+            (1, 'ORD-1', 'processing'),
+            (2, 'ORD-1', 'shipped'),  # Starts from processing, set by the row above
+            (3, 'ORD-2', 'pending'),
+            (4, 'ORD-3', 'shipped'),
+            (5, 'ORD-9', 'shipped'),
+            (6, 'ORD-3', 'lost'),
+        ])
+        
+        self.assertEqual(report.updated, {'shipped': 1})
+        self.assertEqual(report.unchanged, 1)
+        self.assertEqual(report.errors, [
+            (3, 'ORD-2 cannot go from delivered to pending'),
+            (5, 'unknown order "ORD-9"'),
+            (6, 'unknown status "lost"'),
+        ])
+        self.assertEqual(self.statuses(), {'ORD-1': 'shipped', 'ORD-2': 'delivered', 'ORD-3': 'shipped'})
+        self.assertEqual(list(OrderStatus.objects.order_by('id').values_list('status', flat=True)),
+                         ['processing', 'shipped'])
+    
+    def test_rows_are_applied_in_batches(self):
+        """Test that a long input is read a batch at a time and every order gets its updated_at"""
+        for number in range(7):
+            self.create_order(f'ORD-{number}')
+        Order.objects.update(updated_at=timezone.now() - timezone.timedelta(days=1))
+        rows = ((number, f'ORD-{number}', 'processing') for number in range(7))
+        
+        transitions = OrderStatusTransitions(batch_size=3, max_errors=1)
+        with mock.patch.object(transitions, '_apply_batch', wraps=transitions._apply_batch) as apply_batch:
+            report = transitions.run(rows)
+        
+        self.assertEqual([len(call.args[0]) for call in apply_batch.call_args_list], [3, 3, 1])
+        self.assertEqual(report.updated, {'processing': 7})
+        self.assertFalse(Order.objects.filter(updated_at__lt=timezone.now() - timezone.timedelta(hours=1)).exists())
+    
+    def test_cancelling_returns_stock_and_stops_the_payment(self):
+        """Test that cancelled orders give their units back and their pending payments are never charged"""
+        self.create_order('ORD-1', quantity=2)
+        self.create_order('ORD-2', quantity=3)
+        shipped = self.create_order('ORD-3', status='shipped', quantity=4)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            report = OrderStatusTransitions().run([
+                (1, 'ORD-1', 'cancelled'), (2, 'ORD-2', 'cancelled'), (3, 'ORD-3', 'cancelled')
+            ])
+        
+        self.assertEqual(report.updated, {'cancelled': 2})
+        self.assertEqual(report.rows_failed, 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 15)
+        self.assertEqual(
+            list(Payment.objects.order_by('id').values_list('status', 'last_error')),
+            [('failed', 'Order cancelled'), ('failed', 'Order cancelled'), ('pending', '')]
+        )
+        self.assertIsNone(PaymentQueue.process(Payment.objects.get(order__order_number='ORD-1').pk))
+        self.assertEqual(Order.objects.get(pk=shipped.pk).status, 'shipped')
+    
+    def test_cancelling_a_paid_order_flags_its_refund(self):
+        """Test that cancelling an order that was already paid marks its payment for refund"""
+        order = self.create_order('ORD-1', status='processing')
+        Payment.objects.filter(order=order).update(status='completed', transaction_id='local_1')
+        
+        report = OrderStatusTransitions().run([(1, 'ORD-1', 'cancelled')])
+        
+        self.assertEqual(report.refunds_due, 1)
+        payment = Payment.objects.get(order=order)
+        self.assertEqual((payment.status, payment.transaction_id), ('refund_due', 'local_1'))
+    
+    def test_payment_charged_during_cancellation_is_flagged_for_refund(self):
+        """Test that a payment claimed by a worker survives cancellation and keeps its charge for the refund"""
+        LocalGateway.reset()
+        order = self.create_order('ORD-1')
+        payment = Payment.objects.get(order=order)
+        Payment.objects.filter(pk=payment.pk).update(
+            attempts=1, next_attempt_at=timezone.now() + timezone.timedelta(seconds=60)
+        )
+        
+        OrderStatusTransitions().run([(1, 'ORD-1', 'cancelled')])
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'pending')
+        
+        self.assertEqual(PaymentQueue.complete(payment, 'local_1'), 'refund_due')
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.transaction_id), ('refund_due', 'local_1'))
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'cancelled')
+    
+    def test_payment_due_for_retry_is_not_charged_after_cancellation(self):
+        """Test that a payment waiting for its retry is failed, not charged, once its order is cancelled"""
+        LocalGateway.reset()
+        order = self.create_order('ORD-1')
+        payment = Payment.objects.get(order=order)
+        Payment.objects.filter(pk=payment.pk).update(next_attempt_at=timezone.now() + timezone.timedelta(seconds=60))
+        OrderStatusTransitions().run([(1, 'ORD-1', 'cancelled')])
+        
+        Payment.objects.filter(pk=payment.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(PaymentQueue.process(payment.pk), 'failed')
+        self.assertEqual(LocalGateway.charges(), {})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 11)  # Returned once, by the cancellation
+    
+    def test_file_rows_are_streamed_from_csv(self):
+        """Test that an uploaded CSV is read row by row and unreadable rows are reported by line"""
+        self.create_order('ORD-1')
+        self.create_order('ORD-2')
+        upload = io.BytesIO(b'order_number,status\nORD-1,Processing\n,shipped\nORD-2,cancelled\n')
+        
+        report = OrderStatusTransitions().run_file(upload, 'csv')
+        
+        self.assertEqual(report.updated, {'processing': 1, 'cancelled': 1})
+        self.assertEqual(report.errors, [(3, 'order_number is required')])
+    
+    def test_admin_action_marks_the_selected_orders(self):
+        """Test that the Django admin action moves the selected orders and reports what it could not move"""
+        self.create_order('ORD-1', status='processing')
+        self.create_order('ORD-2', status='processing')
+        self.create_order('ORD-3')
+        request = RequestFactory().post('/admin/orders/order/')
+        request.user = User.objects.create_user(
+            username='adminuser', email='admin@example.com', phone='', password='testpass123',
+            is_staff=True, is_superuser=True
+        )
+        order_admin = admin.site._registry[Order]
+        action = order_admin.get_actions(request)['mark_shipped'][0]
+        
+        with mock.patch.object(order_admin, 'message_user') as message_user:
+            action(order_admin, request, Order.objects.all())
+        
+        self.assertEqual(self.statuses(), {'ORD-1': 'shipped', 'ORD-2': 'shipped', 'ORD-3': 'pending'})
+        self.assertEqual([call.args[1] for call in message_user.call_args_list], [
+            '2 orders marked shipped.', '1 orders cannot be marked shipped from their current status.'
+        ])
+        self.assertEqual(OrderStatus.objects.filter(notes='Marked shipped by adminuser').count(), 2)
+
+
+def generate_order_numbers(count):
+    return [OrderNumberGenerator.generate() for _ in range(count)]
+
+
+class OrderNumberTests(TestCase):
+    ORDER_NUMBER_RE = re.compile(r'^ORD(-[0-9A-HJKMNP-TV-Z]{6}){3}$')
+    
+    def test_order_numbers_are_readable_and_decode(self):
+        """Test that order numbers use unambiguous characters and decode to when and where they were made"""
+        before = timezone.now()
+        with self.settings(ORDER_NUMBER_HOST_ID=513):
+            order_number = OrderNumberGenerator.generate()
+        self.assertRegex(order_number, self.ORDER_NUMBER_RE)
+        
+        created_at, host_id, pid, _ = OrderNumberGenerator.decode(order_number)
+        self.assertLessEqual(abs((created_at - before).total_seconds()), 1)
+        self.assertEqual((host_id, pid), (513, os.getpid()))
+        self.assertEqual(OrderNumberGenerator.decode(order_number.lower().replace('-', '').replace('0', 'o'))[1], 513)
+        with self.assertRaises(ValueError):
+            OrderNumberGenerator.decode('ORD-20230101-001')
+    
+    def test_host_id_must_be_configured_outside_debug(self):
+        """Test that only DEBUG falls back to the host name and ids must fit in 16 bits"""
+        with self.settings(ORDER_NUMBER_HOST_ID=None, DEBUG=False), self.assertRaises(ImproperlyConfigured):
+            OrderNumberGenerator.generate()
+        with self.settings(ORDER_NUMBER_HOST_ID=None, DEBUG=True):
+            self.assertEqual(OrderNumberGenerator.host_id(), hostname_hash() & 0xFFFF)
+        with self.settings(ORDER_NUMBER_HOST_ID=1 << 16), self.assertRaises(ImproperlyConfigured):
+            OrderNumberGenerator.host_id()
+    
+    def test_numbers_are_unique_and_ordered_across_threads(self):
+        """Test that threads generating at full speed never share a number and each sees them increase"""
+        results = [None] * 8
+        
+        def generate(index):
+            results[index] = generate_order_numbers(5000)
+        
+        threads = [threading.Thread(target=generate, args=(index,)) for index in range(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        for numbers in results:
+            self.assertEqual(numbers, sorted(numbers))
+        self.assertEqual(len({number for numbers in results for number in numbers}), 8 * 5000)
+    
+    def test_numbers_are_unique_across_processes(self):
+        """Test that forked workers generating at the same time never share a number"""
+        with multiprocessing.get_context('fork').Pool(4) as pool:
+            results = pool.map(generate_order_numbers, [5000] * 4)
+        results.append(generate_order_numbers(5000))
+        
+        self.assertEqual(len({number for numbers in results for number in numbers}), 5 * 5000)
+        self.assertEqual(len({OrderNumberGenerator.decode(numbers[0])[2] for numbers in results}), 5)
+    
+    def test_numbers_keep_increasing_whatever_the_clock_does(self):
+        """Test that stalls, bursts and backward clock steps still give unique, increasing numbers"""
+        for seed in range(20):
+            rng = random.Random(seed)
+            clock = [1_800_000_000.0]
+            
+            def tick():
+                step = rng.choice([0.0, 0.0, 0.0005, 0.002, -0.5, -0.001])  # Mostly bursts within a millisecond
+                clock[0] += step
+                return clock[0]
+            
+            # Fresh generator state, so the fake clock doesn't leak into real numbers
+            with mock.patch.multiple(OrderNumberGenerator, _pid=None, _last_ms=-1, _sequence=0), \
+                    mock.patch('apps.orders.utils.time.time', side_effect=tick):
+                numbers = generate_order_numbers(3000)
+            self.assertEqual(len(set(numbers)), len(numbers), f'seed {seed}')
+            self.assertEqual(numbers, sorted(numbers), f'seed {seed}')
+
+
+class OrdersQueryPlanTests(TestCase):
+    """
+    EXPLAIN the page the order history view reads and fail if it scans the table or sorts
+    """
+    
+    def test_order_history_uses_index(self):
+        """Test that a user's newest orders walk an index in order"""
+        users = [
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', phone='', password='testpass123')
+            for i in range(5)
+        ]
+        Order.objects.bulk_create([
+            Order(user=users[i % 5], order_number=f'ORD-{i}', total_amount=10, delivery_address='1 Test Street')
+            for i in range(200)
+        ])
+        
+        self.client.login(username='user0', password='testpass123')
+        with DatabaseOptimizer.capture_page_querysets() as querysets:
+            self.client.get(reverse('orders:order_history'))
+        self.assertEqual(len(querysets), 1)
+        self.assertEqual(DatabaseOptimizer.plan_problems(querysets[0]), [], DatabaseOptimizer.explain(querysets[0]))
@@ -6,8 +6,8 @@ app_name = 'orders'
 urlpatterns = [
     path('cart/', views.cart, name='cart'),
     path('cart/add/', views.add_to_cart, name='add_to_cart'),
-    path('cart/update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
-    path('cart/remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/update/<int:product_id>/', views.update_cart_item, name='update_cart_item'),
+    path('cart/remove/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('cart/clear/', views.clear_cart, name='clear_cart'),
     
     path('checkout/', views.checkout, name='checkout'),
@@ -15,4 +15,5 @@ urlpatterns = [
     
     path('orders/', views.order_history, name='order_history'),
     path('orders/<int:order_id>/', views.order_detail, name='order_detail'),
+    path('orders/<int:order_id>/status/', views.order_status, name='order_status'),
 ]
@@ -1 +1,132 @@
-  
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+import os
+import socket
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Crockford's base32: digits and capitals without I, L, O and U, in ASCII order
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+DECODE_MAP = {char: value for value, char in enumerate(ALPHABET)}
+DECODE_MAP.update({'O': 0, 'I': 1, 'L': 1})  # Characters people type by mistake
+
+
+@lru_cache(maxsize=1)
+def hostname_hash():
+    return zlib.crc32(socket.gethostname().encode('utf-8'))
+
+
+class OrderNumberGenerator:
+    """
+    Time-ordered order numbers that are unique without any coordination
+
+    Each number packs, from the most significant bit: milliseconds since
+    EPOCH_MS (43 bits), a host id (16 bits, ORDER_NUMBER_HOST_ID; only DEBUG
+    falls back to a hash of the host name), the process id (22 bits, unique among the running
+    processes of a host) and a sequence within the millisecond (9 bits).
+    It is written as 18 base32 characters in groups of six, e.g.
+    ORD-01HXK4-M9Q2ZT-7VB0C3. All numbers have the same width and the
+    alphabet is in ASCII order, so they sort as strings in the order they
+    were made and new orders land at the end of the order_number index.
+    """
+
+    PREFIX = 'ORD'
+    EPOCH_MS = 1704067200000  # 2024-01-01 UTC
+    TIME_BITS = 43
+    HOST_BITS = 16
+    PROCESS_BITS = 22
+    SEQUENCE_BITS = 9
+    LENGTH = 18  # base32 characters for all 90 bits
+    GROUP_SIZE = 6
+
+    _lock = threading.Lock()
+    _pid = None
+    _last_ms = -1
+    _sequence = 0
+
+    @classmethod
+    def host_id(cls):
+        host_id = settings.ORDER_NUMBER_HOST_ID
+        if host_id is None:
+            if not settings.DEBUG:
+                # Hashed host names can collide and two hosts would then share numbers
+                raise ImproperlyConfigured('ORDER_NUMBER_HOST_ID must be set outside development.')
+            return hostname_hash() & ((1 << cls.HOST_BITS) - 1)
+        if not 0 <= host_id < 1 << cls.HOST_BITS:
+            raise ImproperlyConfigured(f'ORDER_NUMBER_HOST_ID must be between 0 and {(1 << cls.HOST_BITS) - 1}.')
+        return host_id
+
+    @classmethod
+    def next_id(cls):
+        """
+        Return the next order id as an integer
+        """
+        with cls._lock:
+            pid = os.getpid()
+            if pid != cls._pid:
+                # A forked worker starts its own sequence
+                cls._pid, cls._last_ms, cls._sequence = pid, -1, 0
+
+            now_ms = int(time.time() * 1000) - cls.EPOCH_MS
+            if now_ms > cls._last_ms:
+                cls._last_ms, cls._sequence = now_ms, 0
+            else:
+                # Same millisecond, or the clock stepped back: carry on from the last id
+                cls._sequence += 1
+                if cls._sequence >> cls.SEQUENCE_BITS:
+                    cls._last_ms += 1  # Borrow the next millisecond instead of waiting for it
+                    cls._sequence = 0
+            ms, sequence = cls._last_ms, cls._sequence
+
+        value = ms
+        value = value << cls.HOST_BITS | cls.host_id()
+        value = value << cls.PROCESS_BITS | pid & ((1 << cls.PROCESS_BITS) - 1)
+        return value << cls.SEQUENCE_BITS | sequence
+
+    @classmethod
+    def encode(cls, value):
+        chars = []
+        for _ in range(cls.LENGTH):
+            chars.append(ALPHABET[value & 31])
+            value >>= 5
+        body = ''.join(reversed(chars))
+        groups = [body[start:start + cls.GROUP_SIZE] for start in range(0, cls.LENGTH, cls.GROUP_SIZE)]
+        return '-'.join([cls.PREFIX] + groups)
+
+    @classmethod
+    def generate(cls):
+        """
+        Return a new order number
+        """
+        return cls.encode(cls.next_id())
+
+    @classmethod
+    def decode(cls, order_number):
+        """
+        Return (created at, host id, process id, sequence) of an order number
+
+        Lowercase, missing dashes and the letters O, I and L typed for 0 and 1
+        are accepted. Raises ValueError for anything that is not an order number.
+        """
+        body = order_number.strip().upper().replace('-', '')
+        if not body.startswith(cls.PREFIX) or len(body) != len(cls.PREFIX) + cls.LENGTH:
+            raise ValueError(f"Not an order number: {order_number!r}")
+
+        value = 0
+        for char in body[len(cls.PREFIX):]:
+            if char not in DECODE_MAP:
+                raise ValueError(f"Not an order number: {order_number!r}")
+            value = value << 5 | DECODE_MAP[char]
+
+        sequence = value & ((1 << cls.SEQUENCE_BITS) - 1)
+        value >>= cls.SEQUENCE_BITS
+        pid = value & ((1 << cls.PROCESS_BITS) - 1)
+        value >>= cls.PROCESS_BITS
+        host_id = value & ((1 << cls.HOST_BITS) - 1)
+        ms = value >> cls.HOST_BITS
+        created_at = datetime.fromtimestamp(cls.EPOCH_MS / 1000, tz=dt_timezone.utc) + timedelta(milliseconds=ms)
+        return created_at, host_id, pid, sequence
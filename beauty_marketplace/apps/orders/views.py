@@ -1,28 +1,29 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.core.paginator import Paginator
+from django.http import Http404, JsonResponse
 from django.db.models import Sum
-from django.utils import timezone
 
-from .models import CartItem, Order, OrderItem, OrderStatus, Payment
+from .cart import CartStore, CartSummary
+from .checkout import CheckoutError, CheckoutService
+from .models import Order, Payment
+from .reservations import StockReservations
 from apps.products.models import Product
+from apps.products.pagination import KeysetPaginator
 from apps.accounts.models import User
 
 
 @login_required
 def cart(request):
-    # Get cart items for the current user
-    cart_items = CartItem.objects.filter(user=request.user).select_related('product')
-    
-    # Calculate subtotal
-    subtotal = sum(item.total_price() for item in cart_items)
+    # Cart lines and their product snapshots come from the cart store
+    cart_items = CartStore.get_lines(request.user.pk)
+    summary = CartSummary.from_lines(cart_items)
     
     context = {
         'cart_items': cart_items,
-        'subtotal': subtotal,
-        'item_count': cart_items.count(),
+        'subtotal': summary.subtotal,
+        'item_count': summary.line_count,
     }
     
     return render(request, 'orders/cart.html', context)
@@ -32,21 +33,19 @@ def cart(request):
 def add_to_cart(request):
     if request.method == 'POST':
         product_id = request.POST.get('product_id')
-        quantity = int(request.POST.get('quantity', 1))
+        quantity = max(int(request.POST.get('quantity', 1)), 1)
         
-        product = get_object_or_404(Product, id=product_id, is_active=True)
+        product = get_object_or_404(Product.objects.with_card_data(), id=product_id, is_active=True)
         
-        # Check if item is already in cart
-        cart_item, created = CartItem.objects.get_or_create(
-            user=request.user,
-            product=product,
-            defaults={'quantity': quantity}
-        )
+        # One atomic increment; the cart is saved to the database later
+        line_quantity = CartStore.add(request.user.pk, product, quantity)
         
-        if not created:
-            # Update quantity if item already in cart
-            cart_item.quantity += quantity
-            cart_item.save()
+        # Hold the units for the buyer; if they are gone, take them back out of the cart
+        shortages = StockReservations.hold(request.user.pk, {product.pk: line_quantity})
+        if shortages:
+            CartStore.add(request.user.pk, product, -quantity)
+            messages.error(request, f'Sorry, only {shortages[product.pk]} of {product.name} are available right now.')
+        elif line_quantity > quantity:
             messages.success(request, f'Updated quantity of {product.name} in your cart.')
         else:
             messages.success(request, f'Added {product.name} to your cart.')
@@ -57,17 +56,21 @@ def add_to_cart(request):
 
 
 @login_required
-def update_cart_item(request, item_id):
+def update_cart_item(request, product_id):
     if request.method == 'POST':
-        cart_item = get_object_or_404(CartItem, id=item_id, user=request.user)
-        quantity = int(request.POST.get('quantity', 1))
+        quantity = max(int(request.POST.get('quantity', 1)), 0)
         
+        # Hold the new quantity first; without the stock the line is left as it was
+        shortages = StockReservations.hold(request.user.pk, {product_id: quantity})
+        if shortages:
+            messages.error(request, f'Sorry, only {shortages[product_id]} of that product are available right now.')
+            return redirect('orders:cart')
+        if not CartStore.set_quantity(request.user.pk, product_id, quantity):
+            StockReservations.hold(request.user.pk, {product_id: 0})
+            raise Http404("No such item in your cart.")
         if quantity > 0:
-            cart_item.quantity = quantity
-            cart_item.save()
             messages.success(request, 'Cart updated successfully.')
         else:
-            cart_item.delete()
             messages.success(request, 'Item removed from cart.')
         
         return redirect('orders:cart')
@@ -76,12 +79,14 @@ def update_cart_item(request, item_id):
 
 
 @login_required
-def remove_from_cart(request, item_id):
+def remove_from_cart(request, product_id):
     if request.method == 'POST':
-        cart_item = get_object_or_404(CartItem, id=item_id, user=request.user)
-        product_name = cart_item.product.name
-        cart_item.delete()
-        messages.success(request, f'{product_name} removed from your cart.')
+        line = next((line for line in CartStore.get_lines(request.user.pk) if line.product_id == product_id), None)
+        if line is None:
+            raise Http404("No such item in your cart.")
+        CartStore.set_quantity(request.user.pk, product_id, 0)
+        StockReservations.hold(request.user.pk, {product_id: 0})
+        messages.success(request, f'{line.name} removed from your cart.')
         return redirect('orders:cart')
     
     return redirect('orders:cart')
@@ -90,7 +95,8 @@ def remove_from_cart(request, item_id):
 @login_required
 def clear_cart(request):
     if request.method == 'POST':
-        CartItem.objects.filter(user=request.user).delete()
+        CartStore.clear(request.user.pk)
+        StockReservations.release(request.user.pk)
         messages.success(request, 'Cart cleared successfully.')
         return redirect('orders:cart')
     
@@ -100,18 +106,24 @@ def clear_cart(request):
 @login_required
 def checkout(request):
     # Get cart items for the current user
-    cart_items = CartItem.objects.filter(user=request.user).select_related('product')
+    cart_items = CartStore.get_lines(request.user.pk)
     
     if not cart_items:
         messages.error(request, 'Your cart is empty.')
         return redirect('orders:cart')
     
-    # Calculate subtotal
-    subtotal = sum(item.total_price() for item in cart_items)
+    # Show what the order will be charged: current names and prices, not the ones from when items were added
+    cart_items = CartStore.refresh(request.user.pk, cart_items)
+    
+    # Entering checkout holds the whole cart while the buyer fills in the form
+    shortages = StockReservations.hold(request.user.pk, {item.product_id: item.quantity for item in cart_items})
+    if shortages:
+        names = ', '.join(item.name for item in cart_items if item.product_id in shortages)
+        messages.warning(request, f'Some items are selling out and could not be held for you: {names}.')
     
     context = {
         'cart_items': cart_items,
-        'subtotal': subtotal,
+        'subtotal': CartSummary.from_lines(cart_items).subtotal,
     }
     
     return render(request, 'orders/checkout.html', context)
@@ -127,45 +139,16 @@ def process_checkout(request):
             messages.error(request, 'Please provide a delivery address.')
             return redirect('orders:checkout')
         
-        # Get cart items
-        cart_items = CartItem.objects.filter(user=request.user).select_related('product')
-        
-        if not cart_items:
-            messages.error(request, 'Your cart is empty.')
-            return redirect('orders:cart')
-        
-        # Calculate total amount
-        total_amount = sum(item.total_price() for item in cart_items)
-        
-        # Create order
-        order = Order.objects.create(
-            user=request.user,
-            order_number=f"ORD-{timezone.now().strftime('%Y%m%d%H%M%S')}-{request.user.id}",
-            total_amount=total_amount,
-            delivery_address=delivery_address,
-            status='pending'
-        )
-        
-        # Create order items
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                unit_price=cart_item.product.price,
-                total_price=cart_item.total_price()
+        # Order, order items, stock and cart change together or not at all
+        try:
+            order = CheckoutService.place_order(
+                request.user, delivery_address, request.POST.get('payment_method', 'credit_card')
             )
+        except CheckoutError as e:
+            messages.error(request, str(e))
+            return redirect('orders:cart')
         
-        # Create initial order status
-        OrderStatus.objects.create(
-            order=order,
-            status='pending',
-            notes='Order created'
-        )
-        
-        # Clear cart
-        cart_items.delete()
-        
+        # The payment is charged in the background; the order page follows its progress
         messages.success(request, f'Order #{order.order_number} created successfully!')
         return redirect('orders:order_detail', order_id=order.id)
     
@@ -178,9 +161,8 @@ def order_history(request):
     orders = Order.objects.filter(user=request.user).order_by('-created_at')
     
     # Paginate results
-    paginator = Paginator(orders, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(orders, 10, ('-created_at', '-id'))
+    page_obj = paginator.get_page(request.GET)
     
     context = {
         'page_obj': page_obj,
@@ -199,6 +181,21 @@ def order_detail(request, order_id):
         'order': order,
         'order_items': order_items,
         'order_status_history': order_status_history,
+        'payment': Payment.objects.filter(order=order).first(),
+        'poll_interval_ms': settings.PAYMENT_STATUS_POLL_INTERVAL * 1000,
     }
     
     return render(request, 'orders/order_detail.html', context)
+
+
+@login_required
+def order_status(request, order_id):
+    # Polled by the order page while the payment is pending
+    order = get_object_or_404(Order.objects.only('id', 'status'), id=order_id, user=request.user)
+    payment = Payment.objects.filter(order=order).only('status').first()
+    
+    return JsonResponse({
+        'status': order.status,
+        'status_display': order.get_status_display(),
+        'payment_status': payment.status if payment else None,
+    })
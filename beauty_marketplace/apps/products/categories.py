@@ -0,0 +1,157 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CategoryMembership:
+    """
+    Product membership in categories and the per-category active product counts
+
+    A product belongs to its primary ``category`` plus any extra categories,
+    one ProductCategory row each. Links copy the product's ``is_active`` so
+    category browsing reads a single partial index, and
+    ``Category.active_product_count`` always equals the number of active links.
+    Every change to links or product status adjusts the counters in the same
+    transaction.
+    """
+
+    @staticmethod
+    def apply_deltas(deltas):
+        """
+        Apply {category_id: change} to active_product_count, one UPDATE per distinct change
+        """
+        from .models import Category
+
+        by_change = {}
+        for category_id, change in deltas.items():
+            if change:
+                by_change.setdefault(change, []).append(category_id)
+        for change, category_ids in by_change.items():
+            Category.objects.filter(pk__in=category_ids).update(
+                active_product_count=F('active_product_count') + change
+            )
+        return bool(by_change)
+
+    @staticmethod
+    def _sync(product, category_ids):
+        """
+        Make the product's links equal category_ids and match its status; returns whether counts changed
+        """
+        from .models import ProductCategory
+
+        links = dict(ProductCategory.objects.filter(product=product).values_list('category_id', 'is_active'))
+        removed = [category_id for category_id in links if category_id not in category_ids]
+        added = [category_id for category_id in category_ids if category_id not in links]
+
+        if removed:
+            ProductCategory.objects.filter(product=product, category_id__in=removed).delete()
+        if added:
+            ProductCategory.objects.bulk_create(
+                [ProductCategory(product=product, category_id=category_id, is_active=product.is_active)
+                 for category_id in added],
+                ignore_conflicts=True
+            )
+        kept = [is_active for category_id, is_active in links.items() if category_id not in removed]
+        if any(is_active != product.is_active for is_active in kept):
+            ProductCategory.objects.filter(product=product).exclude(is_active=product.is_active).update(
+                is_active=product.is_active
+            )
+
+        deltas = {}
+        for category_id, is_active in links.items():
+            if is_active:
+                deltas[category_id] = deltas.get(category_id, 0) - 1
+        if product.is_active:
+            for category_id in category_ids:
+                deltas[category_id] = deltas.get(category_id, 0) + 1
+        return CategoryMembership.apply_deltas(deltas)
+
+    @staticmethod
+    def listing_changed(product, created=False):
+        """
+        Follow a product's new primary category or status (called after it was saved)
+        """
+        from .models import ProductCategory
+
+        with transaction.atomic():
+            category_ids = set(ProductCategory.objects.filter(product=product).values_list('category_id', flat=True))
+            # Form views assign category_id as a string
+            category_id = int(product.category_id)
+            stored_category_id = None if created or product._stored_listing[0] is None else int(product._stored_listing[0])
+            if stored_category_id != category_id:
+                category_ids.discard(stored_category_id)
+            category_ids.add(category_id)
+            return CategoryMembership._sync(product, category_ids)
+
+    @staticmethod
+    def set_categories(product, category_ids):
+        """
+        Set a product's extra categories; its primary category is always kept
+        """
+        from .utils import ProductCache
+
+        category_ids = {int(category_id) for category_id in category_ids if str(category_id).isdigit()}
+        category_ids.add(int(product.category_id))
+        with transaction.atomic():
+            counts_changed = CategoryMembership._sync(product, category_ids)
+        # Category lists, counts and filtered product lists all change
+        ProductCache.invalidate_product_cache(product.pk, product.category_id)
+        return counts_changed
+
+    @staticmethod
+    def product_deleted(product):
+        """
+        Drop a product that is about to be deleted from its categories' counts
+        """
+        from .models import ProductCategory
+
+        deltas = {
+            category_id: -1
+            for category_id in ProductCategory.objects.filter(product=product, is_active=True)
+            .values_list('category_id', flat=True)
+        }
+        CategoryMembership.apply_deltas(deltas)
+
+    @staticmethod
+    def reconcile():
+        """
+        Add missing primary links, fix link status and recount every category
+
+        Returns (links added, links fixed, categories fixed).
+        """
+        from .models import Category, Product, ProductCategory
+
+        with transaction.atomic():
+            missing = Product.objects.exclude(
+                pk__in=ProductCategory.objects.filter(category_id=OuterRef('category_id')).values('product_id')
+            ).values_list('pk', 'category_id', 'is_active')
+            added = ProductCategory.objects.bulk_create(
+                [ProductCategory(product_id=pk, category_id=category_id, is_active=is_active)
+                 for pk, category_id, is_active in missing.iterator(chunk_size=2000)],
+                batch_size=1000,
+                ignore_conflicts=True
+            )
+
+            links_fixed = 0
+            for is_active in (True, False):
+                links_fixed += ProductCategory.objects.filter(product__is_active=is_active).exclude(
+                    is_active=is_active
+                ).update(is_active=is_active)
+
+            counts = ProductCategory.objects.filter(category_id=OuterRef('pk'), is_active=True).values(
+                'category_id'
+            ).annotate(count=Count('pk')).values('count')
+            expected = Coalesce(Subquery(counts), Value(0))
+            stale = list(
+                Category.objects.annotate(expected=expected).exclude(
+                    active_product_count=F('expected')
+                ).values_list('pk', flat=True)
+            )
+            categories_fixed = Category.objects.filter(pk__in=stale).update(active_product_count=expected)
+
+        if categories_fixed:
+            logger.warning(f"Category product counts were out of date on {categories_fixed} categories")
+        return len(added), links_fixed, categories_fixed
@@ -0,0 +1,153 @@
+import hashlib
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+import logging
+
+from .search import tokenize
+from .utils import ProductCache
+
+logger = logging.getLogger(__name__)
+
+
+def parse_price(value):
+    """
+    Parse a price filter, returning None for blank or invalid input
+    """
+    if value in (None, ''):
+        return None
+    try:
+        price = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    return price.normalize() if price.is_finite() else None
+
+
+def price_buckets():
+    """
+    Return the configured price buckets as (min, max) pairs; max is None for the last
+    """
+    bounds = [None] + [Decimal(bound) for bound in settings.FACET_PRICE_BUCKETS] + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def bucket_label(low, high):
+    if low is None:
+        return f"Under ${high}"
+    if high is None:
+        return f"${low} & above"
+    return f"${low} to ${high}"
+
+
+class ProductFacets:
+    """
+    Category and price-bucket counts for the product listing sidebar
+
+    Both facets come from one GROUP BY over the active ProductCategory rows
+    matching the search, so category counts include extra categories. Each
+    facet ignores its own filter (category counts respect the price filter but
+    not the category filter, and vice versa) so the sidebar shows what
+    selecting it would give.
+    """
+
+    @staticmethod
+    def normalize_filters(search='', category_id='', min_price='', max_price=''):
+        """
+        Reduce filters to a canonical tuple so equivalent requests share a cache entry
+        """
+        terms = tuple(sorted(set(tokenize(search))))
+        category_id = int(category_id) if str(category_id).isdigit() else None
+        return terms, category_id, parse_price(min_price), parse_price(max_price)
+
+    @staticmethod
+    def cache_key(filters):
+        digest = hashlib.md5(repr(filters).encode('utf-8')).hexdigest()
+        # Facets live in the product list namespace, so any catalog change refreshes them
+        version = ProductCache.get_namespace_version(ProductCache.NAMESPACE_LIST)
+        return f"facets:v{version}:{digest}"
+
+    @staticmethod
+    def get_counts(search='', category_id='', min_price='', max_price=''):
+        """
+        Return {'categories': {category_id: count}, 'price_buckets': [...]} for the filters
+        """
+        filters = ProductFacets.normalize_filters(search, category_id, min_price, max_price)
+        cache_key = ProductFacets.cache_key(filters)
+
+        counts = cache.get(cache_key)
+        if counts is None:
+            counts = ProductFacets.compute(*filters)
+            cache.set(cache_key, counts, timeout=settings.FACET_CACHE_TTL)
+        return counts
+
+    @staticmethod
+    def compute(terms, category_id, min_price, max_price):
+        """
+        Count matching products per category and per price bucket in a single query
+
+        Rows are grouped by category, price bucket, whether the price is in the
+        filtered range and whether the category is the product's primary one.
+        Bucket counts use the rows of the selected category, or the primary
+        rows when no category is selected, so each product is counted once.
+        """
+        from .models import ProductCategory, SearchPosting
+
+        links = ProductCategory.objects.filter(is_active=True, product__is_active=True)
+        if terms:
+            links = links.filter(
+                product_id__in=SearchPosting.objects.filter(term__term__in=terms).values('product_id')
+            )
+
+        price_range = Q()
+        if min_price is not None:
+            price_range &= Q(product__price__gte=min_price)
+        if max_price is not None:
+            price_range &= Q(product__price__lte=max_price)
+
+        if price_range:
+            in_range = Case(When(price_range, then=Value(1)), default=Value(0), output_field=IntegerField())
+        else:
+            in_range = Value(1, output_field=IntegerField())
+
+        buckets = price_buckets()
+        rows = links.annotate(
+            bucket=Case(
+                *[
+                    When(product__price__lt=high, then=Value(index))
+                    for index, (_, high) in enumerate(buckets) if high is not None
+                ],
+                default=Value(len(buckets) - 1),
+                output_field=IntegerField()
+            ),
+            in_range=in_range,
+            primary=Case(
+                When(category_id=F('product__category_id'), then=Value(1)),
+                default=Value(0),
+                output_field=IntegerField()
+            ),
+        ).values('category_id', 'bucket', 'in_range', 'primary').annotate(count=Count('id')).order_by()
+
+        categories = {}
+        bucket_counts = [0] * len(buckets)
+        for row in rows:
+            if row['in_range']:
+                categories[row['category_id']] = categories.get(row['category_id'], 0) + row['count']
+            selected = row['category_id'] == category_id if category_id is not None else row['primary']
+            if selected:
+                bucket_counts[row['bucket']] += row['count']
+
+        return {
+            'categories': categories,
+            'price_buckets': [
+                {
+                    'label': bucket_label(low, high),
+                    'min_price': '' if low is None else str(low),
+                    # Buckets are half-open; prices have two decimal places
+                    'max_price': '' if high is None else str(high - Decimal('0.01')),
+                    'count': count,
+                }
+                for (low, high), count in zip(buckets, bucket_counts)
+            ],
+        }
@@ -1 +1,8 @@
-  
+from django import forms
+from .models import ProductReview
+
+
+class ReviewForm(forms.ModelForm):
+    class Meta:
+        model = ProductReview
+        fields = ['rating', 'comment']
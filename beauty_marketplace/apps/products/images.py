@@ -0,0 +1,246 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
+import io
+import ipaddress
+import os
+import socket
+import threading
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+import logging
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FORMATS = (('webp', 'WEBP', 'image/webp'), ('jpeg', 'JPEG', 'image/jpeg'))
+
+
+class ImageSourceError(Exception):
+    """
+    The source image could not be fetched or decoded
+    """
+
+
+def variant_path(digest, name, width, extension):
+    """
+    Path of a variant relative to MEDIA_ROOT; it only depends on the source content
+    """
+    return f"images/{digest[:2]}/{digest}/{name}-{width}.{extension}"
+
+
+def render_variants(data, digest, media_root, sizes, quality):
+    """
+    Decode an image and write its resized WebP and JPEG variants under media_root
+
+    Runs in a worker process, so it only takes and returns plain data. Images
+    are re-encoded from pixels, which drops EXIF, GPS and other metadata; the
+    EXIF orientation is applied first so nothing appears rotated. Images are
+    never upscaled. Returns (width, height, variants) for the source.
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            source.load()
+            image = ImageOps.exif_transpose(source)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageSourceError(f"Cannot decode image: {e}")
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    variants = []
+    written = set()
+    for name, max_edge in sorted(sizes.items(), key=lambda item: item[1]):
+        resized = image.copy()
+        resized.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if resized.size in written:
+            continue  # The source is smaller than this variant; keep one copy per size
+        written.add(resized.size)
+
+        variant = {'name': name, 'width': resized.width, 'height': resized.height}
+        for extension, pil_format, _ in IMAGE_FORMATS:
+            frame = resized
+            if pil_format == 'JPEG' and frame.mode == 'RGBA':
+                frame = Image.new('RGB', frame.size, (255, 255, 255))
+                frame.paste(resized, mask=resized.getchannel('A'))
+            path = variant_path(digest, name, resized.width, extension)
+            full_path = os.path.join(media_root, path)
+            if not os.path.exists(full_path):
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                temporary = f"{full_path}.{os.getpid()}.tmp"
+                frame.save(temporary, pil_format, quality=quality, optimize=True)
+                os.replace(temporary, full_path)  # Readers never see a partial file
+            variant[extension] = path
+        variants.append(variant)
+
+    return image.width, image.height, variants
+
+
+class ImagePipeline:
+    """
+    Turns product image URLs into content-addressed, resized variants
+
+    New images are processed after their transaction commits, on a small
+    dispatcher thread pool; the decoding and encoding runs on a process pool.
+    Sources are identified by the SHA-256 of their bytes, so the same picture
+    used by many products (or uploaded twice) is processed and stored once.
+    """
+
+    _lock = threading.Lock()
+    _dispatcher = None
+    _workers = None
+
+    @staticmethod
+    def _pools():
+        with ImagePipeline._lock:
+            if ImagePipeline._dispatcher is None:
+                ImagePipeline._dispatcher = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_PIPELINE_DISPATCHERS, thread_name_prefix='image-pipeline'
+                )
+                if settings.IMAGE_PIPELINE_WORKERS:
+                    ImagePipeline._workers = ProcessPoolExecutor(max_workers=settings.IMAGE_PIPELINE_WORKERS)
+            return ImagePipeline._dispatcher, ImagePipeline._workers
+
+    @staticmethod
+    def enqueue(image_ids):
+        """
+        Process these ProductImage ids once the current transaction commits
+        """
+        image_ids = list(image_ids)
+        if not image_ids:
+            return
+
+        def submit():
+            if not settings.IMAGE_PIPELINE_ASYNC:
+                ImagePipeline.process_many(image_ids)
+                return
+            dispatcher, _ = ImagePipeline._pools()
+            for image_id in image_ids:
+                dispatcher.submit(ImagePipeline._process_in_thread, image_id)
+
+        transaction.on_commit(submit)
+
+    @staticmethod
+    def _process_in_thread(image_id):
+        try:
+            ImagePipeline.process(image_id)
+        except Exception:
+            logger.exception(f"Image pipeline failed for product image {image_id}")
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def process_many(image_ids):
+        for image_id in image_ids:
+            ImagePipeline.process(image_id)
+
+    @staticmethod
+    def process(image_id):
+        """
+        Fetch, deduplicate and render one product image; returns its ImageAsset or None
+        """
+        from .models import ImageAsset, ProductImage
+
+        image = ProductImage.objects.filter(pk=image_id).select_related('asset').first()
+        if image is None:
+            return None
+
+        try:
+            data = ImagePipeline.read_source(image.image_url)
+        except ImageSourceError as e:
+            logger.warning(f"Skipping product image {image_id}: {e}")
+            return None
+
+        digest = hashlib.sha256(data).hexdigest()
+        asset, _ = ImageAsset.objects.get_or_create(sha256=digest)
+        if asset.status != ImageAsset.STATUS_READY:
+            ImagePipeline.render(asset, data)
+
+        if image.asset_id != asset.pk:
+            ProductImage.objects.filter(pk=image_id).update(asset=asset)
+            from .utils import ProductCache
+            ProductCache.invalidate_product_cache(image.product_id)
+        return asset
+
+    @staticmethod
+    def render(asset, data):
+        """
+        Render an asset's variants on the process pool (or inline without one) and record them
+        """
+        from .models import ImageAsset
+
+        args = (data, asset.sha256, str(settings.MEDIA_ROOT), settings.IMAGE_VARIANTS, settings.IMAGE_QUALITY)
+        _, workers = ImagePipeline._pools() if settings.IMAGE_PIPELINE_WORKERS else (None, None)
+        try:
+            if workers is not None:
+                width, height, variants = workers.submit(render_variants, *args).result()
+            else:
+                width, height, variants = render_variants(*args)
+        except ImageSourceError as e:
+            logger.warning(f"Image {asset.sha256} failed: {e}")
+            ImageAsset.objects.filter(pk=asset.pk).update(status=ImageAsset.STATUS_FAILED)
+            asset.status = ImageAsset.STATUS_FAILED
+            return asset
+
+        asset.width, asset.height, asset.variants = width, height, variants
+        asset.status = ImageAsset.STATUS_READY
+        asset.save(update_fields=['width', 'height', 'variants', 'status'])
+        return asset
+
+    @staticmethod
+    def read_source(url):
+        """
+        Return the bytes of an image URL, reading files under MEDIA_URL from MEDIA_ROOT
+        """
+        parts = urlsplit(url)
+        media_prefix = '/' + settings.MEDIA_URL.strip('/') + '/'
+        is_local = not parts.netloc or parts.netloc in settings.IMAGE_PIPELINE_MEDIA_HOSTS
+        if is_local and parts.path.startswith(media_prefix):
+            root = os.path.realpath(settings.MEDIA_ROOT)
+            path = os.path.realpath(os.path.join(root, parts.path[len(media_prefix):]))
+            if not path.startswith(root + os.sep):
+                raise ImageSourceError("Path outside MEDIA_ROOT")
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read(settings.IMAGE_PIPELINE_MAX_BYTES + 1)
+            except OSError as e:
+                raise ImageSourceError(str(e))
+        else:
+            data = ImagePipeline.download(url)
+
+        if len(data) > settings.IMAGE_PIPELINE_MAX_BYTES:
+            raise ImageSourceError("Image is too large")
+        return data
+
+    @staticmethod
+    def download(url):
+        """
+        Download a public http(s) image with a timeout and size limit
+        """
+        import requests
+
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ImageSourceError("Only http and https image URLs can be fetched")
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, parts.port or 443)}
+        except socket.gaierror as e:
+            raise ImageSourceError(str(e))
+        # Seller-supplied URLs must not reach internal services
+        if any(not ipaddress.ip_address(address.split('%')[0]).is_global for address in addresses):
+            raise ImageSourceError("Image host is not public")
+
+        try:
+            response = requests.get(url, stream=True, timeout=settings.IMAGE_PIPELINE_TIMEOUT, allow_redirects=False)
+            with response:
+                response.raise_for_status()
+                data = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    data.extend(chunk)
+                    if len(data) > settings.IMAGE_PIPELINE_MAX_BYTES:
+                        raise ImageSourceError("Image is too large")
+        except requests.RequestException as e:
+            raise ImageSourceError(str(e))
+        return bytes(data)
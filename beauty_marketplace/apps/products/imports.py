@@ -0,0 +1,223 @@
+import codecs
+import csv
+import json
+import logging
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import transaction
+
+from .images import ImagePipeline
+from .models import Category, Product, ProductCategory, ProductImage
+from .utils import ProductCache
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+validate_url = URLValidator()
+
+
+def detect_format(filename):
+    """
+    Import format from a file name, or None if it is not one we read
+    """
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in ('json', 'ndjson'):
+        extension = 'jsonl'
+    return extension if extension in IMPORT_FORMATS else None
+
+
+def read_rows(stream, file_format):
+    """
+    Yield (line number, row dict or None, parse error or None) from a binary stream
+
+    Lines are decoded and parsed one at a time, so memory does not grow with the file.
+    """
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, 'Each line must be a JSON object'
+        else:
+            yield line_number, row, None
+
+
+class ImportReport:
+    """
+    Counts and the first few row errors of a catalog import
+    """
+
+    def __init__(self, max_errors):
+        self.products_created = 0
+        self.images_created = 0
+        self.rows_failed = 0
+        self.errors = []  # (line number, message), capped at max_errors
+        self._max_errors = max_errors
+
+    def add_error(self, line_number, message):
+        self.rows_failed += 1
+        if len(self.errors) < self._max_errors:
+            self.errors.append((line_number, message))
+
+    @property
+    def errors_truncated(self):
+        return self.rows_failed > len(self.errors)
+
+
+class CatalogImporter:
+    """
+    Bulk-create a seller's products and images from a CSV or JSONL file
+
+    Rows are validated and written in chunks, each chunk in its own transaction,
+    so a bad row only rejects itself and memory stays flat for any file size.
+    Imported products await admin approval like ones created by hand.
+
+    Columns: name, description, price, quantity, category (id or name) and
+    image_urls ('|'-separated in CSV, a list or string in JSONL).
+    """
+
+    def __init__(self, seller, batch_size=None, max_errors=None):
+        self.seller = seller
+        self.batch_size = batch_size or settings.CATALOG_IMPORT_BATCH_SIZE
+        self.report = ImportReport(max_errors or settings.CATALOG_IMPORT_MAX_ERRORS)
+        self._categories = {}
+        for category_id, name in Category.objects.filter(is_active=True).values_list('id', 'name'):
+            self._categories[str(category_id)] = category_id
+            self._categories.setdefault(name.strip().lower(), category_id)
+
+    def run(self, stream, file_format):
+        """
+        Import every row of the stream and return the ImportReport
+        """
+        rows = read_rows(stream, file_format)
+        # Product saves from bulk_create send no signals, so invalidate caches once at the end
+        with ProductCache.coalesce_invalidations():
+            while True:
+                chunk = list(islice(rows, self.batch_size))
+                if not chunk:
+                    break
+                self._import_chunk(chunk)
+            if self.report.products_created:
+                ProductCache.invalidate_product_cache()
+
+        logger.info(
+            'Catalog import for seller %s: %d products, %d images, %d rows rejected',
+            self.seller.pk, self.report.products_created, self.report.images_created, self.report.rows_failed
+        )
+        return self.report
+
+    def _import_chunk(self, chunk):
+        products, image_urls = [], []
+        for line_number, row, error in chunk:
+            if error is None:
+                try:
+                    product, urls = self.clean_row(row)
+                except ValidationError as e:
+                    error = '; '.join(e.messages)
+            if error is not None:
+                self.report.add_error(line_number, error)
+                continue
+            products.append(product)
+            image_urls.append(urls)
+
+        if not products:
+            return
+
+        with transaction.atomic():
+            Product.objects.bulk_create(products, batch_size=self.batch_size)
+            images = [
+                ProductImage(product_id=product.pk, image_url=url, is_primary=(i == 0), sort_order=i)
+                for product, urls in zip(products, image_urls)
+                for i, url in enumerate(urls)
+            ]
+            ProductImage.objects.bulk_create(images, batch_size=self.batch_size)
+            ImagePipeline.enqueue(image.pk for image in images)
+            # Imported products are inactive, so no category counts change
+            ProductCategory.objects.bulk_create(
+                [ProductCategory(product_id=product.pk, category_id=product.category_id, is_active=False)
+                 for product in products],
+                batch_size=self.batch_size
+            )
+
+        self.report.products_created += len(products)
+        self.report.images_created += len(images)
+
+    def clean_row(self, row):
+        """
+        Validate a row and return an unsaved Product and its image URLs
+        """
+        errors = []
+
+        name = str(row.get('name') or '').strip()
+        if not name:
+            errors.append('name is required')
+        elif len(name) > Product._meta.get_field('name').max_length:
+            errors.append('name is too long')
+
+        description = str(row.get('description') or '').strip()
+
+        try:
+            price = Decimal(str(row.get('price', '')).strip())
+            if not price.is_finite() or price < 0 or price.as_tuple().exponent < -2 or price >= 10 ** 8:
+                raise InvalidOperation
+        except InvalidOperation:
+            errors.append('price must be a non-negative amount with at most two decimal places')
+            price = None
+
+        try:
+            quantity = int(str(row.get('quantity', 0) or 0).strip())
+            if quantity < 0:
+                raise ValueError
+        except ValueError:
+            errors.append('quantity must be a non-negative whole number')
+            quantity = None
+
+        category = str(row.get('category') or '').strip()
+        category_id = self._categories.get(category) or self._categories.get(category.lower())
+        if category_id is None:
+            errors.append(f'unknown category "{category}"')
+
+        urls = row.get('image_urls') or []
+        if isinstance(urls, str):
+            urls = urls.split('|')
+        if not isinstance(urls, list):
+            errors.append('image_urls must be a list of URLs')
+            urls = []
+        urls = [str(url).strip() for url in urls if str(url).strip()]
+        if len(urls) > settings.CATALOG_IMPORT_MAX_IMAGES:
+            errors.append(f'at most {settings.CATALOG_IMPORT_MAX_IMAGES} images are allowed')
+        for url in urls:
+            try:
+                validate_url(url)
+            except ValidationError:
+                errors.append(f'invalid image URL "{url}"')
+
+        if errors:
+            raise ValidationError(errors)
+
+        product = Product(
+            seller=self.seller,
+            category_id=category_id,
+            name=name,
+            description=description,
+            price=price,
+            quantity=quantity,
+            is_active=False  # Product needs admin approval
+        )
+        return product, urls
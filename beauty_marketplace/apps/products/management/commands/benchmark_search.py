@@ -0,0 +1,89 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.accounts.models import User
+from apps.products.models import Category, Product
+from apps.products.search import ProductSearchIndex
+
+VOCABULARY = (
+    'serum', 'vitamin', 'cream', 'moisturizer', 'cleanser', 'toner', 'mask', 'lipstick',
+    'foundation', 'concealer', 'mascara', 'eyeliner', 'blush', 'bronzer', 'highlighter',
+    'primer', 'sunscreen', 'spf', 'retinol', 'hyaluronic', 'acid', 'niacinamide', 'peptide',
+    'collagen', 'oil', 'argan', 'jojoba', 'rose', 'lavender', 'tea', 'tree', 'charcoal',
+    'clay', 'gel', 'balm', 'lotion', 'shampoo', 'conditioner', 'hair', 'scalp', 'nail',
+    'polish', 'perfume', 'fragrance', 'musk', 'vanilla', 'matte', 'glossy', 'hydrating',
+    'brightening', 'soothing', 'firming', 'organic', 'vegan', 'sensitive', 'dry', 'oily',
+    'skin', 'face', 'eye', 'lip', 'body', 'night', 'day', 'travel', 'size', 'brush',
+)
+
+CATEGORY_NAMES = ('Skincare', 'Makeup', 'Haircare', 'Fragrances', 'Tools & Accessories')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark search latency against synthetic catalogs (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                            help='Catalog sizes to benchmark')
+        parser.add_argument('--queries', type=int, default=200, help='Queries timed per catalog size')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Products inserted per batch')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        weights = [1.0 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+        with transaction.atomic():
+            seller = User.objects.create_user(
+                username='search-benchmark-seller',
+                email='search-benchmark@example.com',
+                phone='',
+                password=None,
+                user_type='seller'
+            )
+            categories = [Category.objects.create(name=name) for name in CATEGORY_NAMES]
+
+            created = 0
+            for size in sorted(options['sizes']):
+                while created < size:
+                    batch = min(options['batch_size'], size - created)
+                    Product.objects.bulk_create([
+                        Product(
+                            seller=seller,
+                            category=rng.choice(categories),
+                            name=' '.join(rng.choices(VOCABULARY, weights, k=rng.randint(2, 5))).title(),
+                            description=' '.join(rng.choices(VOCABULARY, weights, k=rng.randint(15, 40))),
+                            price=Decimal(rng.randint(100, 20000)) / 100,
+                            quantity=rng.randint(0, 100)
+                        )
+                        for _ in range(batch)
+                    ])
+                    created += batch
+
+                started = time.perf_counter()
+                ProductSearchIndex.rebuild(chunk_size=options['batch_size'])
+                build_seconds = time.perf_counter() - started
+
+                latencies = []
+                for _ in range(options['queries']):
+                    query = ' '.join(rng.choices(VOCABULARY, k=rng.randint(1, 3)))
+                    started = time.perf_counter()
+                    list(Product.objects.search_products(query)[:12])
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+                latencies.sort()
+                p95 = latencies[int(len(latencies) * 0.95) - 1]
+                p99 = latencies[int(len(latencies) * 0.99) - 1]
+                self.stdout.write(
+                    f'{size:>9} products | index build {build_seconds:7.1f}s | '
+                    f'p50 {statistics.median(latencies):7.2f}ms | p95 {p95:7.2f}ms | p99 {p99:7.2f}ms'
+                )
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('Benchmark finished; synthetic data rolled back.'))
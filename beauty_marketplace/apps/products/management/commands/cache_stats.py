@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.utils import CacheStats
+
+
+class Command(BaseCommand):
+    help = 'Show hit, miss, stale and recompute counts for the read-through product caches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after showing them')
+
+    def handle(self, *args, **options):
+        CacheStats.flush()
+        stats = CacheStats.get_stats()
+
+        self.stdout.write(f"{'cache':<20}{'hit':>10}{'miss':>10}{'stale':>10}{'recompute':>11}{'hit rate':>10}")
+        for name, counts in stats.items():
+            lookups = counts['hit'] + counts['miss'] + counts['stale']
+            hit_rate = f"{(counts['hit'] + counts['stale']) / lookups:.1%}" if lookups else '-'
+            self.stdout.write(
+                f"{name:<20}{counts['hit']:>10}{counts['miss']:>10}{counts['stale']:>10}"
+                f"{counts['recompute']:>11}{hit_rate:>10}"
+            )
+
+        if options['reset']:
+            CacheStats.reset()
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
@@ -0,0 +1,42 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounts.models import User
+from apps.products.imports import IMPORT_FORMATS, CatalogImporter, detect_format
+
+
+class Command(BaseCommand):
+    help = "Bulk-import a seller's products from a CSV or JSONL file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file to import')
+        parser.add_argument('--seller', required=True, help='Username of the seller the products belong to')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='File format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, help='Rows written per transaction')
+
+    def handle(self, *args, **options):
+        seller = User.objects.filter(username=options['seller'], user_type='seller').first()
+        if seller is None:
+            raise CommandError(f"No seller named {options['seller']!r}")
+
+        file_format = options['format'] or detect_format(options['path'])
+        if file_format is None:
+            raise CommandError('Cannot tell the file format from its name; pass --format')
+
+        importer = CatalogImporter(seller, batch_size=options['batch_size'])
+        try:
+            with open(options['path'], 'rb') as stream:
+                report = importer.run(stream, file_format)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            raise CommandError(f'Could not read {options["path"]}: {e}')
+
+        for line_number, message in report.errors:
+            self.stderr.write(f'Line {line_number}: {message}')
+        if report.errors_truncated:
+            self.stderr.write(f'... and {report.rows_failed - len(report.errors)} more rejected rows')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {report.products_created} products and {report.images_created} images; '
+            f'rejected {report.rows_failed} rows.'
+        ))
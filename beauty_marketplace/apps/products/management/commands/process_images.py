@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from apps.products.images import ImagePipeline
+from apps.products.models import ImageAsset, ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Render responsive variants for product images that have not been processed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry images whose source failed to decode')
+
+    def handle(self, *args, **options):
+        pending = Q(asset__isnull=True)
+        if options['retry_failed']:
+            pending |= Q(asset__status=ImageAsset.STATUS_FAILED)
+        images = ProductImage.objects.filter(pending)
+
+        processed = failed = 0
+        for image_id in images.values_list('id', flat=True).iterator(chunk_size=500):
+            asset = ImagePipeline.process(image_id)
+            if asset is not None and asset.status == ImageAsset.STATUS_READY:
+                processed += 1
+            else:
+                failed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} images; {failed} could not be processed.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.related import RelatedProductsEngine
+
+
+class Command(BaseCommand):
+    help = 'Add new orders and product views to the related products (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Discard all counts and rebuild from the whole history')
+
+    def handle(self, *args, **options):
+        run = RelatedProductsEngine.run(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Added {run.orders_processed} orders and {run.sessions_processed} sessions; '
+            f're-ranked {run.products_updated} products.'
+        ))
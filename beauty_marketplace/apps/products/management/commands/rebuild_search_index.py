@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.search import ProductSearchIndex
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Products indexed per batch')
+
+    def handle(self, *args, **options):
+        def progress(indexed):
+            self.stdout.write(f'Indexed {indexed} products...')
+
+        indexed = ProductSearchIndex.rebuild(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt with {indexed} products.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.suggestions import SuggestionService
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search suggestion index and publish it to all workers (run periodically)'
+
+    def handle(self, *args, **options):
+        index = SuggestionService.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Suggestion index rebuilt with {len(index)} keys.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.categories import CategoryMembership
+
+
+class Command(BaseCommand):
+    help = 'Backfill primary category links and recount active products per category'
+
+    def handle(self, *args, **options):
+        added, links_fixed, categories_fixed = CategoryMembership.reconcile()
+        self.stdout.write(self.style.SUCCESS(
+            f'Added {added} category links, fixed {links_fixed} links and {categories_fixed} category counts.'
+        ))
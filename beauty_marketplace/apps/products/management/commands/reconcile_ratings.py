@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.ratings import ProductRatingAggregates
+
+
+class Command(BaseCommand):
+    help = 'Recompute product rating aggregates from reviews and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Products checked per batch')
+
+    def handle(self, *args, **options):
+        def progress(checked, fixed):
+            self.stdout.write(f'Checked {checked} products, fixed {fixed}...')
+
+        checked, fixed = ProductRatingAggregates.reconcile(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Reconciled {checked} products; {fixed} needed fixing.'))
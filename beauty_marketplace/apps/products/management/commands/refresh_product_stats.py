@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.stats import ProductStatsEngine
+
+
+class Command(BaseCommand):
+    help = 'Fold changed orders and new product views into the seller dashboard stats (run every few minutes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Discard all stats and rebuild from the whole history')
+
+    def handle(self, *args, **options):
+        run = ProductStatsEngine.run(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed stats of {run.products_updated} products.'))
@@ -1,16 +1,90 @@
-from django.db import models
-from django.db.models import Q, Count, Avg
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import re
+
+from django.db import connections, models, transaction
+from django.db.models import Q, Count, Exists, F, OuterRef, Prefetch
+from django.db.models.expressions import RawSQL
 from django.conf import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class ProductQuerySet(models.QuerySet):
+    """
+    QuerySet for Product with loaders for the data templates render
+    """
+    
+    def with_card_data(self):
+        """
+        Load what a product card shows: seller, category and the first image by sort_order
+        
+        Takes two queries however many products there are; the first image is
+        available as ``product.primary_image``.
+        """
+        from .models import ProductImage
+        
+        return self.select_related('seller', 'category').prefetch_related(
+            Prefetch(
+                'images',
+                queryset=ProductImage.objects.select_related('asset').order_by('sort_order', 'id')[:1],
+                to_attr='card_images'
+            )
+        )
+    
+    def with_detail_data(self):
+        """
+        Load what the product detail page shows: seller with profile, category and all images
+        """
+        from .models import ProductImage
+        
+        return self.select_related('seller__profile', 'category').prefetch_related(
+            Prefetch('images', queryset=ProductImage.objects.select_related('asset').order_by('sort_order', 'id'))
+        )
+    
+    def in_category(self, category_id):
+        """
+        Active products in a category, primary or extra, looked up through its ProductCategory links
+        
+        The link is checked per product with EXISTS rather than collected with
+        IN, so a sorted page walks the storefront index in order and stops at
+        its LIMIT instead of sorting the whole category.
+        """
+        from .models import ProductCategory
+        
+        return self.filter(
+            Exists(ProductCategory.objects.filter(product_id=OuterRef('pk'), category_id=category_id, is_active=True)),
+            is_active=True
+        )
+
+
 class ProductManager(models.Manager):
     """
     Custom manager for Product model with optimized queries
     """
     
+    def get_queryset(self):
+        return ProductQuerySet(self.model, using=self._db)
+    
+    def with_card_data(self):
+        """
+        Get products with everything a product card shows, in constant queries
+        """
+        return self.get_queryset().with_card_data()
+    
+    def with_detail_data(self):
+        """
+        Get products with everything the detail page shows, in constant queries
+        """
+        return self.get_queryset().with_detail_data()
+    
+    def in_category(self, category_id):
+        """
+        Get active products in a category, including products listed there as an extra category
+        """
+        return self.get_queryset().in_category(category_id)
+    
     def get_active_products(self):
         """
         Get all active products
@@ -19,9 +93,9 @@ class ProductManager(models.Manager):
     
     def get_products_by_category(self, category_id):
         """
-        Get products by category with optimization
+        Get products in a category (primary or extra) with optimization
         """
-        return self.filter(category_id=category_id, is_active=True).select_related('seller')
+        return self.in_category(category_id).select_related('seller')
     
     def get_products_with_images(self):
         """
@@ -31,32 +105,43 @@ class ProductManager(models.Manager):
     
     def search_products(self, query):
         """
-        Search products with optimization
+        Search products through the inverted index, ordered by BM25 relevance
+        
+        Ranked ids and scores come from SearchResultCache; the score is mapped
+        back onto rows with a simple CASE so filters, sorting and keyset
+        pagination work as on any other queryset.
         """
+        from .search import SearchResultCache
+        
         if not query:
             return self.get_active_products()
         
-        # Split query into words and build search conditions
-        words = query.split()
-        search_conditions = Q()
+        ids, scores = SearchResultCache.get(query)
+        if not ids:
+            return self.none()
         
-        for word in words:
-            if len(word) >= 2:  # Only search for words with 2+ characters
-                search_conditions |= (
-                    Q(name__icontains=word) |
-                    Q(description__icontains=word)
-                )
+        connection = connections[self.db]
+        column = f'{connection.ops.quote_name(self.model._meta.db_table)}.{connection.ops.quote_name("id")}'
+        # Built as SQL text: a Case() of a thousand When()s takes far longer to compile than to run
+        score = RawSQL(
+            f"CASE {column} {' '.join(['WHEN %s THEN %s'] * len(ids))} ELSE 0 END",
+            [value for pair in zip(ids, scores) for value in pair],
+            output_field=models.FloatField()
+        )
         
-        return self.filter(search_conditions, is_active=True).select_related('seller')
+        return self.filter(
+            is_active=True,
+            id__in=list(ids)
+        ).annotate(
+            search_score=score
+        ).order_by('-search_score', 'id').select_related('seller')
     
     def get_popular_products(self, limit=10):
         """
         Get popular products based on reviews and sales
         """
-        return self.filter(is_active=True).annotate(
-            review_count=Count('reviews'),
-            avg_rating=Avg('reviews__rating')
-        ).filter(
+        return self.filter(
+            is_active=True,
             review_count__gt=0
         ).order_by('-avg_rating', '-review_count')[:limit]
     
@@ -64,10 +149,8 @@ class ProductManager(models.Manager):
         """
         Get featured products (newest with good ratings)
         """
-        return self.filter(is_active=True).annotate(
-            review_count=Count('reviews'),
-            avg_rating=Avg('reviews__rating')
-        ).filter(
+        return self.filter(
+            is_active=True,
             review_count__gte=3,  # At least 3 reviews
             avg_rating__gte=4.0   # At least 4 star average
         ).order_by('-created_at')[:limit]
@@ -86,11 +169,11 @@ class CategoryManager(models.Manager):
     
     def get_categories_with_product_counts(self):
         """
-        Get categories with product counts
+        Get categories that have active products, with the count as product_count
         """
-        return self.get_active_categories().annotate(
-            product_count=Count('products', filter=Q(products__is_active=True))
-        ).filter(product_count__gt=0).order_by('name')
+        return self.get_active_categories().filter(active_product_count__gt=0).annotate(
+            product_count=F('active_product_count')
+        ).order_by('name')
 
 
 class ProductImageManager(models.Manager):
@@ -109,6 +192,53 @@ class ProductImageManager(models.Manager):
         Get images for multiple products efficiently
         """
         return self.filter(product_id__in=product_ids).select_related('product')
+    
+    def sync_for_product(self, product, image_urls):
+        """
+        Make a product's images match image_urls (in order; the first is primary)
+        
+        Images whose URL is still listed keep their row and id; only their
+        sort_order and is_primary are updated, and only if they changed. New
+        URLs are bulk-inserted and dropped ones deleted in a single statement.
+        Returns the number of (created, updated, deleted) images.
+        """
+        from .images import ImagePipeline
+        from .snapshots import HomePageSnapshot
+        from .utils import ProductCache
+        
+        image_urls = [url for url in image_urls if url]
+        existing = defaultdict(deque)
+        for image in self.filter(product=product).order_by('sort_order', 'id'):
+            existing[image.image_url].append(image)
+        
+        created, updated = [], []
+        for i, image_url in enumerate(image_urls):
+            if existing[image_url]:
+                image = existing[image_url].popleft()
+                if (image.sort_order, image.is_primary) != (i, i == 0):
+                    image.sort_order, image.is_primary = i, i == 0
+                    updated.append(image)
+            else:
+                created.append(self.model(product=product, image_url=image_url, is_primary=(i == 0), sort_order=i))
+        removed = [image.pk for images in existing.values() for image in images]
+        
+        if not (created or updated or removed):
+            return 0, 0, 0
+        
+        # Bulk writes send no signals, so invalidate the product's caches here, once
+        with ProductCache.coalesce_invalidations(), transaction.atomic():
+            if removed:
+                self.filter(pk__in=removed).delete()
+            if updated:
+                self.bulk_update(updated, ['sort_order', 'is_primary'])
+            if created:
+                self.bulk_create(created)
+                ImagePipeline.enqueue(image.pk for image in created)
+            ProductCache.invalidate_product_cache(product.pk)
+            if HomePageSnapshot.shows_product(product.pk):
+                HomePageSnapshot.schedule_refresh()
+        
+        return len(created), len(updated), len(removed)
 
 
 class ProductReviewManager(models.Manager):
@@ -164,12 +294,84 @@ class DatabaseOptimizer:
         """
         return queryset.select_related('user__profile', 'product')
     
+    @staticmethod
+    def explain(queryset):
+        """
+        Return the database's query plan for a queryset
+        
+        On PostgreSQL sequential scans and sorts are disabled while explaining,
+        so a Seq Scan or Sort left in the plan means no index can serve the
+        query, even on tables small enough that the planner would normally
+        skip the index.
+        """
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            with transaction.atomic(using=queryset.db):
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                    cursor.execute('SET LOCAL enable_sort = off')
+                return queryset.explain()
+        return queryset.explain()
+    
+    @staticmethod
+    @contextmanager
+    def capture_page_querysets():
+        """
+        Collect the query of every KeysetPaginator page read inside the block, e.g. by a view under test
+        """
+        from .pagination import KeysetPaginator
+        
+        querysets = []
+        get_page = KeysetPaginator.get_page
+        
+        def recording_get_page(paginator, query_params=None):
+            querysets.append(paginator.page_queryset(query_params))
+            return get_page(paginator, query_params)
+        
+        KeysetPaginator.get_page = recording_get_page
+        try:
+            yield querysets
+        finally:
+            KeysetPaginator.get_page = get_page
+    
+    @staticmethod
+    def plan_problems(queryset):
+        """
+        Return what makes the query plan read more rows than it returns: full scans and sorts
+        
+        An index walked in the query's order is fine, as the walk stops at the
+        LIMIT; the same walk feeding a sort reads the whole index first.
+        Understands PostgreSQL and SQLite plans; other backends report none.
+        """
+        plan = DatabaseOptimizer.explain(queryset)
+        vendor = connections[queryset.db].vendor
+        if vendor == 'postgresql':
+            problems = [f'full scan of {table}' for table in re.findall(r'Seq Scan on (\w+)', plan)]
+            # Sorts feeding a GROUP BY group rows for aggregates; ORDER BY sorts are what a page must avoid
+            nodes = re.findall(r'^\s*(?:->\s+)?(\w[\w ]*?)\s+\(cost=.*\n(?:\s+Sort Key: (.+))?', plan, re.MULTILINE)
+            for parent, (node, sort_key) in zip([('', '')] + nodes, nodes):
+                if sort_key and parent[0] != 'GroupAggregate':
+                    problems.append(f'sort on {sort_key}')
+            return problems
+        if vendor == 'sqlite':
+            # A bare "SCAN table" reads every row
+            problems = [f'full scan of {table}' for table in re.findall(r'\bSCAN (\w+)\s*$', plan, re.MULTILINE)]
+            sorts = re.findall(r'USE TEMP B-TREE FOR (.*ORDER BY)', plan)
+            if sorts:
+                problems += [
+                    f'full index scan of {table}'
+                    for table in re.findall(r'\bSCAN (\w+) USING (?:COVERING )?INDEX', plan)
+                ]
+            return problems + [f'temp sort for {sort}' for sort in sorts]
+        return []
+    
     @staticmethod
     def get_products_with_review_stats():
         """
-        Get products with review statistics
+        Get products with review statistics (stored on the product rows)
         """
-        return ProductManager().get_queryset().annotate(
-            review_count=Count('reviews'),
-            avg_rating=Avg('reviews__rating')
-        )
\ No newline at end of file
+        from .models import Product
+        
+        return Product.objects.only(
+            'id', 'name', 'price', 'review_count', 'rating_sum', 'avg_rating'
+        )
@@ -1,6 +1,9 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Q
 from django.utils import timezone
 from apps.accounts.models import User
+from .managers import CategoryManager, ProductImageManager, ProductManager, ProductReviewManager
 
 
 class Category(models.Model):
@@ -9,6 +12,11 @@ class Category(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(default=timezone.now)
     
+    # Active products linked through ProductCategory, maintained by CategoryMembership
+    active_product_count = models.PositiveIntegerField(default=0)
+    
+    objects = CategoryManager()
+    
     def __str__(self):
         return self.name
     
@@ -27,8 +35,91 @@ class Product(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Review statistics, maintained incrementally by ProductRatingAggregates
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    avg_rating = models.FloatField(default=0.0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+    
+    objects = ProductManager()
+    
     def __str__(self):
         return self.name
+    
+    def save(self, *args, **kwargs):
+        # post_save handlers adjust category counts; commit them together with the row
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+    
+    @property
+    def primary_image(self):
+        """
+        First image by sort_order, or None; free when loaded with_card_data()
+        """
+        if hasattr(self, 'card_images'):
+            return self.card_images[0] if self.card_images else None
+        return self.images.order_by('sort_order', 'id').first()
+    
+    @property
+    def rating_histogram(self):
+        """
+        List of (stars, review count) from 5 stars down to 1
+        """
+        return [(stars, getattr(self, f'rating_{stars}_count')) for stars in range(5, 0, -1)]
+    
+    class Meta:
+        indexes = [
+            # Storefront listings only ever read active products; each index ends
+            # with id so keyset pagination can seek on it
+            models.Index(
+                fields=['-avg_rating', '-review_count', '-id'], condition=Q(is_active=True), name='product_active_rating_idx'
+            ),
+            models.Index(fields=['-created_at', '-id'], condition=Q(is_active=True), name='product_active_newest_idx'),
+            models.Index(
+                fields=['category', '-created_at', '-id'], condition=Q(is_active=True), name='product_active_category_idx'
+            ),
+            models.Index(fields=['price', 'id'], condition=Q(is_active=True), name='product_active_price_idx'),
+            models.Index(fields=['seller', '-created_at', '-id'], name='product_seller_newest_idx'),
+            models.Index(fields=['-created_at', '-id'], name='product_newest_idx'),  # admin approval list, all statuses
+        ]
+
+
+class ImageAsset(models.Model):
+    """
+    Resized variants of one source image, identified by the SHA-256 of its bytes
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    
+    sha256 = models.CharField(max_length=64, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    variants = models.JSONField(default=list)  # [{'name', 'width', 'height', 'webp', 'jpeg'}], smallest first
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Image {self.sha256[:12]}"
+    
+    @staticmethod
+    def url(path):
+        return '/' + settings.MEDIA_URL.strip('/') + '/' + path
+    
+    def srcset(self, extension):
+        """
+        srcset attribute value listing every variant in one format
+        """
+        return ', '.join(f"{self.url(variant[extension])} {variant['width']}w" for variant in self.variants)
 
 
 class ProductImage(models.Model):
@@ -37,17 +128,47 @@ class ProductImage(models.Model):
     is_primary = models.BooleanField(default=False)
     sort_order = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(default=timezone.now)
+    asset = models.ForeignKey(
+        ImageAsset, on_delete=models.SET_NULL, null=True, blank=True, related_name='product_images'
+    )  # set by ImagePipeline once the variants exist
+    
+    objects = ProductImageManager()
     
     def __str__(self):
         return f"Image for {self.product.name}"
     
+    @property
+    def is_processed(self):
+        return self.asset is not None and self.asset.status == ImageAsset.STATUS_READY
+    
+    @property
+    def src(self):
+        """
+        Fallback src: the largest JPEG variant, or the original URL until processed
+        """
+        if self.is_processed and self.asset.variants:
+            return self.asset.url(self.asset.variants[-1]['jpeg'])
+        return self.image_url
+    
+    @property
+    def srcset_webp(self):
+        return self.asset.srcset('webp') if self.is_processed else ''
+    
+    @property
+    def srcset_jpeg(self):
+        return self.asset.srcset('jpeg') if self.is_processed else ''
+    
     class Meta:
         ordering = ['sort_order']
 
 
 class ProductCategory(models.Model):
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    """
+    A product's membership in one of its categories (its primary category included)
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='category_links')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='product_links')
+    is_active = models.BooleanField(default=True)  # copy of product.is_active, for the browsing index
     created_at = models.DateTimeField(default=timezone.now)
     
     def __str__(self):
@@ -55,6 +176,9 @@ class ProductCategory(models.Model):
     
     class Meta:
         unique_together = ('product', 'category')
+        indexes = [
+            models.Index(fields=['category', 'product'], condition=Q(is_active=True), name='productcategory_active_idx'),
+        ]
 
 
 class ProductReview(models.Model):
@@ -65,8 +189,122 @@ class ProductReview(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ProductReviewManager()
+    
     def __str__(self):
         return f"Review for {self.product.name} by {self.user.username}"
     
     class Meta:
         unique_together = ('product', 'user')
+        indexes = [
+            models.Index(fields=['product', '-created_at', '-id'], name='review_product_newest_idx'),
+        ]
+
+
+class SearchDocument(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    length = models.PositiveIntegerField(default=0)  # weighted token count
+    indexed_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Search document for product {self.product_id}"
+
+
+class SearchTerm(models.Model):
+    term = models.CharField(max_length=64, unique=True)
+    document_frequency = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return self.term
+
+
+class SearchPosting(models.Model):
+    term = models.ForeignKey(SearchTerm, on_delete=models.CASCADE, related_name='postings')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_postings')
+    term_frequency = models.PositiveIntegerField(default=1)
+    document_length = models.PositiveIntegerField(default=0)  # copied from SearchDocument so scoring needs no join
+    
+    def __str__(self):
+        return f"{self.term.term} in product {self.product_id}"
+    
+    class Meta:
+        unique_together = ('term', 'product')
+
+
+class ProductAffinity(models.Model):
+    """
+    Number of baskets (orders and browsing sessions) containing both products
+
+    Rows where product and other are the same hold that product's own basket counts.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='affinities')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    order_count = models.PositiveIntegerField(default=0)
+    session_count = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Product {self.product_id} with product {self.other_id}"
+    
+    class Meta:
+        unique_together = ('product', 'other')
+
+
+class RelatedProducts(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='related')
+    product_ids = models.JSONField(default=list)  # most similar first
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Related products for product {self.product_id}"
+
+
+class RelatedProductsRun(models.Model):
+    last_order_id = models.PositiveBigIntegerField(default=0)  # orders up to here are counted
+    views_through = models.DateField(null=True, blank=True)  # product views up to this day are counted
+    orders_processed = models.PositiveIntegerField(default=0)
+    sessions_processed = models.PositiveIntegerField(default=0)
+    products_updated = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Related products run at {self.finished_at}"
+
+
+class ProductStats(models.Model):
+    """
+    Sales and view totals per product, refreshed by ProductStatsEngine for the seller dashboard
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    units_sold = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    views_7d = models.PositiveIntegerField(default=0)
+    views_30d = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Stats for product {self.product_id}"
+
+
+class ProductViewDaily(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_views')
+    day = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.views} views of product {self.product_id} on {self.day}"
+    
+    class Meta:
+        unique_together = ('product', 'day')
+        indexes = [
+            models.Index(fields=['day'], name='viewdaily_day_idx'),
+        ]
+
+
+class ProductStatsRun(models.Model):
+    last_view_id = models.PositiveBigIntegerField(default=0)  # product views up to here are rolled up
+    started_at = models.DateTimeField(default=timezone.now)  # orders changed after this are picked up next run
+    products_updated = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Product stats run at {self.finished_at}"
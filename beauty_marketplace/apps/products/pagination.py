@@ -0,0 +1,226 @@
+import datetime
+import json
+
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.http import QueryDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    JSON encoder that keeps full microsecond precision on datetimes
+
+    DjangoJSONEncoder truncates to milliseconds, which would make the equality
+    half of the seek condition miss rows.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CursorJSONSerializer:
+    """
+    JSON serializer for cursor tokens that understands dates and decimals
+    """
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'), cls=CursorEncoder).encode('latin-1')
+
+    def loads(self, data):
+        return json.loads(data.decode('latin-1'))
+
+
+class CursorPage:
+    """
+    A single page of keyset-paginated results
+    """
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor=None, previous_cursor=None,
+                 estimated_count=None, estimate_is_lower_bound=False, query_params=None, cursor_param='cursor'):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.estimated_count = estimated_count
+        self.estimate_is_lower_bound = estimate_is_lower_bound
+        self._query_params = query_params
+        self._cursor_param = cursor_param
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __repr__(self):
+        return f"<CursorPage of {len(self.object_list)} items>"
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _querystring(self, cursor):
+        """
+        Current query string (filters, sort) with the cursor replaced
+        """
+        params = QueryDict(mutable=True)
+        if self._query_params is not None:
+            params.update(self._query_params)
+        params.pop('page', None)
+        params[self._cursor_param] = cursor
+        return f"?{params.urlencode()}"
+
+    @property
+    def next_querystring(self):
+        return self._querystring(self.next_cursor) if self.next_cursor else ''
+
+    @property
+    def previous_querystring(self):
+        return self._querystring(self.previous_cursor) if self.previous_cursor else ''
+
+
+class KeysetPaginator:
+    """
+    Cursor-based paginator that seeks on the ordering columns instead of using OFFSET
+
+    ``ordering`` must end with a unique column (normally ``id``) so every row has a
+    distinct position. Cursors are signed, opaque tokens holding the ordering values
+    of the first or last row on a page.
+    """
+
+    SALT = 'apps.products.pagination'
+
+    def __init__(self, queryset, per_page, ordering, cursor_param='cursor', estimate_count=False,
+                 count_cap=1000):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.cursor_param = cursor_param
+        self.estimate_count = estimate_count
+        self.count_cap = count_cap
+
+    @property
+    def _fields(self):
+        return [(field.lstrip('-'), field.startswith('-')) for field in self.ordering]
+
+    def encode_cursor(self, direction, obj):
+        values = [getattr(obj, name) for name, _ in self._fields]
+        token = signing.dumps([direction, values], salt=self.SALT, serializer=CursorJSONSerializer, compress=True)
+        # Hex keeps the token free of '-' and word-like runs that SecurityMiddleware rejects
+        return token.encode('ascii').hex()
+
+    def decode_cursor(self, cursor):
+        """
+        Return (direction, values) for a cursor token, or None if it is missing or invalid
+        """
+        if not cursor:
+            return None
+        try:
+            token = bytes.fromhex(cursor).decode('ascii')
+            direction, values = signing.loads(token, salt=self.SALT, serializer=CursorJSONSerializer)
+        except (signing.BadSignature, ValueError, TypeError):
+            logger.info("Ignoring invalid pagination cursor")
+            return None
+        if direction not in ('next', 'prev') or len(values) != len(self.ordering):
+            return None
+        return direction, values
+
+    def _seek_filter(self, values, backwards):
+        """
+        Build the row-value comparison (a, b) > (x, y) as nested Q objects
+        """
+        condition = Q()
+        equal_so_far = Q()
+        for (name, descending), value in zip(self._fields, values):
+            after = descending != backwards  # descending columns seek with "less than"
+            lookup = f"{name}__lt" if after else f"{name}__gt"
+            condition |= equal_so_far & Q(**{lookup: value})
+            equal_so_far &= Q(**{name: value})
+        return condition
+
+    def _page_query(self, query_params):
+        cursor = query_params.get(self.cursor_param) if query_params is not None else None
+        decoded = self.decode_cursor(cursor)
+
+        backwards = decoded is not None and decoded[0] == 'prev'
+        if backwards:
+            ordering = [field[1:] if field.startswith('-') else f"-{field}" for field in self.ordering]
+        else:
+            ordering = list(self.ordering)
+
+        queryset = self.queryset.order_by(*ordering)
+        if decoded is not None:
+            queryset = queryset.filter(self._seek_filter(decoded[1], backwards))
+        return queryset[:self.per_page + 1], decoded, backwards
+
+    def page_queryset(self, query_params=None):
+        """
+        The query get_page() reads its rows with, e.g. to check its query plan
+        """
+        return self._page_query(query_params)[0]
+
+    def get_page(self, query_params=None):
+        """
+        Return the CursorPage selected by the cursor in query_params (first page if none)
+        """
+        queryset, decoded, backwards = self._page_query(query_params)
+        rows = list(queryset)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backwards:
+            rows.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = decoded is not None, has_more
+
+        estimated_count = None
+        lower_bound = False
+        if self.estimate_count:
+            estimated_count, lower_bound = estimate_count(self.queryset, cap=self.count_cap)
+
+        return CursorPage(
+            rows,
+            has_next=has_next and bool(rows),
+            has_previous=has_previous and bool(rows),
+            next_cursor=self.encode_cursor('next', rows[-1]) if rows and has_next else None,
+            previous_cursor=self.encode_cursor('prev', rows[0]) if rows and has_previous else None,
+            estimated_count=estimated_count,
+            estimate_is_lower_bound=lower_bound,
+            query_params=query_params,
+            cursor_param=self.cursor_param,
+        )
+
+
+def estimate_count(queryset, cap=1000):
+    """
+    Estimate the number of rows in a queryset without a full COUNT(*)
+
+    On PostgreSQL this reads the planner's row estimate. Elsewhere it counts at
+    most ``cap`` rows. Returns (count, is_lower_bound).
+    """
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+
+    if connection.vendor == 'postgresql':
+        try:
+            plan = json.loads(queryset.explain(format='json'))
+            return int(plan[0]['Plan']['Plan Rows']), False
+        except Exception as e:
+            logger.warning(f"Could not estimate row count from query plan: {e}")
+
+    count = queryset[:cap + 1].count()
+    if count > cap:
+        return cap, True
+    return count, False
@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Value, When
+from django.db.models.functions import Cast
+import logging
+
+logger = logging.getLogger(__name__)
+
+RATING_VALUES = range(1, 6)
+
+
+def histogram_field(rating):
+    """
+    Name of the Product column counting reviews with this rating
+    """
+    return f'rating_{rating}_count'
+
+
+class ProductRatingAggregates:
+    """
+    Incrementally maintained review statistics stored on Product rows
+    """
+
+    @staticmethod
+    def apply_delta(product_id, added=None, removed=None):
+        """
+        Add and/or remove one rating from a product's aggregates in a single UPDATE
+
+        Every column is computed from the row's current values inside the same
+        statement, so concurrent reviews cannot lose updates.
+        """
+        from .models import Product
+
+        if added == removed:
+            return 0  # Rating unchanged
+
+        count_delta = (added is not None) - (removed is not None)
+        sum_delta = (added or 0) - (removed or 0)
+
+        updates = {}
+        if count_delta:
+            updates['review_count'] = F('review_count') + count_delta
+        if sum_delta:
+            updates['rating_sum'] = F('rating_sum') + sum_delta
+        if added is not None:
+            updates[histogram_field(added)] = F(histogram_field(added)) + 1
+        if removed is not None:
+            updates[histogram_field(removed)] = F(histogram_field(removed)) - 1
+
+        new_count = F('review_count') + count_delta
+        updates['avg_rating'] = Case(
+            When(
+                review_count__gt=-count_delta,
+                then=Cast(F('rating_sum') + sum_delta, FloatField()) / Cast(new_count, FloatField())
+            ),
+            default=Value(0.0),
+            output_field=FloatField()
+        )
+
+        return Product.objects.filter(pk=product_id).update(**updates)
+
+    @staticmethod
+    def compute(product_ids):
+        """
+        Recompute aggregates for the given products from their reviews
+        """
+        from .models import ProductReview
+
+        stats = {
+            product_id: {histogram_field(rating): 0 for rating in RATING_VALUES}
+            for product_id in product_ids
+        }
+        rows = ProductReview.objects.filter(
+            product_id__in=product_ids
+        ).values('product_id', 'rating').annotate(count=Count('id')).order_by()
+        for row in rows:
+            stats[row['product_id']][histogram_field(row['rating'])] = row['count']
+
+        for values in stats.values():
+            review_count = sum(values[histogram_field(rating)] for rating in RATING_VALUES)
+            rating_sum = sum(rating * values[histogram_field(rating)] for rating in RATING_VALUES)
+            values['review_count'] = review_count
+            values['rating_sum'] = rating_sum
+            values['avg_rating'] = rating_sum / review_count if review_count else 0.0
+        return stats
+
+    @staticmethod
+    def reconcile(chunk_size=1000, progress=None):
+        """
+        Recompute aggregates for every product in chunks, fixing rows that drifted
+
+        Returns (products checked, products fixed).
+        """
+        from .models import Product
+        from .utils import ProductCache
+
+        fields = ['review_count', 'rating_sum', 'avg_rating'] + [histogram_field(r) for r in RATING_VALUES]
+        checked = fixed = 0
+        last_id = 0
+
+        while True:
+            product_ids = list(
+                Product.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not product_ids:
+                break
+            last_id = product_ids[-1]
+
+            with transaction.atomic():
+                # Lock the chunk so concurrent review writes wait for the corrected values
+                products = list(
+                    Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').only('pk', *fields)
+                )
+                stats = ProductRatingAggregates.compute(product_ids)
+
+                stale = []
+                for product in products:
+                    expected = stats[product.pk]
+                    if any(abs(getattr(product, f) - expected[f]) > 1e-9 for f in fields):
+                        for f in fields:
+                            setattr(product, f, expected[f])
+                        stale.append(product)
+                if stale:
+                    Product.objects.bulk_update(stale, fields)
+                    # bulk_update sends no signals, so invalidate the fixed products here
+                    with ProductCache.coalesce_invalidations():
+                        for product in stale:
+                            ProductCache.invalidate_product_cache(product.pk)
+
+            checked += len(products)
+            fixed += len(stale)
+            if progress:
+                progress(checked, fixed)
+
+        if fixed:
+            logger.warning(f"Rating aggregates were out of date on {fixed} products")
+        return checked, fixed
@@ -0,0 +1,235 @@
+from datetime import timedelta
+
+import numpy as np
+from scipy import sparse
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Min
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def cooccurrence(basket_ids, product_ids, size):
+    """
+    Count the baskets shared by every pair of products
+
+    ``basket_ids`` and ``product_ids`` are parallel arrays with one entry per
+    (basket, product) occurrence. Returns a sparse symmetric ``size`` x ``size``
+    matrix indexed by product id whose diagonal holds baskets per product.
+    """
+    if not len(basket_ids):
+        return sparse.csr_matrix((size, size), dtype=np.int64)
+
+    _, basket_index = np.unique(basket_ids, return_inverse=True)
+    baskets = sparse.csr_matrix(
+        (np.ones(len(basket_index), dtype=np.int64), (basket_index, product_ids)),
+        shape=(basket_index.max() + 1, size)
+    )
+    baskets.data[:] = 1  # a product bought twice in one order is one occurrence
+    return (baskets.T @ baskets).tocsr()
+
+
+def top_neighbours(products, others, scores, limit):
+    """
+    Return {product: [other, ...]} keeping the ``limit`` best-scoring others per product
+    """
+    order = np.lexsort((-scores, products))
+    products, others = products[order], others[order]
+    _, starts, counts = np.unique(products, return_index=True, return_counts=True)
+    rank = np.arange(len(products)) - np.repeat(starts, counts)
+    keep = rank < limit
+
+    neighbours = {}
+    for product, other in zip(products[keep].tolist(), others[keep].tolist()):
+        neighbours.setdefault(product, []).append(other)
+    return neighbours
+
+
+class RelatedProductsEngine:
+    """
+    Offline item-to-item recommendations from co-purchases and co-views
+
+    Products bought in the same order or viewed in the same browsing session
+    (a user or anonymous session on one day) are related. Shared basket counts
+    are kept in ProductAffinity and only grow, so each run adds the orders and
+    completed days of views since the last RelatedProductsRun and re-ranks the
+    products they touch. Similarity is cosine over weighted basket counts.
+    """
+
+    @staticmethod
+    def load_orders(after_id, through_id):
+        from apps.orders.models import OrderItem
+
+        rows = OrderItem.objects.filter(
+            order_id__gt=after_id, order_id__lte=through_id
+        ).exclude(order__status='cancelled').values_list('order_id', 'product_id')
+        pairs = np.fromiter(
+            (value for row in rows.iterator(chunk_size=10000) for value in row), dtype=np.int64
+        ).reshape(-1, 2)
+        return pairs[:, 0], pairs[:, 1]
+
+    @staticmethod
+    def load_sessions(first_day, last_day):
+        from apps.analytics.models import ProductView
+
+        rows = ProductView.objects.filter(
+            created_at__date__gte=first_day, created_at__date__lte=last_day
+        ).exclude(user__isnull=True, session_key='').values_list(
+            'user_id', 'session_key', 'created_at__date', 'product_id'
+        )
+
+        session_ids = {}
+        baskets, products = [], []
+        for user_id, session_key, day, product_id in rows.iterator(chunk_size=10000):
+            visitor = ('user', user_id) if user_id else ('session', session_key)
+            baskets.append(session_ids.setdefault((visitor, day), len(session_ids)))
+            products.append(product_id)
+        return np.array(baskets, dtype=np.int64), np.array(products, dtype=np.int64)
+
+    @staticmethod
+    def merge_counts(order_counts, session_counts):
+        """
+        Add new shared basket counts to ProductAffinity; returns the products touched
+        """
+        from .models import ProductAffinity
+
+        size = order_counts.shape[0]
+        order_counts, session_counts = order_counts.tocoo(), session_counts.tocoo()
+        order_keys = order_counts.row.astype(np.int64) * size + order_counts.col
+        session_keys = session_counts.row.astype(np.int64) * size + session_counts.col
+
+        keys = np.union1d(order_keys, session_keys)
+        added_orders = np.zeros(len(keys), dtype=np.int64)
+        added_sessions = np.zeros(len(keys), dtype=np.int64)
+        added_orders[np.searchsorted(keys, order_keys)] = order_counts.data
+        added_sessions[np.searchsorted(keys, session_keys)] = session_counts.data
+        products, others = keys // size, keys % size
+
+        touched = np.unique(products)
+        for chunk in np.array_split(touched, max(1, len(touched) // 1000)):
+            in_chunk = np.isin(products, chunk)
+            existing = {
+                (row.product_id, row.other_id): row
+                for row in ProductAffinity.objects.filter(product_id__in=chunk.tolist())
+            }
+            created, updated = [], []
+            for product, other, orders, sessions in zip(
+                products[in_chunk].tolist(), others[in_chunk].tolist(),
+                added_orders[in_chunk].tolist(), added_sessions[in_chunk].tolist()
+            ):
+                row = existing.get((product, other))
+                if row is None:
+                    created.append(ProductAffinity(
+                        product_id=product, other_id=other, order_count=orders, session_count=sessions
+                    ))
+                else:
+                    row.order_count += orders
+                    row.session_count += sessions
+                    updated.append(row)
+            ProductAffinity.objects.bulk_create(created, batch_size=5000)
+            ProductAffinity.objects.bulk_update(updated, ['order_count', 'session_count'], batch_size=5000)
+        return touched.tolist()
+
+    @staticmethod
+    def rank(product_ids):
+        """
+        Recompute the stored neighbours of the given products from ProductAffinity
+        """
+        from .models import ProductAffinity, RelatedProducts
+
+        view_weight = settings.RELATED_VIEW_WEIGHT
+        updated = 0
+        for start in range(0, len(product_ids), 1000):
+            chunk = product_ids[start:start + 1000]
+            rows = np.array(
+                list(ProductAffinity.objects.filter(product_id__in=chunk).values_list(
+                    'product_id', 'other_id', 'order_count', 'session_count'
+                )),
+                dtype=np.int64
+            ).reshape(-1, 4)
+            products, others = rows[:, 0], rows[:, 1]
+            shared = rows[:, 2] + view_weight * rows[:, 3]
+
+            pairs = (products != others) & (rows[:, 2] + rows[:, 3] >= settings.RELATED_MIN_SUPPORT)
+            totals = {
+                product: orders + view_weight * sessions
+                for product, orders, sessions in ProductAffinity.objects.filter(
+                    product_id=F('other_id'), product_id__in=set(others[pairs].tolist()) | set(chunk)
+                ).values_list('product_id', 'order_count', 'session_count')
+            }
+            lookup = np.vectorize(lambda product: totals.get(product, 0.0), otypes=[float])
+
+            products, others, shared = products[pairs], others[pairs], shared[pairs]
+            if len(products):
+                scores = shared / np.sqrt(lookup(products) * lookup(others))
+                neighbours = top_neighbours(products, others, scores, settings.RELATED_PRODUCTS_STORED)
+            else:
+                neighbours = {}
+
+            RelatedProducts.objects.bulk_create(
+                [RelatedProducts(product_id=product, product_ids=ids) for product, ids in neighbours.items()],
+                update_conflicts=True, unique_fields=['product'], update_fields=['product_ids', 'updated_at']
+            )
+            updated += len(neighbours)
+        return updated
+
+    @staticmethod
+    def run(full=False):
+        """
+        Fold new orders and completed days of product views into the related products
+
+        With ``full`` all counts are dropped and rebuilt from the whole history.
+        Returns the RelatedProductsRun recorded for this run.
+        """
+        from apps.analytics.models import ProductView
+        from apps.orders.models import Order
+        from .models import Product, ProductAffinity, RelatedProducts, RelatedProductsRun
+        from .utils import ProductCache
+
+        with transaction.atomic():
+            if full:
+                ProductAffinity.objects.all().delete()
+                RelatedProducts.objects.all().delete()
+                RelatedProductsRun.objects.all().delete()
+            last_run = RelatedProductsRun.objects.order_by('-finished_at', '-id').first()
+
+            last_order_id = last_run.last_order_id if last_run else 0
+            through_order_id = Order.objects.aggregate(last=Max('id'))['last'] or last_order_id
+
+            # Today's sessions are still open, so views are only counted up to yesterday
+            views_through = timezone.localdate() - timedelta(days=1)
+            if last_run and last_run.views_through:
+                views_from = last_run.views_through + timedelta(days=1)
+            else:
+                first_view = ProductView.objects.aggregate(first=Min('created_at'))['first']
+                views_from = timezone.localdate(first_view) if first_view else views_through + timedelta(days=1)
+
+            size = (Product.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+            order_ids, order_products = RelatedProductsEngine.load_orders(last_order_id, through_order_id)
+            session_ids, session_products = RelatedProductsEngine.load_sessions(views_from, views_through)
+
+            touched = RelatedProductsEngine.merge_counts(
+                cooccurrence(order_ids, order_products, size),
+                cooccurrence(session_ids, session_products, size)
+            )
+            updated = RelatedProductsEngine.rank(touched)
+
+            run = RelatedProductsRun.objects.create(
+                last_order_id=through_order_id,
+                views_through=max(views_through, views_from - timedelta(days=1)),
+                orders_processed=len(np.unique(order_ids)),
+                sessions_processed=len(np.unique(session_ids)),
+                products_updated=updated,
+            )
+
+        if updated:
+            # Related products are cached in the list namespace
+            ProductCache.bump_namespace(ProductCache.NAMESPACE_LIST)
+        logger.info(
+            f"Related products: {run.orders_processed} orders and {run.sessions_processed} sessions "
+            f"added, {updated} products re-ranked"
+        )
+        return run
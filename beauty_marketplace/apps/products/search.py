@@ -0,0 +1,474 @@
+from array import array
+from collections import Counter, OrderedDict
+from functools import lru_cache
+import hashlib
+import math
+import re
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+import logging
+
+from .utils import CacheStats, ProductCache
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+STOP_WORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'with',
+})
+
+# Name matches count more than category matches, which count more than
+# description matches (a poor man's BM25F).
+FIELD_WEIGHTS = (
+    ('name', 3),
+    ('category', 2),
+    ('description', 1),
+)
+
+MAX_TERM_LENGTH = 64
+
+
+@lru_cache(maxsize=100000)
+def stem(token):
+    """
+    Light suffix-stripping stemmer (plurals, -ing, -ed, -ly)
+    """
+    if len(token) <= 3 or token.isdigit():
+        return token
+
+    if token.endswith('ies') and len(token) > 4:
+        token = token[:-3] + 'y'
+    elif token.endswith('sses'):
+        token = token[:-2]
+    elif token.endswith(('ches', 'shes', 'xes', 'zes')):
+        token = token[:-2]
+    elif token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        token = token[:-1]
+
+    if token.endswith('ing') and len(token) > 5:
+        token = token[:-3]
+    elif token.endswith('ed') and len(token) > 4:
+        token = token[:-2]
+    elif token.endswith('ly') and len(token) > 4:
+        token = token[:-2]
+
+    return token
+
+
+def tokenize(text):
+    """
+    Split text into normalized, stemmed tokens with stop words removed
+    """
+    if not text:
+        return []
+
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = text.lower()
+
+    tokens = []
+    for token in TOKEN_RE.findall(text):
+        if token in STOP_WORDS or len(token) < 2:
+            continue
+        token = stem(token)[:MAX_TERM_LENGTH]
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+def normalize_query(query):
+    """
+    The distinct index terms of a query, sorted
+
+    Case, accents, spacing, stop words, word order and plural endings change
+    neither which products match nor their scores, so queries that differ only
+    in those share one cached result.
+    """
+    return tuple(sorted(set(tokenize(query))))
+
+
+def document_terms(product):
+    """
+    Build the weighted term frequencies for a product
+    """
+    fields = {
+        'name': product.name,
+        'category': product.category.name if product.category_id else '',
+        'description': product.description,
+    }
+
+    counts = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(fields[field]):
+            counts[token] += weight
+    return counts
+
+
+class ProductSearchIndex:
+    """
+    Inverted index over product name, category and description, ranked with BM25
+    """
+
+    STATS_CACHE_KEY = 'search_index:stats'
+
+    @staticmethod
+    def _ensure_terms(terms):
+        """
+        Return a mapping of term -> SearchTerm id, creating missing terms
+        """
+        from .models import SearchTerm
+
+        terms = set(terms)
+        if not terms:
+            return {}
+
+        term_ids = dict(SearchTerm.objects.filter(term__in=terms).values_list('term', 'id'))
+        missing = terms - set(term_ids)
+        if missing:
+            SearchTerm.objects.bulk_create(
+                [SearchTerm(term=term) for term in missing],
+                ignore_conflicts=True
+            )
+            term_ids.update(SearchTerm.objects.filter(term__in=missing).values_list('term', 'id'))
+        return term_ids
+
+    @staticmethod
+    @transaction.atomic
+    def index_product(product):
+        """
+        Add, update or remove a single product in the index
+        """
+        from .models import SearchDocument, SearchPosting, SearchTerm
+
+        if not product.is_active:
+            ProductSearchIndex.remove_product(product.pk)
+            return
+
+        counts = document_terms(product)
+        length = sum(counts.values())
+
+        existing = dict(
+            SearchPosting.objects.filter(product_id=product.pk).values_list('term__term', 'term_frequency')
+        )
+        if existing == dict(counts):
+            return  # Indexed text unchanged (e.g. a price or stock update)
+
+        term_ids = ProductSearchIndex._ensure_terms(counts)
+        added = [term_ids[term] for term in counts if term not in existing]
+        removed = [term for term in existing if term not in counts]
+
+        SearchPosting.objects.filter(product_id=product.pk).delete()
+        SearchPosting.objects.bulk_create([
+            SearchPosting(
+                term_id=term_ids[term],
+                product_id=product.pk,
+                term_frequency=tf,
+                document_length=length
+            )
+            for term, tf in counts.items()
+        ])
+        SearchDocument.objects.update_or_create(
+            product_id=product.pk,
+            defaults={'length': length, 'indexed_at': timezone.now()}
+        )
+
+        if added:
+            SearchTerm.objects.filter(id__in=added).update(document_frequency=F('document_frequency') + 1)
+        if removed:
+            SearchTerm.objects.filter(term__in=removed).update(document_frequency=F('document_frequency') - 1)
+        ProductCache.bump_namespace(ProductCache.NAMESPACE_SEARCH)
+
+    @staticmethod
+    @transaction.atomic
+    def remove_product(product_id):
+        """
+        Remove a product from the index
+        """
+        from .models import SearchDocument, SearchPosting, SearchTerm
+
+        term_ids = list(SearchPosting.objects.filter(product_id=product_id).values_list('term_id', flat=True))
+        if term_ids:
+            SearchPosting.objects.filter(product_id=product_id).delete()
+            SearchTerm.objects.filter(id__in=term_ids).update(document_frequency=F('document_frequency') - 1)
+        if SearchDocument.objects.filter(product_id=product_id).delete()[0] or term_ids:
+            ProductCache.bump_namespace(ProductCache.NAMESPACE_SEARCH)
+
+    @staticmethod
+    def reindex_category(category_id):
+        """
+        Re-index every active product of a category (e.g. after a rename)
+        """
+        from .models import Product
+
+        products = Product.objects.filter(category_id=category_id, is_active=True).select_related('category')
+        with ProductCache.coalesce_invalidations():
+            for product in products.iterator(chunk_size=500):
+                ProductSearchIndex.index_product(product)
+
+    @staticmethod
+    def rebuild(chunk_size=1000, progress=None):
+        """
+        Rebuild the whole index from scratch, streaming products in chunks
+        """
+        from .models import Product, SearchDocument, SearchPosting, SearchTerm
+
+        with transaction.atomic():
+            SearchPosting.objects.all().delete()
+            SearchDocument.objects.all().delete()
+            SearchTerm.objects.all().delete()
+
+            term_ids = {}
+            document_frequency = Counter()
+            indexed = 0
+
+            products = Product.objects.filter(is_active=True).select_related('category').order_by('id')
+            chunk = []
+            for product in products.iterator(chunk_size=chunk_size):
+                chunk.append(product)
+                if len(chunk) >= chunk_size:
+                    indexed += ProductSearchIndex._index_chunk(chunk, term_ids, document_frequency)
+                    chunk = []
+                    if progress:
+                        progress(indexed)
+            if chunk:
+                indexed += ProductSearchIndex._index_chunk(chunk, term_ids, document_frequency)
+                if progress:
+                    progress(indexed)
+
+            terms = [
+                SearchTerm(id=term_id, term=term, document_frequency=document_frequency[term])
+                for term, term_id in term_ids.items()
+            ]
+            SearchTerm.objects.bulk_update(terms, ['document_frequency'], batch_size=chunk_size)
+
+        cache.delete(ProductSearchIndex.STATS_CACHE_KEY)
+        # Drops cached search results, and product list pages ranked from them
+        ProductCache.bump_namespace(ProductCache.NAMESPACE_SEARCH, ProductCache.NAMESPACE_LIST)
+        logger.info(f"Rebuilt search index with {indexed} products and {len(term_ids)} terms")
+        return indexed
+
+    @staticmethod
+    def _index_chunk(products, term_ids, document_frequency):
+        from .models import SearchDocument, SearchPosting, SearchTerm
+
+        documents = []
+        postings = []
+        now = timezone.now()
+
+        per_product = [(product, document_terms(product)) for product in products]
+
+        new_terms = {term for _, counts in per_product for term in counts} - set(term_ids)
+        if new_terms:
+            created = SearchTerm.objects.bulk_create([SearchTerm(term=term) for term in new_terms])
+            if any(term.pk is None for term in created):
+                # Backends that cannot return ids from bulk inserts
+                term_ids.update(SearchTerm.objects.filter(term__in=new_terms).values_list('term', 'id'))
+            else:
+                term_ids.update((term.term, term.pk) for term in created)
+
+        for product, counts in per_product:
+            length = sum(counts.values())
+            documents.append(SearchDocument(product_id=product.pk, length=length, indexed_at=now))
+            for term, tf in counts.items():
+                document_frequency[term] += 1
+                postings.append(SearchPosting(
+                    term_id=term_ids[term],
+                    product_id=product.pk,
+                    term_frequency=tf,
+                    document_length=length
+                ))
+
+        SearchDocument.objects.bulk_create(documents)
+        SearchPosting.objects.bulk_create(postings, batch_size=5000)
+        return len(documents)
+
+    @staticmethod
+    def get_corpus_stats():
+        """
+        Return (document count, average document length), cached briefly
+        """
+        from .models import SearchDocument
+
+        stats = cache.get(ProductSearchIndex.STATS_CACHE_KEY)
+        if stats is None:
+            aggregate = SearchDocument.objects.aggregate(count=Count('product_id'), avg_length=Avg('length'))
+            stats = (aggregate['count'] or 0, float(aggregate['avg_length'] or 0.0))
+            cache.set(ProductSearchIndex.STATS_CACHE_KEY, stats, timeout=settings.SEARCH_STATS_TTL)
+        return stats
+
+    @staticmethod
+    def score_expression(query, prefix=''):
+        """
+        Return (term ids, BM25 score expression) for a query, or None if nothing matches
+        
+        ``prefix`` is the lookup path from the queried model to SearchPosting, so the
+        same expression scores both SearchPosting rows and Product rows.
+        """
+        return ProductSearchIndex.score_terms(tokenize(query), prefix)
+
+    @staticmethod
+    def score_terms(terms, prefix=''):
+        """
+        score_expression() for terms that are already tokenized
+        """
+        from .models import SearchTerm
+
+        terms = set(terms)
+        if not terms:
+            return None
+
+        term_rows = list(
+            SearchTerm.objects.filter(term__in=terms, document_frequency__gt=0).values_list('id', 'document_frequency')
+        )
+        if not term_rows:
+            return None
+
+        k1 = settings.SEARCH_BM25_K1
+        b = settings.SEARCH_BM25_B
+        document_count, avg_length = ProductSearchIndex.get_corpus_stats()
+        document_count = max(document_count, max(df for _, df in term_rows))
+        avg_length = avg_length or 1.0
+
+        idf = Case(
+            *[
+                When(**{f'{prefix}term_id': term_id}, then=Value(math.log(1 + (document_count - df + 0.5) / (df + 0.5))))
+                for term_id, df in term_rows
+            ],
+            default=Value(0.0),
+            output_field=FloatField()
+        )
+        tf = Cast(f'{prefix}term_frequency', FloatField())
+        length_norm = Value(k1 * (1 - b)) + Value(k1 * b / avg_length) * Cast(f'{prefix}document_length', FloatField())
+
+        score = Sum(idf * tf * Value(k1 + 1) / (tf + length_norm), output_field=FloatField())
+        return [term_id for term_id, _ in term_rows], score
+
+    @staticmethod
+    def search(query, limit=None):
+        """
+        Return a list of (product_id, score) ordered by BM25 relevance
+        """
+        return ProductSearchIndex.rank(tokenize(query), limit)
+
+    @staticmethod
+    def rank(terms, limit=None):
+        """
+        search() for terms that are already tokenized
+        """
+        from .models import SearchPosting
+
+        match = ProductSearchIndex.score_terms(terms)
+        if match is None:
+            return []
+        term_ids, score = match
+
+        results = SearchPosting.objects.filter(
+            term_id__in=term_ids
+        ).values('product_id').annotate(
+            score=score
+        ).order_by('-score', 'product_id')[:limit or settings.SEARCH_MAX_RESULTS]
+
+        return [(row['product_id'], row['score']) for row in results]
+
+    @staticmethod
+    def search_ids(query, limit=None):
+        """
+        Return product ids ordered by relevance
+        """
+        return [product_id for product_id, _ in ProductSearchIndex.search(query, limit)]
+
+
+
+class SearchResultCache:
+    """
+    Ranked search results per normalized query, cached in two tiers
+
+    Each worker keeps recently used results in a bounded in-process LRU in
+    front of the shared cache, so the popular head of queries is answered from
+    memory without a database or cache read beyond the search version.
+    Entries are keyed by the search namespace version, which the index bumps
+    only when indexed text changes (a product's name, description, category
+    or activation), so orders and price or stock edits leave them cached while
+    a re-indexed product retires them in every worker at once. Results are
+    stored as compact arrays of product ids and scores.
+    """
+
+    LOCAL = 'search_local'
+    SHARED = 'search_shared'
+
+    _lock = threading.Lock()
+    _local = OrderedDict()
+
+    @staticmethod
+    def _empty():
+        return array('q'), array('d')
+
+    @classmethod
+    def get(cls, query):
+        """
+        Return (product ids, scores) for a query, best match first
+        """
+        terms = normalize_query(query)
+        if not terms:
+            return cls._empty()
+
+        version = ProductCache.get_namespace_version(ProductCache.NAMESPACE_SEARCH)
+        digest = hashlib.md5(' '.join(terms).encode('utf-8')).hexdigest()
+        cache_key = f'search_results:v{version}:{digest}'
+
+        now = time.monotonic()
+        with cls._lock:
+            entry = cls._local.get(cache_key)
+            hit = entry is not None and entry[0] > now
+            if hit:
+                cls._local.move_to_end(cache_key)
+        if hit:
+            CacheStats.record(cls.LOCAL, 'hit')
+            return entry[1]
+
+        CacheStats.record(cls.LOCAL, 'miss')
+        results = ProductCache.get_or_compute(
+            cache_key,
+            lambda: cls.compute(terms),
+            settings.SEARCH_RESULT_CACHE_TTL,
+            name=cls.SHARED
+        )
+
+        with cls._lock:
+            cls._local[cache_key] = (now + settings.SEARCH_RESULT_CACHE_TTL, results)
+            cls._local.move_to_end(cache_key)
+            while len(cls._local) > settings.SEARCH_RESULT_LRU_SIZE:
+                cls._local.popitem(last=False)
+        return results
+
+    @classmethod
+    def compute(cls, terms):
+        ids, scores = cls._empty()
+        for product_id, score in ProductSearchIndex.rank(terms):
+            ids.append(product_id)
+            scores.append(score)
+        return ids, scores
+
+    @classmethod
+    def get_ids(cls, query, limit=None):
+        """
+        Return product ids for a query, best match first
+        """
+        ids, _ = cls.get(query)
+        return list(ids[:limit] if limit else ids)
+
+    @classmethod
+    def clear_local(cls):
+        with cls._lock:
+            cls._local.clear()
@@ -0,0 +1,204 @@
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from apps.advertisements.models import Advertisement, AdvertisementSlot
+
+from .categories import CategoryMembership
+from .images import ImagePipeline
+from .models import Category, Product, ProductImage, ProductReview
+from .ratings import ProductRatingAggregates
+from .search import ProductSearchIndex
+from .snapshots import HomePageSnapshot
+from .utils import ProductCache
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    """
+    Keep the search index in step with product saves, approvals and deactivations
+    """
+    if raw:
+        return
+    ProductSearchIndex.index_product(instance)
+
+
+@receiver(pre_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    """
+    Remove deleted products from the search index before their postings cascade
+    """
+    ProductSearchIndex.remove_product(instance.pk)
+
+
+@receiver(pre_save, sender=Category)
+def detect_category_rename(sender, instance, raw=False, **kwargs):
+    """
+    Remember whether the category name changed so its products can be re-indexed
+    """
+    instance._search_name_changed = False
+    if raw or not instance.pk:
+        return
+    old_name = Category.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+    instance._search_name_changed = old_name is not None and old_name != instance.name
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, raw=False, **kwargs):
+    """
+    Category names are indexed with each product, so re-index on rename
+    """
+    if raw or not getattr(instance, '_search_name_changed', False):
+        return
+    ProductSearchIndex.reindex_category(instance.pk)
+
+
+@receiver(post_init, sender=ProductImage)
+def remember_image_url(sender, instance, **kwargs):
+    """
+    Remember the stored URL so saves know whether the image must be processed again
+    """
+    instance._stored_url = instance.__dict__.get('image_url') if instance.pk else None
+
+
+@receiver(post_save, sender=ProductImage)
+def process_product_image(sender, instance, created, raw=False, **kwargs):
+    """
+    Render variants for new images and images pointed at a new URL, after commit
+    """
+    if raw or (not created and instance.image_url == instance._stored_url):
+        return
+    instance._stored_url = instance.image_url
+    ImagePipeline.enqueue([instance.pk])
+
+
+@receiver(post_init, sender=ProductReview)
+def remember_review_rating(sender, instance, **kwargs):
+    """
+    Remember the stored product and rating so saves can apply a delta
+    """
+    # Read __dict__ directly so deferred fields are not fetched for every row
+    rating = instance.__dict__.get('rating')
+    if instance.pk and rating is not None:
+        instance._stored_rating = (instance.__dict__.get('product_id'), rating)
+    else:
+        instance._stored_rating = None
+
+
+@receiver(post_save, sender=ProductReview)
+def update_rating_aggregates(sender, instance, created, raw=False, **kwargs):
+    """
+    Apply a new or changed review to the product's rating aggregates
+    """
+    if raw:
+        return
+    stored = getattr(instance, '_stored_rating', None)
+    current = (instance.product_id, int(instance.rating))
+    
+    if created:
+        ProductRatingAggregates.apply_delta(instance.product_id, added=current[1])
+    elif stored is None:
+        pass  # Previous rating unknown (deferred); reconcile_ratings repairs any drift
+    elif stored[0] != current[0]:
+        ProductRatingAggregates.apply_delta(stored[0], removed=int(stored[1]))
+        ProductRatingAggregates.apply_delta(current[0], added=current[1])
+    else:
+        ProductRatingAggregates.apply_delta(current[0], added=current[1], removed=int(stored[1]))
+    instance._stored_rating = current
+
+
+@receiver(post_delete, sender=ProductReview)
+def remove_rating_aggregates(sender, instance, **kwargs):
+    """
+    Remove a deleted review from the product's rating aggregates
+    """
+    stored = getattr(instance, '_stored_rating', None)
+    if stored is None:
+        return
+    ProductRatingAggregates.apply_delta(stored[0], removed=int(stored[1]))
+
+
+@receiver(post_init, sender=Product)
+def remember_product_listing(sender, instance, **kwargs):
+    """
+    Remember the stored category and status so saves know if category counts changed
+    """
+    instance._stored_listing = (instance.__dict__.get('category_id'), instance.__dict__.get('is_active'))
+
+
+@receiver(post_save, sender=Product)
+def update_category_membership(sender, instance, created, raw=False, **kwargs):
+    """
+    Move the product's primary category link and keep category counts in step with its status
+    """
+    if raw:
+        return
+    if created or (instance.category_id, instance.is_active) != instance._stored_listing:
+        CategoryMembership.listing_changed(instance, created=created)
+
+
+@receiver(pre_delete, sender=Product)
+def remove_category_membership(sender, instance, **kwargs):
+    """
+    Take a deleted product out of its categories' counts before its links cascade
+    """
+    CategoryMembership.product_deleted(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_caches(sender, instance, raw=False, created=False, **kwargs):
+    """
+    Product changes affect its own entries and every list (and facet counts);
+    category counts only change when the product moves, appears or disappears
+    """
+    if raw:
+        return
+    listing = (instance.category_id, instance.is_active)
+    listing_changed = created or kwargs['signal'] is post_delete or listing != instance._stored_listing
+    ProductCache.invalidate_product_cache(instance.pk, instance.category_id if listing_changed else None)
+    
+    # Approvals and deactivations can change which products are featured
+    was_active = instance._stored_listing[1]
+    if (instance.is_active or was_active) and (listing_changed or HomePageSnapshot.shows_product(instance.pk)):
+        HomePageSnapshot.schedule_refresh()
+    instance._stored_listing = listing
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def invalidate_product_related_caches(sender, instance, raw=False, **kwargs):
+    """
+    Images and reviews are shown on product cards and detail pages
+    """
+    if raw:
+        return
+    ProductCache.invalidate_product_cache(instance.product_id)
+    if HomePageSnapshot.shows_product(instance.product_id):
+        HomePageSnapshot.schedule_refresh()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_caches(sender, instance, raw=False, **kwargs):
+    """
+    Category names and status appear in category lists, product lists and detail pages
+    """
+    if raw:
+        return
+    ProductCache.bump_namespace(ProductCache.NAMESPACE_CATEGORY, ProductCache.NAMESPACE_LIST)
+    HomePageSnapshot.schedule_refresh()
+
+
+@receiver(post_save, sender=Advertisement)
+@receiver(post_delete, sender=Advertisement)
+@receiver(post_save, sender=AdvertisementSlot)
+@receiver(post_delete, sender=AdvertisementSlot)
+def refresh_home_ads(sender, instance, raw=False, **kwargs):
+    """
+    Active ads are part of the home page snapshot
+    """
+    if raw:
+        return
+    HomePageSnapshot.schedule_refresh()
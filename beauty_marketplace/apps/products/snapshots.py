@@ -0,0 +1,130 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+import logging
+
+from .utils import ProductCache
+
+logger = logging.getLogger(__name__)
+
+
+def seconds_until_midnight():
+    """
+    Seconds until the next local midnight, when ad date windows can change
+    """
+    now = timezone.localtime()
+    midnight = datetime.datetime.combine(
+        now.date() + datetime.timedelta(days=1), datetime.time.min, tzinfo=now.tzinfo
+    )
+    return max(60, int((midnight - now).total_seconds()))
+
+
+class HomePageSnapshot:
+    """
+    The home page context assembled into plain data and kept in the cache
+
+    The snapshot is rebuilt (pushed) after commits that change something it
+    shows: a featured product, an approval that could make a product
+    featured, a category or an advertisement. It also expires at midnight,
+    since ads go live and end by date. Rendering from it needs no queries.
+    """
+
+    CACHE_KEY = 'home_snapshot'
+
+    @staticmethod
+    def build():
+        from apps.advertisements.models import AdvertisementSlot
+        from .models import Category, Product
+
+        featured = Product.objects.with_card_data().filter(is_active=True).order_by('-created_at', '-id')
+        today = timezone.localdate()
+        slots = AdvertisementSlot.objects.select_related('advertisement').filter(
+            page_location__iexact=settings.HOME_AD_LOCATION,
+            advertisement__status='active',
+            advertisement__start_date__lte=today,
+            advertisement__end_date__gte=today
+        ).order_by('slot_name', 'id')
+
+        return {
+            'built_at': time.time(),
+            'featured_products': [
+                {
+                    'id': product.id,
+                    'name': product.name,
+                    'description': product.description,
+                    'price': str(product.price),
+                    'image': {
+                        'src': product.primary_image.src,
+                        'srcset_webp': product.primary_image.srcset_webp,
+                        'srcset_jpeg': product.primary_image.srcset_jpeg,
+                    } if product.primary_image else None,
+                    'avg_rating': product.avg_rating,
+                    'review_count': product.review_count,
+                }
+                for product in featured[:settings.HOME_FEATURED_PRODUCTS]
+            ],
+            'categories': [
+                {'id': category.id, 'name': category.name}
+                for category in Category.objects.filter(is_active=True).order_by('name', 'id')
+            ],
+            'ad_slots': [
+                {
+                    'slot_name': slot.slot_name,
+                    'dimensions': slot.dimensions,
+                    'title': slot.advertisement.title,
+                    'description': slot.advertisement.description,
+                    'image_url': slot.advertisement.image_url,
+                    'target_url': slot.advertisement.target_url,
+                }
+                for slot in slots
+            ],
+        }
+
+    @staticmethod
+    def get():
+        """
+        Return the current snapshot, building it if it is missing
+        """
+        return ProductCache.get_or_compute(
+            HomePageSnapshot.CACHE_KEY, HomePageSnapshot.build, seconds_until_midnight(), name='home'
+        )
+
+    @staticmethod
+    def refresh():
+        """
+        Rebuild the snapshot now and replace the cached one
+        """
+        return ProductCache.refresh(
+            HomePageSnapshot.CACHE_KEY, HomePageSnapshot.build, seconds_until_midnight(), name='home'
+        )
+
+    @staticmethod
+    def schedule_refresh():
+        """
+        Rebuild the snapshot once the current transaction commits
+
+        Every change in a transaction schedules a rebuild, but the first one
+        to run makes the others no-ops.
+        """
+        requested_at = time.time()
+
+        def refresh_if_older():
+            snapshot = ProductCache.peek(HomePageSnapshot.CACHE_KEY)
+            if snapshot is None or snapshot['built_at'] < requested_at:
+                HomePageSnapshot.refresh()
+
+        transaction.on_commit(refresh_if_older)
+
+    @staticmethod
+    def shows_product(product_id):
+        """
+        Whether the cached snapshot features a product
+        """
+        snapshot = ProductCache.peek(HomePageSnapshot.CACHE_KEY)
+        if snapshot is None:
+            return False  # The next request builds a fresh one anyway
+        return any(product['id'] == product_id for product in snapshot['featured_products'])
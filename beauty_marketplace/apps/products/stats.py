@@ -0,0 +1,181 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(values, size=1000):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class ProductStatsEngine:
+    """
+    Keeps ProductStats up to date from order items and product views
+
+    Each run only revisits products whose orders changed since the previous
+    run (recounting their sales, so cancellations are reflected) and rolls the
+    new product views up into ProductViewDaily. The 7- and 30-day view counts
+    are then summed from the daily rollup rather than the raw view log.
+    """
+
+    @staticmethod
+    def refresh_sales(since):
+        """
+        Recount units sold and revenue of products with orders changed since ``since``
+        """
+        from apps.orders.models import OrderItem
+        from .models import ProductStats
+
+        items = OrderItem.objects.all()
+        if since is not None:
+            items = items.filter(order__updated_at__gte=since)
+        touched = set(items.values_list('product_id', flat=True).distinct())
+
+        now = timezone.now()
+        for chunk in chunked(sorted(touched)):
+            totals = {
+                row['product_id']: row
+                for row in OrderItem.objects.filter(product_id__in=chunk).exclude(order__status='cancelled')
+                .values('product_id').annotate(units=Sum('quantity'), revenue=Sum('total_price'))
+            }
+            ProductStats.objects.bulk_create(
+                [
+                    ProductStats(
+                        product_id=product_id,
+                        units_sold=totals.get(product_id, {}).get('units') or 0,
+                        revenue=totals.get(product_id, {}).get('revenue') or 0,
+                        updated_at=now
+                    )
+                    for product_id in chunk
+                ],
+                update_conflicts=True,
+                unique_fields=['product'],
+                update_fields=['units_sold', 'revenue', 'updated_at']
+            )
+        return touched
+
+    @staticmethod
+    def daily_view_counts(product_ids, first_day):
+        """
+        Rows of (product_id, day, views) for these products' views since first_day
+        """
+        from apps.analytics.models import ProductView
+
+        return ProductView.objects.filter(
+            product_id__in=product_ids, created_at__gte=first_day
+        ).annotate(day=TruncDate('created_at')).values('product_id', 'day').annotate(views=Count('id'))
+
+    @staticmethod
+    def roll_up_views(last_view_id, through_view_id):
+        """
+        Recount the daily views of every (product, day) that received views in the id range
+        """
+        from apps.analytics.models import ProductView
+        from .models import ProductViewDaily
+
+        new_views = ProductView.objects.filter(id__gt=last_view_id, id__lte=through_view_id)
+        touched = set(new_views.values_list('product_id', flat=True).distinct())
+        if not touched:
+            return touched
+        first_day = timezone.localtime(new_views.aggregate(first=Min('created_at'))['first']).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+
+        for chunk in chunked(sorted(touched)):
+            # Whole days are recounted, so views outside the id range on those days are included too
+            counts = ProductStatsEngine.daily_view_counts(chunk, first_day)
+            ProductViewDaily.objects.bulk_create(
+                [ProductViewDaily(product_id=row['product_id'], day=row['day'], views=row['views']) for row in counts],
+                update_conflicts=True,
+                unique_fields=['product', 'day'],
+                update_fields=['views']
+            )
+        return touched
+
+    @staticmethod
+    def refresh_views():
+        """
+        Sum the 7- and 30-day windows from the daily rollup and drop days older than both
+        """
+        from .models import ProductStats, ProductViewDaily
+
+        today = timezone.localdate()
+        week_start = today - timedelta(days=6)
+        month_start = today - timedelta(days=settings.PRODUCT_STATS_VIEW_DAYS - 1)
+        ProductViewDaily.objects.filter(day__lt=month_start).delete()
+
+        windows = {
+            row['product_id']: row
+            for row in ProductViewDaily.objects.values('product_id').annotate(
+                week=Sum('views', filter=Q(day__gte=week_start)),
+                month=Sum('views')
+            )
+        }
+        # Products that had views but none left in the window drop to zero
+        stale = ProductStats.objects.filter(Q(views_7d__gt=0) | Q(views_30d__gt=0)).exclude(
+            product_id__in=list(windows)
+        ).values_list('product_id', flat=True)
+        touched = set(windows) | set(stale)
+
+        now = timezone.now()
+        for chunk in chunked(sorted(touched)):
+            ProductStats.objects.bulk_create(
+                [
+                    ProductStats(
+                        product_id=product_id,
+                        views_7d=windows.get(product_id, {}).get('week') or 0,
+                        views_30d=windows.get(product_id, {}).get('month') or 0,
+                        updated_at=now
+                    )
+                    for product_id in chunk
+                ],
+                update_conflicts=True,
+                unique_fields=['product'],
+                update_fields=['views_7d', 'views_30d', 'updated_at']
+            )
+        return touched
+
+    @staticmethod
+    def run(full=False):
+        """
+        Bring ProductStats up to date and return the ProductStatsRun recorded for this run
+
+        With ``full`` all stats and daily view counts are rebuilt from the whole history.
+        """
+        from apps.analytics.models import ProductView
+        from .models import ProductStats, ProductStatsRun, ProductViewDaily
+
+        started_at = timezone.now()
+        with transaction.atomic():
+            if full:
+                ProductStats.objects.all().delete()
+                ProductViewDaily.objects.all().delete()
+                ProductStatsRun.objects.all().delete()
+            last_run = ProductStatsRun.objects.order_by('-finished_at', '-id').first()
+
+            # Orders committed just after the last run started may carry an earlier timestamp
+            since = last_run.started_at - timedelta(seconds=settings.PRODUCT_STATS_OVERLAP) if last_run else None
+            last_view_id = last_run.last_view_id if last_run else 0
+            through_view_id = ProductView.objects.aggregate(last=Max('id'))['last'] or last_view_id
+
+            touched = ProductStatsEngine.refresh_sales(since)
+            ProductStatsEngine.roll_up_views(last_view_id, through_view_id)
+            touched |= ProductStatsEngine.refresh_views()
+
+            run = ProductStatsRun.objects.create(
+                last_view_id=through_view_id,
+                started_at=started_at,
+                products_updated=len(touched),
+                finished_at=timezone.now()
+            )
+
+        logger.info("Refreshed stats of %d products", run.products_updated)
+        return run
@@ -0,0 +1,250 @@
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+NON_WORD_RE = re.compile(r"[\W_]+")
+
+# Sorts after any character that can follow a prefix
+PREFIX_END = '\U0010ffff'
+
+# Relative weight of each suggestion source before popularity is applied
+SOURCE_WEIGHTS = {
+    'query': 3.0,
+    'category': 2.0,
+    'product': 1.0,
+}
+
+# Suffixes starting mid-phrase ("serum" in "vitamin c serum") rank below full prefixes
+WORD_START_PENALTY = 0.5
+
+
+def normalize(text):
+    """
+    Lowercase, strip accents and punctuation, and collapse whitespace
+    """
+    if not text:
+        return ''
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    return NON_WORD_RE.sub(' ', text.lower()).strip()
+
+
+class SuggestionIndex:
+    """
+    Immutable prefix index over weighted suggestion phrases
+
+    Keys are kept in one sorted list so a prefix maps to a contiguous range
+    found with two binary searches. Prefixes matching more than
+    ``scan_limit`` keys have their top suggestions precomputed so short,
+    very common prefixes stay as cheap as long ones.
+    """
+
+    def __init__(self, keys=(), phrases=(), weights=(), hot_prefixes=None, limit=10, scan_limit=256):
+        self.keys = list(keys)
+        self.phrases = list(phrases)
+        self.weights = list(weights)
+        self.hot_prefixes = hot_prefixes or {}
+        self.limit = limit
+        self.scan_limit = scan_limit
+        self.built_at = time.time()
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, entries, limit=10, scan_limit=256):
+        """
+        Build an index from (phrase, weight) pairs
+        """
+        phrase_weights = Counter()
+        for phrase, weight in entries:
+            key = normalize(phrase)
+            if key:
+                phrase_weights[key] += weight
+
+        # Index the whole phrase and every later word start, pointing at the phrase
+        rows = []
+        for phrase, weight in phrase_weights.items():
+            rows.append((phrase, phrase, weight))
+            words = phrase.split(' ')
+            for start in range(1, len(words)):
+                rows.append((' '.join(words[start:]), phrase, weight * WORD_START_PENALTY))
+        rows.sort()
+
+        keys = [row[0] for row in rows]
+        phrases = [row[1] for row in rows]
+        weights = [row[2] for row in rows]
+
+        # Precompute answers for prefixes whose key range is too large to scan
+        range_sizes = {}
+
+        def range_size(prefix):
+            size = range_sizes.get(prefix)
+            if size is None:
+                start = bisect.bisect_left(keys, prefix)
+                size = range_sizes[prefix] = bisect.bisect_left(keys, prefix + PREFIX_END, lo=start) - start
+            return size
+
+        hot = {}
+        for position in sorted(range(len(keys)), key=lambda i: -weights[i]):
+            key = keys[position]
+            for length in range(1, len(key) + 1):
+                prefix = key[:length]
+                if range_size(prefix) <= scan_limit:
+                    break  # longer prefixes only match fewer keys
+                top = hot.setdefault(prefix, [])
+                if len(top) < limit and phrases[position] not in top:
+                    top.append(phrases[position])
+
+        hot_prefixes = {prefix: tuple(top) for prefix, top in hot.items()}
+        return cls(keys, phrases, weights, hot_prefixes, limit=limit, scan_limit=scan_limit)
+
+    def suggest(self, text, limit=None):
+        """
+        Return up to ``limit`` phrases starting with ``text`` (or one of its words), best first
+        """
+        limit = min(limit or self.limit, self.limit)
+        prefix = normalize(text)
+        if not prefix:
+            return []
+
+        hot = self.hot_prefixes.get(prefix)
+        if hot is not None:
+            return list(hot[:limit])
+
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + PREFIX_END, lo=start)
+        best = heapq.nlargest(limit * 2, range(start, end), key=self.weights.__getitem__)
+
+        results = []
+        for position in best:
+            phrase = self.phrases[position]
+            if phrase not in results:
+                results.append(phrase)
+                if len(results) == limit:
+                    break
+        return results
+
+
+def collect_entries():
+    """
+    Read suggestion phrases and popularity weights from the database
+    """
+    from apps.analytics.models import SearchQuery
+    from .models import Category, Product
+
+    entries = []
+
+    since = timezone.now() - timedelta(days=settings.SUGGEST_QUERY_WINDOW_DAYS)
+    queries = SearchQuery.objects.filter(
+        created_at__gte=since, result_count__gt=0
+    ).values('query').annotate(count=Count('id')).order_by('-count')[:settings.SUGGEST_MAX_QUERIES]
+    for row in queries:
+        entries.append((row['query'], SOURCE_WEIGHTS['query'] * row['count']))
+
+    categories = Category.objects.filter(is_active=True).values_list('name', 'active_product_count')
+    for name, product_count in categories:
+        entries.append((name, SOURCE_WEIGHTS['category'] * (1 + product_count)))
+
+    products = Product.objects.filter(is_active=True).values_list('name', 'review_count')
+    for name, review_count in products.iterator(chunk_size=2000):
+        entries.append((name, SOURCE_WEIGHTS['product'] * (1 + review_count)))
+
+    return entries
+
+
+class SuggestionService:
+    """
+    Per-process holder of the current SuggestionIndex
+
+    Lookups only read the in-memory index. The rebuild_suggestions command
+    builds the index from the database and publishes it to the cache; workers
+    check its version every SUGGEST_REFRESH_INTERVAL seconds on a background
+    thread and swap in the published index with a single assignment. Workers
+    never build an index themselves, so until one is published they suggest
+    nothing.
+    """
+
+    SNAPSHOT_KEY = 'suggestions:snapshot'
+    VERSION_KEY = 'suggestions:version'
+
+    _index = SuggestionIndex()
+    _version = None
+    _checked_at = None
+    _refresh_lock = threading.Lock()
+
+    @classmethod
+    def suggest(cls, text, limit=None):
+        cls._maybe_refresh()
+        return cls._index.suggest(text, limit)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Build an index from the database, publish it to the cache and install it locally
+        """
+        index = SuggestionIndex.build(collect_entries(), limit=settings.SUGGEST_LIMIT)
+        version = str(time.time())
+        cache.set(cls.SNAPSHOT_KEY, index, timeout=None)
+        cache.set(cls.VERSION_KEY, version, timeout=None)
+        cls._install(index, version)
+        logger.info(f"Rebuilt suggestion index with {len(index)} keys")
+        return index
+
+    @classmethod
+    def load(cls):
+        """
+        Install the published index if it is newer than the local one, returning whether it did
+        """
+        version = cache.get(cls.VERSION_KEY)
+        if version is None:
+            logger.warning("No suggestion index published yet; run rebuild_suggestions")
+            return False
+        if version == cls._version:
+            return False
+        index = cache.get(cls.SNAPSHOT_KEY)
+        if index is None:
+            logger.warning(f"Published suggestion index {version} is missing from the cache")
+            return False
+        cls._install(index, version)
+        return True
+
+    @classmethod
+    def _install(cls, index, version):
+        cls._index = index
+        cls._version = version
+        cls._checked_at = time.monotonic()
+
+    @classmethod
+    def _maybe_refresh(cls):
+        checked_at = cls._checked_at
+        if checked_at is not None and time.monotonic() - checked_at < settings.SUGGEST_REFRESH_INTERVAL:
+            return
+        if not cls._refresh_lock.acquire(blocking=False):
+            return  # Another thread is already refreshing
+        cls._checked_at = time.monotonic()
+        thread = threading.Thread(target=cls._refresh, name='suggestion-refresh', daemon=True)
+        thread.start()
+
+    @classmethod
+    def _refresh(cls):
+        try:
+            cls.load()
+        except Exception as e:
+            logger.error(f"Error refreshing suggestion index: {e}")
+        finally:
+            cls._refresh_lock.release()
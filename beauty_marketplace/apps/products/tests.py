@@ -1,9 +1,42 @@
-from django.test import TestCase, Client
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
-from .models import Category, Product, ProductImage, ProductReview
+from apps.advertisements.models import Advertisement, AdvertisementSlot
+
+from .models import (
+    Category, ImageAsset, Product, ProductAffinity, ProductCategory, ProductImage, ProductReview, ProductStats, RelatedProducts,
+    SearchPosting, SearchTerm
+)
+from .categories import CategoryMembership
+from .facets import ProductFacets
+from .images import ImagePipeline, ImageSourceError
+from .imports import CatalogImporter
+from .managers import DatabaseOptimizer
+from .pagination import KeysetPaginator
+from .ratings import ProductRatingAggregates
+from .related import RelatedProductsEngine, cooccurrence
+from .search import ProductSearchIndex, SearchResultCache, normalize_query, tokenize
+from .stats import ProductStatsEngine
+from .snapshots import HomePageSnapshot
+from .suggestions import SuggestionIndex, SuggestionService
+from .utils import CacheStats, ProductCache
 
 User = get_user_model()
 
@@ -183,3 +216,1578 @@ class ProductsViewTests(TestCase):
         response = self.client.post(reverse('products:delete_product', args=[self.product.id]))
         self.assertEqual(response.status_code, 302)  # Redirect after successful deletion
         self.assertFalse(Product.objects.filter(id=self.product.id).exists())
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        cache.delete(ProductSearchIndex.STATS_CACHE_KEY)
+        self.skincare = Category.objects.create(name='Skincare')
+        self.makeup = Category.objects.create(name='Makeup')
+        self.serum = Product.objects.create(
+            seller=self.seller,
+            category=self.skincare,
+            name='Vitamin C Serum',
+            description='A brightening serum for dull skin',
+            price=30.00,
+            quantity=10
+        )
+        self.lipstick = Product.objects.create(
+            seller=self.seller,
+            category=self.makeup,
+            name='Matte Lipstick',
+            description='Long lasting colour, pairs well with a vitamin serum',
+            price=15.00,
+            quantity=10
+        )
+    
+    def test_tokenize_lowercases_stems_and_drops_stop_words(self):
+        """Test that tokenization normalizes case, plurals and stop words"""
+        self.assertEqual(tokenize('The Serums and Brushes'), ['serum', 'brush'])
+        self.assertEqual(tokenize('Crème HYDRATING'), ['creme', 'hydrat'])
+    
+    def test_products_are_indexed_on_save(self):
+        """Test that saving a product adds its postings to the index"""
+        self.assertTrue(SearchPosting.objects.filter(product=self.serum, term__term='serum').exists())
+        self.assertEqual(SearchTerm.objects.get(term='vitamin').document_frequency, 2)
+    
+    def test_name_matches_rank_above_description_matches(self):
+        """Test that BM25 ranking favours products whose name matches"""
+        self.assertEqual(ProductSearchIndex.search_ids('vitamin serum'), [self.serum.id, self.lipstick.id])
+    
+    def test_category_names_are_searchable(self):
+        """Test that products can be found by their category name"""
+        self.assertEqual(ProductSearchIndex.search_ids('makeup'), [self.lipstick.id])
+    
+    def test_deactivated_products_are_removed_from_index(self):
+        """Test that deactivating a product removes it from search results"""
+        self.serum.is_active = False
+        self.serum.save()
+        self.assertEqual(ProductSearchIndex.search_ids('serum'), [self.lipstick.id])
+        self.assertEqual(SearchTerm.objects.get(term='vitamin').document_frequency, 1)
+    
+    def test_deleted_products_update_document_frequency(self):
+        """Test that deleting a product decrements term document frequencies"""
+        self.lipstick.delete()
+        self.assertEqual(SearchTerm.objects.get(term='vitamin').document_frequency, 1)
+        self.assertEqual(ProductSearchIndex.search_ids('lipstick'), [])
+    
+    def test_edits_reindex_product(self):
+        """Test that editing a product's text updates the index incrementally"""
+        self.lipstick.name = 'Velvet Lip Tint'
+        self.lipstick.save()
+        self.assertEqual(ProductSearchIndex.search_ids('lipstick'), [])
+        self.assertEqual(ProductSearchIndex.search_ids('velvet'), [self.lipstick.id])
+    
+    def test_category_rename_reindexes_products(self):
+        """Test that renaming a category re-indexes its products"""
+        self.makeup.name = 'Cosmetics'
+        self.makeup.save()
+        self.assertEqual(ProductSearchIndex.search_ids('cosmetics'), [self.lipstick.id])
+    
+    def test_rebuild_matches_incremental_index(self):
+        """Test that a full rebuild produces the same results as incremental updates"""
+        before = ProductSearchIndex.search('vitamin serum')
+        self.assertEqual(ProductSearchIndex.rebuild(chunk_size=1), 2)
+        self.assertEqual(ProductSearchIndex.search('vitamin serum'), before)
+    
+    def test_product_list_search_uses_index(self):
+        """Test that the product list search returns ranked index matches"""
+        response = self.client.get(reverse('products:product_list'), {'search': 'Serums'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [product.id for product in response.context['page_obj']],
+            [self.serum.id, self.lipstick.id]
+        )
+
+
+class SearchResultCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        SearchResultCache.clear_local()
+        CacheStats.reset()
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.skincare = Category.objects.create(name='Skincare')
+        self.serum = self.create_product('Vitamin C Serum', 'A brightening serum for dull skin')
+        self.toner = self.create_product('Rose Toner', 'Pairs well with a vitamin serum')
+    
+    def create_product(self, name, description):
+        return Product.objects.create(
+            seller=self.seller,
+            category=self.skincare,
+            name=name,
+            description=description,
+            price=20.00,
+            quantity=5
+        )
+    
+    def tier_counts(self):
+        CacheStats.flush()
+        stats = CacheStats.get_stats([SearchResultCache.LOCAL, SearchResultCache.SHARED])
+        return {tier: (counts['hit'], counts['miss']) for tier, counts in stats.items()}
+    
+    def test_equivalent_queries_normalize_alike(self):
+        """Test that case, spacing, stop words, word order and plurals don't change the normalized query"""
+        self.assertEqual(normalize_query('Vitamin C  Serum'), ('serum', 'vitamin'))
+        self.assertEqual(normalize_query('the serums with VITAMIN'), ('serum', 'vitamin'))
+        self.assertEqual(normalize_query('  '), ())
+    
+    def test_repeated_queries_are_served_from_memory(self):
+        """Test that a popular query is ranked once and then answered without the database"""
+        ids, _ = SearchResultCache.get('vitamin c serum')
+        self.assertEqual(list(ids), [self.serum.id, self.toner.id])
+        
+        with self.assertNumQueries(0):
+            ids, scores = SearchResultCache.get('Serum  VITAMIN')
+        self.assertEqual(list(ids), [self.serum.id, self.toner.id])
+        self.assertEqual(list(scores), [score for _, score in ProductSearchIndex.search('vitamin serum')])
+        self.assertEqual(self.tier_counts(), {'search_local': (1, 1), 'search_shared': (0, 1)})
+        
+        # Another worker starts with an empty LRU and reads the shared tier
+        SearchResultCache.clear_local()
+        with self.assertNumQueries(0):
+            SearchResultCache.get('vitamin serum')
+        self.assertEqual(self.tier_counts(), {'search_local': (1, 2), 'search_shared': (1, 1)})
+    
+    def test_catalog_changes_retire_cached_results(self):
+        """Test that cached results are replaced once the catalog version changes"""
+        self.assertEqual(SearchResultCache.get_ids('serum'), [self.serum.id, self.toner.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            cream = self.create_product('Serum Cream', 'Serum in a cream')
+        self.assertEqual(SearchResultCache.get_ids('serum'), [cream.id, self.serum.id, self.toner.id])
+        
+        self.toner.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.toner.save()
+        self.assertEqual(SearchResultCache.get_ids('serum', limit=5), [cream.id, self.serum.id])
+    
+    def test_stock_and_price_changes_keep_cached_results(self):
+        """Test that edits the index does not see, like orders taking stock, leave cached results in place"""
+        SearchResultCache.get('serum')
+        self.serum.quantity = 1
+        self.serum.price = 25.00
+        self.serum.save()
+        ProductCache.invalidate_product_cache(self.serum.pk)
+        
+        SearchResultCache.clear_local()
+        with self.assertNumQueries(0):
+            self.assertEqual(SearchResultCache.get_ids('serum'), [self.serum.id, self.toner.id])
+    
+    @override_settings(SEARCH_RESULT_LRU_SIZE=2)
+    def test_local_tier_is_bounded(self):
+        """Test that each worker only keeps the most recently used queries"""
+        for query in ('serum', 'toner', 'vitamin', 'serum'):
+            SearchResultCache.get(query)
+        self.assertEqual(len(SearchResultCache._local), 2)
+        self.assertEqual(self.tier_counts()['search_local'], (0, 4))
+    
+    def test_product_list_ranks_from_cached_results(self):
+        """Test that the product list filters and paginates the cached ranking"""
+        response = self.client.get(reverse('products:product_list'), {'search': 'Vitamin Serum'})
+        self.assertEqual([product.id for product in response.context['page_obj']], [self.serum.id, self.toner.id])
+        
+        response = self.client.get(reverse('products:product_list'), {'search': 'serum vitamin', 'max_price': '10'})
+        self.assertEqual(list(response.context['page_obj']), [])
+        self.assertEqual(self.tier_counts()['search_local'], (1, 1))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.category = Category.objects.create(name='Skincare')
+        # Repeated prices and timestamps force the id tie-breaker to be used
+        created_at = timezone.now()
+        self.products = [
+            Product.objects.create(
+                seller=self.seller,
+                category=self.category,
+                name=f'Product {i}',
+                description='Test description',
+                price=10 + i % 3,
+                quantity=5,
+                created_at=created_at
+            )
+            for i in range(11)
+        ]
+    
+    def walk(self, ordering, per_page=4):
+        paginator = KeysetPaginator(Product.objects.filter(is_active=True), per_page, ordering)
+        page = paginator.get_page({})
+        pages = [page]
+        while page.has_next:
+            page = paginator.get_page({'cursor': page.next_cursor})
+            pages.append(page)
+        return paginator, pages
+    
+    def test_forward_walk_visits_every_row_once_in_order(self):
+        """Test that following next cursors yields each product once, in sort order"""
+        for ordering in [('price', 'id'), ('-price', '-id'), ('-created_at', '-id')]:
+            _, pages = self.walk(ordering)
+            seen = [product.id for page in pages for product in page]
+            expected = list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+            self.assertEqual(seen, expected)
+            self.assertEqual([len(page) for page in pages], [4, 4, 3])
+    
+    def test_previous_cursor_returns_previous_page(self):
+        """Test that the previous cursor of a page leads back to the page before it"""
+        paginator, pages = self.walk(('price', 'id'))
+        
+        back = paginator.get_page({'cursor': pages[2].previous_cursor})
+        self.assertEqual(list(back), list(pages[1]))
+        self.assertTrue(back.has_next)
+        self.assertTrue(back.has_previous)
+        
+        first = paginator.get_page({'cursor': back.previous_cursor})
+        self.assertEqual(list(first), list(pages[0]))
+        self.assertFalse(first.has_previous)
+    
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        """Test that a tampered cursor is ignored instead of raising"""
+        paginator, pages = self.walk(('price', 'id'))
+        page = paginator.get_page({'cursor': pages[0].next_cursor + 'x'})
+        self.assertEqual(list(page), list(pages[0]))
+    
+    def test_querystring_keeps_filters(self):
+        """Test that next links keep the other query parameters"""
+        paginator = KeysetPaginator(Product.objects.all(), 4, ('price', 'id'))
+        page = paginator.get_page({'sort': 'price_asc', 'page': '2'})
+        self.assertIn('sort=price_asc', page.next_querystring)
+        self.assertIn('cursor=', page.next_querystring)
+        self.assertNotIn('page=', page.next_querystring)
+    
+    def test_product_list_paginates_with_cursor(self):
+        """Test that product list pages through results using the next link"""
+        for i in range(3):
+            Product.objects.create(
+                seller=self.seller,
+                category=self.category,
+                name=f'Extra Serum {i}',
+                description='Test description',
+                price=20,
+                quantity=5
+            )
+        
+        response = self.client.get(reverse('products:product_list'), {'sort': 'price_asc'})
+        self.assertEqual(response.status_code, 200)
+        page_obj = response.context['page_obj']
+        self.assertEqual(len(page_obj), 12)
+        self.assertEqual(page_obj.estimated_count, 14)
+        self.assertContains(response, page_obj.next_querystring.replace('&', '&amp;'))
+        
+        response = self.client.get(reverse('products:product_list') + page_obj.next_querystring)
+        self.assertEqual([p.name for p in response.context['page_obj']], ['Extra Serum 1', 'Extra Serum 2'])
+    
+    def test_product_list_paginates_search_results(self):
+        """Test that relevance-ranked search results page by score"""
+        for i in range(13):
+            Product.objects.create(
+                seller=self.seller,
+                category=self.category,
+                name=f'Rose Toner {i}',
+                description='Rose water' if i % 2 else 'Toner',
+                price=12,
+                quantity=5
+            )
+        
+        first = self.client.get(reverse('products:product_list'), {'search': 'rose'}).context['page_obj']
+        second = self.client.get(reverse('products:product_list') + first.next_querystring).context['page_obj']
+        self.assertEqual(len(first), 12)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({p.id for p in first} & {p.id for p in second})
+
+
+class ProductRatingAggregateTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.buyers = [
+            User.objects.create_user(
+                username=f'buyer{i}',
+                email=f'buyer{i}@example.com',
+                phone='',
+                password='testpass123'
+            )
+            for i in range(3)
+        ]
+        self.category = Category.objects.create(name='Skincare')
+        self.product = Product.objects.create(
+            seller=self.seller,
+            category=self.category,
+            name='Vitamin C Serum',
+            description='Test description',
+            price=30.00,
+            quantity=10
+        )
+    
+    def review(self, buyer, rating, product=None):
+        return ProductReview.objects.create(
+            product=product or self.product,
+            user=buyer,
+            rating=rating,
+            comment='Test review'
+        )
+    
+    def test_review_create_and_delete_update_aggregates(self):
+        """Test that creating and deleting reviews keeps the aggregates in step"""
+        self.review(self.buyers[0], 5)
+        review = self.review(self.buyers[1], 2)
+        
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 2)
+        self.assertEqual(self.product.rating_sum, 7)
+        self.assertAlmostEqual(self.product.avg_rating, 3.5)
+        self.assertEqual(self.product.rating_histogram, [(5, 1), (4, 0), (3, 0), (2, 1), (1, 0)])
+        
+        review.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 1)
+        self.assertAlmostEqual(self.product.avg_rating, 5.0)
+        self.assertEqual(self.product.rating_2_count, 0)
+        
+        ProductReview.objects.all().delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 0)
+        self.assertEqual(self.product.avg_rating, 0.0)
+    
+    def test_add_review_update_moves_histogram_bucket(self):
+        """Test that editing a review through add_review replaces its old rating"""
+        self.client.force_login(self.buyers[0])
+        url = reverse('products:add_review', args=[self.product.id])
+        self.client.post(url, {'rating': '4', 'comment': 'Good'})
+        self.client.post(url, {'rating': '1', 'comment': 'Changed my mind'})
+        
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 1)
+        self.assertEqual(self.product.rating_sum, 1)
+        self.assertEqual(self.product.rating_4_count, 0)
+        self.assertEqual(self.product.rating_1_count, 1)
+        self.assertAlmostEqual(self.product.avg_rating, 1.0)
+    
+    def test_add_review_rejects_invalid_ratings(self):
+        """Test that add_review turns away ratings outside 1-5 without touching the aggregates"""
+        self.client.force_login(self.buyers[0])
+        url = reverse('products:add_review', args=[self.product.id])
+        detail_url = reverse('products:product_detail', args=[self.product.id])
+        
+        for rating in ['7', '0', 'abc', '4.5', '']:
+            response = self.client.post(url, {'rating': rating, 'comment': 'Good'}, follow=True)
+            self.assertRedirects(response, detail_url)
+            self.assertContains(response, 'Please choose a rating from 1 to 5 stars.')
+        
+        self.assertFalse(ProductReview.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 0)
+    
+    def test_reconcile_repairs_drift(self):
+        """Test that reconcile recomputes aggregates that drifted from the reviews"""
+        self.review(self.buyers[0], 4)
+        self.review(self.buyers[1], 3)
+        Product.objects.filter(pk=self.product.pk).update(review_count=9, avg_rating=1.0, rating_4_count=0)
+        
+        checked, fixed = ProductRatingAggregates.reconcile(chunk_size=1)
+        self.assertEqual((checked, fixed), (1, 1))
+        
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 2)
+        self.assertEqual(self.product.rating_4_count, 1)
+        self.assertAlmostEqual(self.product.avg_rating, 3.5)
+        self.assertEqual(ProductRatingAggregates.reconcile(), (1, 0))
+    
+    def test_rating_sort_and_popular_products(self):
+        """Test that rating sort and popular products read the stored aggregates"""
+        other = Product.objects.create(
+            seller=self.seller,
+            category=self.category,
+            name='Rose Toner',
+            description='Test description',
+            price=12.00,
+            quantity=10
+        )
+        self.review(self.buyers[0], 3)
+        for buyer in self.buyers:
+            self.review(buyer, 5, product=other)
+        
+        response = self.client.get(reverse('products:product_list'), {'sort': 'rating'})
+        self.assertEqual([p.id for p in response.context['page_obj']], [other.id, self.product.id])
+        
+        with self.assertNumQueries(1):
+            popular = list(Product.objects.get_popular_products())
+        self.assertEqual(popular, [other, self.product])
+        self.assertEqual(list(Product.objects.get_featured_products()), [other])
+
+
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.skincare = Category.objects.create(name='Skincare')
+        self.makeup = Category.objects.create(name='Makeup')
+        for name, category, price in [
+            ('Vitamin Serum', self.skincare, 8),
+            ('Night Serum', self.skincare, 30),
+            ('Day Cream', self.skincare, 60),
+            ('Serum Foundation', self.makeup, 30),
+            ('Matte Lipstick', self.makeup, 120),
+        ]:
+            Product.objects.create(
+                seller=self.seller,
+                category=category,
+                name=name,
+                description='Test description',
+                price=price,
+                quantity=10
+            )
+    
+    def bucket_counts(self, counts):
+        return [bucket['count'] for bucket in counts['price_buckets']]
+    
+    def test_counts_ignore_their_own_filter(self):
+        """Test that category counts apply the price filter and bucket counts the category filter"""
+        counts = ProductFacets.get_counts(category_id=str(self.skincare.id), min_price='20', max_price='100')
+        self.assertEqual(counts['categories'], {self.skincare.id: 2, self.makeup.id: 1})
+        self.assertEqual(self.bucket_counts(counts), [1, 0, 1, 1, 0])
+    
+    def test_search_restricts_counts(self):
+        """Test that facet counts only cover products matching the search"""
+        counts = ProductFacets.get_counts(search='serum')
+        self.assertEqual(counts['categories'], {self.skincare.id: 2, self.makeup.id: 1})
+        self.assertEqual(self.bucket_counts(counts), [1, 0, 2, 0, 0])
+    
+    def test_bounded_queries_and_normalized_cache(self):
+        """Test that facets take a single query and equivalent filters share a cache entry"""
+        with self.assertNumQueries(1):
+            ProductFacets.get_counts(search='Night  SERUMS', min_price='20.00')
+        with self.assertNumQueries(0):
+            ProductFacets.get_counts(search='serum night', min_price='20')
+    
+    def test_extra_categories_count_once_per_bucket(self):
+        """Test that a product in several categories adds to each category but to one price bucket"""
+        serum = Product.objects.get(name='Serum Foundation')
+        CategoryMembership.set_categories(serum, [self.skincare.id])
+        
+        counts = ProductFacets.get_counts()
+        self.assertEqual(counts['categories'], {self.skincare.id: 4, self.makeup.id: 2})
+        self.assertEqual(self.bucket_counts(counts), [1, 0, 2, 1, 1])
+        
+        counts = ProductFacets.get_counts(category_id=str(self.skincare.id))
+        self.assertEqual(self.bucket_counts(counts), [1, 0, 2, 1, 0])
+    
+    def test_product_changes_refresh_counts(self):
+        """Test that saving a product invalidates cached counts"""
+        self.assertEqual(ProductFacets.get_counts()['categories'][self.makeup.id], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(name='Matte Lipstick').first().delete()
+        self.assertEqual(ProductFacets.get_counts()['categories'][self.makeup.id], 1)
+        
+        product = Product.objects.get(name='Day Cream')
+        product.category = self.makeup
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(ProductFacets.get_counts()['categories'], {self.skincare.id: 2, self.makeup.id: 2})
+    
+    def test_product_list_shows_facet_counts(self):
+        """Test that the product list sidebar renders category and price counts"""
+        response = self.client.get(reverse('products:product_list'), {'search': 'serum'})
+        self.assertContains(response, 'Skincare (2)')
+        self.assertContains(response, 'Makeup (1)')
+        self.assertContains(response, 'Under $10')
+
+
+class SearchSuggestionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.category = Category.objects.create(name='Skincare')
+        for name in ['Vitamin C Serum', 'Vitamin E Oil', 'Velvet Lipstick']:
+            Product.objects.create(
+                seller=self.seller,
+                category=self.category,
+                name=name,
+                description='Test description',
+                price=10.00,
+                quantity=5
+            )
+    
+    def test_prefix_and_word_start_matches_ranked_by_weight(self):
+        """Test that suggestions match phrase and word prefixes, best weight first"""
+        index = SuggestionIndex.build([
+            ('Vitamin C Serum', 1),
+            ('vitamin   c serum', 1),
+            ('Vitamin E Oil', 5),
+            ('Rose Serum', 1),
+        ])
+        self.assertEqual(index.suggest('VIT'), ['vitamin e oil', 'vitamin c serum'])
+        self.assertEqual(index.suggest('serum'), ['vitamin c serum', 'rose serum'])  # duplicates merged
+        self.assertEqual(index.suggest('vitamin c'), ['vitamin c serum'])
+        self.assertEqual(index.suggest('xyz'), [])
+        self.assertEqual(index.suggest('   '), [])
+    
+    def test_precomputed_prefixes_match_range_scan(self):
+        """Test that precomputed answers for hot prefixes equal a full range scan"""
+        entries = [(f'serum {word}', weight) for weight, word in enumerate(['alpha', 'beta', 'gamma', 'delta', 'omega'])]
+        scanned = SuggestionIndex.build(entries, limit=3, scan_limit=1000)
+        precomputed = SuggestionIndex.build(entries, limit=3, scan_limit=1)
+        self.assertIn('ser', precomputed.hot_prefixes)
+        for prefix in ['s', 'ser', 'serum', 'serum o', 'ome']:
+            self.assertEqual(precomputed.suggest(prefix), scanned.suggest(prefix))
+    
+    def test_endpoint_serves_index_without_database_queries(self):
+        """Test that the suggestion endpoint answers from memory"""
+        from apps.analytics.models import SearchQuery
+        for _ in range(3):
+            SearchQuery.objects.create(query='Velvet Matte', result_count=4)
+        SuggestionService.rebuild()
+        
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('products:search_suggestions'), {'q': 've'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['suggestions'], ['velvet matte', 'velvet lipstick'])
+        
+        response = self.client.get(reverse('products:search_suggestions'), {'q': 'skin'})
+        self.assertEqual(response.json()['suggestions'], ['skincare'])
+    
+    def test_workers_load_published_index_without_building(self):
+        """Test that workers only load the published index and never build one themselves"""
+        self.addCleanup(SuggestionService._install, SuggestionService._index, SuggestionService._version)
+        SuggestionService._install(SuggestionIndex(), None)
+        
+        with self.assertNumQueries(0), mock.patch.object(SuggestionIndex, 'build') as build:
+            self.assertFalse(SuggestionService.load())
+            self.assertEqual(SuggestionService.suggest('vit'), [])
+        build.assert_not_called()
+        
+        SuggestionService.rebuild()
+        SuggestionService._install(SuggestionIndex(), None)
+        with self.assertNumQueries(0), mock.patch.object(SuggestionIndex, 'build') as build:
+            self.assertTrue(SuggestionService.load())
+            self.assertEqual(SuggestionService.suggest('vit'), ['vitamin c serum', 'vitamin e oil'])
+        build.assert_not_called()
+
+
+class ProductCacheInvalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.seller = User.objects.create_user(
+                username='testseller',
+                email='seller@example.com',
+                phone='',
+                password='testpass123',
+                user_type='seller'
+            )
+            self.category = Category.objects.create(name='Skincare')
+            self.product = Product.objects.create(
+                seller=self.seller,
+                category=self.category,
+                name='Vitamin C Serum',
+                description='Test description',
+                price=30.00,
+                quantity=10
+            )
+            self.other = Product.objects.create(
+                seller=self.seller,
+                category=self.category,
+                name='Rose Toner',
+                description='Test description',
+                price=12.00,
+                quantity=10
+            )
+    
+    def test_bump_waits_for_commit(self):
+        """Test that a product change inside a transaction leaves cache keys alone until it commits"""
+        detail_key = ProductCache.get_product_detail_cache_key(self.product.id)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.price = 25.00
+            self.product.save()
+            self.assertEqual(ProductCache.get_product_detail_cache_key(self.product.id), detail_key)
+        self.assertEqual(ProductCache.get_product_detail_cache_key(self.product.id), detail_key)
+        
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(ProductCache.get_product_detail_cache_key(self.product.id), detail_key)
+    
+    def test_product_save_bumps_its_namespaces_only(self):
+        """Test that saving a product changes its detail and list keys but not other products' keys"""
+        detail_key = ProductCache.get_product_detail_cache_key(self.product.id)
+        other_key = ProductCache.get_product_detail_cache_key(self.other.id)
+        list_key = ProductCache.get_product_list_cache_key(sort_by='newest')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 25.00
+            self.product.save()
+        
+        self.assertNotEqual(ProductCache.get_product_detail_cache_key(self.product.id), detail_key)
+        self.assertNotEqual(ProductCache.get_product_list_cache_key(sort_by='newest'), list_key)
+        self.assertEqual(ProductCache.get_product_detail_cache_key(self.other.id), other_key)
+    
+    def test_related_models_invalidate_product(self):
+        """Test that image, review and category changes invalidate the affected entries"""
+        buyer = User.objects.create_user(username='buyer', email='buyer@example.com', phone='', password='testpass123')
+        
+        for change in [
+            lambda: ProductImage.objects.create(product=self.product, image_url='https://example.com/a.jpg'),
+            lambda: ProductReview.objects.create(product=self.product, user=buyer, rating=5, comment='Great'),
+            lambda: Category.objects.filter(pk=self.category.pk).first().save(),
+        ]:
+            detail_key = ProductCache.get_product_detail_cache_key(self.product.id)
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertNotEqual(ProductCache.get_product_detail_cache_key(self.product.id), detail_key)
+    
+    def test_coalesced_invalidations_bump_once(self):
+        """Test that many changes inside coalesce_invalidations bump each namespace once"""
+        before = ProductCache.get_namespace_version(ProductCache.NAMESPACE_LIST)
+        with self.captureOnCommitCallbacks(execute=True):
+            with ProductCache.coalesce_invalidations():
+                for i in range(5):
+                    ProductImage.objects.create(product=self.product, image_url=f'https://example.com/{i}.jpg')
+                self.assertEqual(ProductCache.get_namespace_version(ProductCache.NAMESPACE_LIST), before)
+        self.assertEqual(ProductCache.get_namespace_version(ProductCache.NAMESPACE_LIST), before + 1)
+    
+    def test_version_survives_eviction(self):
+        """Test that an evicted namespace version never reverts to an old value"""
+        key = ProductCache.get_category_list_cache_key()
+        cache.delete('ns:category')
+        self.assertNotEqual(ProductCache.get_category_list_cache_key(), key)
+
+
+class ReadThroughCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        CacheStats.reset()
+        self.calls = 0
+    
+    def compute(self, value='fresh', delay=0):
+        def compute():
+            self.calls += 1
+            time.sleep(delay)
+            return value
+        return compute
+    
+    def test_hit_miss_and_recompute_counters(self):
+        """Test that a cold lookup computes once and later lookups are hits"""
+        for _ in range(3):
+            self.assertEqual(ProductCache.get_or_compute('k', self.compute(), 60, name='product_list'), 'fresh')
+        CacheStats.flush()
+        
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(
+            CacheStats.get_stats(['product_list'])['product_list'],
+            {'hit': 2, 'miss': 1, 'stale': 0, 'recompute': 1}
+        )
+    
+    def test_concurrent_cold_lookups_compute_once(self):
+        """Test that concurrent misses on one key wait for a single recompute"""
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                ProductCache.get_or_compute('cold', self.compute(delay=0.2), 60, name='product_list')
+            ))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(results, ['fresh'] * 5)
+        self.assertEqual(self.calls, 1)
+    
+    @override_settings(CACHE_STALE_TTL=60)
+    def test_expired_entry_served_stale_while_refreshing(self):
+        """Test that an expired entry is served while another worker holds the refresh lock"""
+        ProductCache._store('k', 'old', timeout=-1)
+        cache.add('k:lock', 'other-worker')
+        
+        self.assertEqual(ProductCache.get_or_compute('k', self.compute(), 60, name='product_list'), 'old')
+        self.assertEqual(self.calls, 0)
+        
+        cache.delete('k:lock')
+        self.assertEqual(ProductCache.get_or_compute('k', self.compute(), 60, name='product_list'), 'fresh')
+        self.assertEqual(self.calls, 1)
+    
+    def test_expensive_entries_refresh_early(self):
+        """Test that entries near expiry are refreshed before they expire when recomputes are slow"""
+        ProductCache._store('cheap', 'old', timeout=60, compute_time=0.0)
+        ProductCache._store('slow', 'old', timeout=60, compute_time=1000.0)
+        
+        # Pin the random draw so the early-refresh decision is deterministic
+        with mock.patch('apps.products.utils.random.random', return_value=0.5):
+            self.assertEqual(ProductCache.get_or_compute('cheap', self.compute(), 60, name='product_list'), 'old')
+            self.assertEqual(ProductCache.get_or_compute('slow', self.compute(), 60, name='product_list'), 'fresh')
+    
+    def test_product_detail_is_read_through(self):
+        """Test that product_detail is served from cache and refreshed when the product changes"""
+        seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        product = Product.objects.create(
+            seller=seller,
+            category=Category.objects.create(name='Skincare'),
+            name='Vitamin C Serum',
+            description='Test description',
+            price=30.00,
+            quantity=10
+        )
+        url = reverse('products:product_detail', args=[product.id])
+        
+        self.client.get(url)
+        self.client.get(url)
+        product.name = 'Vitamin C Booster'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        response = self.client.get(url)
+        CacheStats.flush()
+        
+        self.assertContains(response, 'Vitamin C Booster')
+        self.assertEqual(CacheStats.get_stats(['product_detail'])['product_detail']['hit'], 1)
+        self.assertEqual(self.client.get(reverse('products:product_detail', args=[product.id + 1])).status_code, 404)
+
+
+class ProductQueryCountTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.category = Category.objects.create(name='Skincare')
+    
+    def create_products(self, count):
+        products = []
+        for i in range(count):
+            product = Product.objects.create(
+                seller=self.seller,
+                category=self.category,
+                name=f'Product {i}',
+                description='Test description',
+                price=10.00 + i,
+                quantity=5
+            )
+            for sort_order in (2, 1):
+                ProductImage.objects.create(
+                    product=product,
+                    image_url=f'https://example.com/{i}-{sort_order}.jpg',
+                    sort_order=sort_order
+                )
+            products.append(product)
+        return products
+    
+    def get_uncached(self, url, queries):
+        cache.clear()
+        with self.assertNumQueries(queries):
+            return self.client.get(url)
+    
+    def test_card_data_uses_first_image_by_sort_order(self):
+        """Test that with_card_data loads the first image of each product without extra queries"""
+        self.create_products(3)
+        with self.assertNumQueries(2):
+            products = list(Product.objects.with_card_data().order_by('id'))
+            images = [product.primary_image.image_url for product in products]
+            categories = [product.category.name for product in products]
+        self.assertEqual(images, [f'https://example.com/{i}-1.jpg' for i in range(3)])
+        self.assertEqual(categories, ['Skincare'] * 3)
+    
+    def test_product_list_queries_do_not_grow_with_page_size(self):
+        """Test that the product list takes the same number of queries for 1 or 12 products"""
+        self.create_products(1)
+        response = self.get_uncached(reverse('products:product_list'), 5)
+        self.assertContains(response, 'https://example.com/0-1.jpg')
+        
+        self.create_products(11)
+        response = self.get_uncached(reverse('products:product_list'), 5)
+        self.assertEqual(len(response.context['page_obj']), 12)
+    
+    def test_home_and_detail_queries_do_not_grow_with_images(self):
+        """Test that the home and detail pages take constant queries however many products and images"""
+        product = self.create_products(2)[0]
+        self.get_uncached(reverse('products:home'), 4)
+        self.get_uncached(reverse('products:product_detail', args=[product.id]), 6)
+        
+        self.create_products(5)
+        for sort_order in range(3, 6):
+            ProductImage.objects.create(product=product, image_url='https://example.com/more.jpg', sort_order=sort_order)
+        self.get_uncached(reverse('products:home'), 4)
+        response = self.get_uncached(reverse('products:product_detail', args=[product.id]), 6)
+        self.assertEqual(len(response.context['related_products']), 4)
+
+
+class HomePageSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.category = Category.objects.create(name='Skincare')
+        self.product = Product.objects.create(
+            seller=self.seller,
+            category=self.category,
+            name='Vitamin C Serum',
+            description='Test description',
+            price=30.00,
+            quantity=10
+        )
+    
+    def test_home_renders_from_snapshot_without_queries(self):
+        """Test that the home page takes no queries once the snapshot is built"""
+        ProductImage.objects.create(product=self.product, image_url='https://example.com/serum.jpg')
+        self.client.get(reverse('products:home'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('products:home'))
+        self.assertContains(response, 'Vitamin C Serum')
+        self.assertContains(response, 'https://example.com/serum.jpg')
+        self.assertContains(response, 'Skincare')
+    
+    def test_approval_rebuilds_snapshot(self):
+        """Test that approving a product puts it on the home page"""
+        pending = Product.objects.create(
+            seller=self.seller,
+            category=self.category,
+            name='Retinol Night Cream',
+            description='Test description',
+            price=45.00,
+            quantity=3,
+            is_active=False
+        )
+        self.assertNotContains(self.client.get(reverse('products:home')), 'Retinol Night Cream')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            pending.is_active = True
+            pending.save()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('products:home'))
+        self.assertContains(response, 'Retinol Night Cream')
+    
+    def test_rating_change_rebuilds_featured_product(self):
+        """Test that a review on a featured product updates its rating on the home page"""
+        HomePageSnapshot.get()
+        buyer = User.objects.create_user(username='buyer', email='buyer@example.com', phone='')
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductReview.objects.create(product=self.product, user=buyer, rating=4, comment='Nice')
+        featured = HomePageSnapshot.get()['featured_products']
+        self.assertEqual((featured[0]['avg_rating'], featured[0]['review_count']), (4.0, 1))
+    
+    def test_unfeatured_product_edit_does_not_rebuild(self):
+        """Test that editing an active product that is not featured leaves the snapshot alone"""
+        with override_settings(HOME_FEATURED_PRODUCTS=1):
+            newer = Product.objects.create(
+                seller=self.seller,
+                category=self.category,
+                name='Newer Product',
+                description='Test description',
+                price=12.00,
+                quantity=1
+            )
+            built_at = HomePageSnapshot.get()['built_at']
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.price = 25.00
+                self.product.save()
+            snapshot = HomePageSnapshot.get()
+        self.assertEqual(snapshot['built_at'], built_at)
+        self.assertEqual([product['id'] for product in snapshot['featured_products']], [newer.id])
+    
+    def test_category_and_ad_changes_rebuild_snapshot(self):
+        """Test that category changes and active home page ads show up in the snapshot"""
+        HomePageSnapshot.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Haircare')
+            today = timezone.localdate()
+            ad = Advertisement.objects.create(
+                title='Summer Glow Sale',
+                status='active',
+                start_date=today,
+                end_date=today,
+                created_by=self.seller
+            )
+            AdvertisementSlot.objects.create(advertisement=ad, slot_name='banner', page_location='home')
+        snapshot = HomePageSnapshot.get()
+        self.assertEqual([category['name'] for category in snapshot['categories']], ['Haircare', 'Skincare'])
+        self.assertEqual([slot['title'] for slot in snapshot['ad_slots']], ['Summer Glow Sale'])
+        self.assertContains(self.client.get(reverse('products:home')), 'Summer Glow Sale')
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.category = Category.objects.create(name='Skincare')
+    
+    def csv_file(self, rows):
+        lines = ['name,description,price,quantity,category,image_urls'] + rows
+        return io.BytesIO('\n'.join(lines).encode())
+    
+    def test_csv_import_creates_products_and_images(self):
+        """Test that valid CSV rows become pending products with ordered images"""
+        report = CatalogImporter(self.seller, batch_size=2).run(self.csv_file([
+            'Serum,"Brightening, daily",30.00,10,Skincare,https://example.com/a.jpg|https://example.com/b.jpg',
+            f'Toner,,12.5,3,{self.category.id},',
+            'Cream,,20,1,skincare,https://example.com/c.jpg',
+        ]), 'csv')
+        
+        self.assertEqual((report.products_created, report.images_created, report.rows_failed), (3, 3, 0))
+        serum = Product.objects.get(name='Serum')
+        self.assertEqual(serum.description, 'Brightening, daily')
+        self.assertFalse(serum.is_active)
+        self.assertEqual(
+            list(serum.images.order_by('sort_order').values_list('image_url', 'is_primary')),
+            [('https://example.com/a.jpg', True), ('https://example.com/b.jpg', False)]
+        )
+        self.assertEqual(Product.objects.filter(seller=self.seller, category=self.category).count(), 3)
+    
+    def test_invalid_rows_are_reported_and_skipped(self):
+        """Test that bad rows are rejected with their line numbers while good rows are imported"""
+        report = CatalogImporter(self.seller).run(self.csv_file([
+            'Serum,,30.00,10,Skincare,',
+            ',,abc,-1,Haircare,not-a-url',
+            'Toner,,1.999,2,Skincare,',
+        ]), 'csv')
+        
+        self.assertEqual((report.products_created, report.rows_failed), (1, 2))
+        self.assertEqual([line for line, message in report.errors], [3, 4])
+        message = report.errors[0][1]
+        for problem in ('name is required', 'price', 'quantity', 'unknown category "Haircare"', 'not-a-url'):
+            self.assertIn(problem, message)
+    
+    def test_jsonl_import_and_error_cap(self):
+        """Test that JSONL rows are imported and only the first errors are kept"""
+        lines = [json.dumps({'name': 'Serum', 'price': 30, 'quantity': 2, 'category': 'Skincare',
+                             'image_urls': ['https://example.com/a.jpg']})]
+        lines += ['{broken'] * 3 + ['[1, 2]']
+        report = CatalogImporter(self.seller, max_errors=2).run(io.BytesIO('\n'.join(lines).encode()), 'jsonl')
+        
+        self.assertEqual((report.products_created, report.images_created, report.rows_failed), (1, 1, 4))
+        self.assertEqual(len(report.errors), 2)
+        self.assertTrue(report.errors_truncated)
+    
+    def test_import_invalidates_caches_once(self):
+        """Test that an import bumps each cache namespace once however many rows it writes"""
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch.object(ProductCache, 'bump_namespace') as bump_namespace:
+            CatalogImporter(self.seller, batch_size=10).run(
+                self.csv_file([f'Product {i},,10,1,Skincare,https://example.com/{i}.jpg' for i in range(50)]), 'csv'
+            )
+        inserts = [query for query in queries if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 15)
+        bump_namespace.assert_called_once_with(ProductCache.NAMESPACE_LIST, ProductCache.NAMESPACE_POPULAR)
+    
+    def test_upload_view_and_command(self):
+        """Test that sellers can import through the upload page and the management command"""
+        self.client.login(username='testseller', password='testpass123')
+        upload = SimpleUploadedFile('catalog.csv', self.csv_file(['Serum,,30.00,10,Skincare,']).getvalue())
+        response = self.client.post(reverse('products:import_products'), {'file': upload})
+        self.assertContains(response, '1 products and 0 images imported')
+        
+        upload = SimpleUploadedFile('catalog.txt', b'name')
+        response = self.client.post(reverse('products:import_products'), {'file': upload}, follow=True)
+        self.assertContains(response, 'Please upload a .csv or .jsonl file.')
+        
+        path = f'/tmp/catalog-{self.seller.id}.jsonl'
+        with open(path, 'w') as f:
+            f.write(json.dumps({'name': 'Toner', 'price': '9.99', 'quantity': 1, 'category': 'Skincare'}))
+        out = io.StringIO()
+        call_command('import_products', path, seller='testseller', stdout=out)
+        self.assertIn('Imported 1 products', out.getvalue())
+        self.assertEqual(Product.objects.filter(seller=self.seller).count(), 2)
+
+
+class ProductImageSyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.product = Product.objects.create(
+            seller=seller,
+            category=Category.objects.create(name='Skincare'),
+            name='Vitamin C Serum',
+            description='Test description',
+            price=30.00,
+            quantity=10
+        )
+        ProductImage.objects.sync_for_product(self.product, ['https://example.com/a.jpg', 'https://example.com/b.jpg'])
+        self.ids = dict(self.product.images.values_list('image_url', 'id'))
+    
+    def images(self):
+        return list(self.product.images.order_by('sort_order').values_list('id', 'image_url', 'is_primary'))
+    
+    def test_unchanged_images_are_not_written(self):
+        """Test that resubmitting the same images makes no writes and leaves caches alone"""
+        version = ProductCache.get_namespace_version(ProductCache.product_namespace(self.product.id))
+        with self.assertNumQueries(1):
+            counts = ProductImage.objects.sync_for_product(
+                self.product, ['https://example.com/a.jpg', '', 'https://example.com/b.jpg']
+            )
+        self.assertEqual(counts, (0, 0, 0))
+        self.assertEqual(ProductCache.get_namespace_version(ProductCache.product_namespace(self.product.id)), version)
+    
+    def test_reorder_add_and_remove_keep_surviving_ids(self):
+        """Test that reordering, adding and removing images keeps the ids of images still listed"""
+        counts = ProductImage.objects.sync_for_product(
+            self.product, ['https://example.com/b.jpg', 'https://example.com/c.jpg']
+        )
+        self.assertEqual(counts, (1, 1, 1))
+        images = self.images()
+        self.assertEqual(images[0], (self.ids['https://example.com/b.jpg'], 'https://example.com/b.jpg', True))
+        self.assertEqual(images[1][1:], ('https://example.com/c.jpg', False))
+        self.assertNotIn(self.ids['https://example.com/a.jpg'], [image[0] for image in images])
+    
+    def test_sync_invalidates_product_cache(self):
+        """Test that a changed image set invalidates the product's cached pages"""
+        namespace = ProductCache.product_namespace(self.product.id)
+        version = ProductCache.get_namespace_version(namespace)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.sync_for_product(self.product, ['https://example.com/b.jpg'])
+        self.assertNotEqual(ProductCache.get_namespace_version(namespace), version)
+    
+    def test_edit_product_view_syncs_images(self):
+        """Test that editing a product only writes the images that changed"""
+        self.client.login(username='testseller', password='testpass123')
+        self.client.post(reverse('products:edit_product', args=[self.product.id]), {
+            'name': 'Vitamin C Serum',
+            'description': 'Test description',
+            'price': '30.00',
+            'quantity': '10',
+            'category': self.product.category_id,
+            'image_urls': ['https://example.com/a.jpg', 'https://example.com/d.jpg'],
+        })
+        images = self.images()
+        self.assertEqual(images[0], (self.ids['https://example.com/a.jpg'], 'https://example.com/a.jpg', True))
+        self.assertEqual([image[1] for image in images], ['https://example.com/a.jpg', 'https://example.com/d.jpg'])
+
+
+class SellerDashboardStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', phone='')
+        category = Category.objects.create(name='Skincare')
+        self.a, self.b, self.c = [
+            Product.objects.create(
+                seller=self.seller,
+                category=category,
+                name=f'Product {name}',
+                description='Test description',
+                price=10.00,
+                quantity=5
+            )
+            for name in 'ABC'
+        ]
+    
+    def order(self, product, quantity, status='pending'):
+        from apps.orders.models import Order, OrderItem
+        order = Order.objects.create(
+            user=self.buyer,
+            order_number=f'ORD-{Order.objects.count() + 1}',
+            total_amount=10 * quantity,
+            delivery_address='1 Test Street',
+            status=status
+        )
+        OrderItem.objects.create(order=order, product=product, quantity=quantity, unit_price=10, total_price=10 * quantity)
+        return order
+    
+    def view(self, product, days_ago=0, count=1):
+        from apps.analytics.models import ProductView
+        for _ in range(count):
+            ProductView.objects.create(product=product, created_at=timezone.now() - timezone.timedelta(days=days_ago))
+    
+    def stats(self, product):
+        stats = ProductStats.objects.get(product=product)
+        return stats.units_sold, stats.revenue, stats.views_7d, stats.views_30d
+    
+    def test_stats_count_sales_and_view_windows(self):
+        """Test that a run totals sales, skips cancelled orders and splits views into 7 and 30 days"""
+        self.order(self.a, 2)
+        self.order(self.a, 1)
+        self.order(self.b, 5, status='cancelled')
+        self.view(self.a, days_ago=0, count=2)
+        self.view(self.a, days_ago=10)
+        self.view(self.b, days_ago=40)
+        
+        ProductStatsEngine.run()
+        self.assertEqual(self.stats(self.a), (3, 30, 2, 3))
+        self.assertEqual(self.stats(self.b), (0, 0, 0, 0))
+    
+    def test_runs_are_incremental(self):
+        """Test that later runs pick up new views, new orders and cancellations"""
+        first = self.order(self.a, 2)
+        self.view(self.a)
+        ProductStatsEngine.run()
+        
+        self.order(self.b, 1)
+        self.view(self.a, count=2)
+        first.status = 'cancelled'
+        first.save()
+        run = ProductStatsEngine.run()
+        
+        self.assertEqual(run.products_updated, 2)
+        self.assertEqual(self.stats(self.a), (0, 0, 3, 3))
+        self.assertEqual(self.stats(self.b), (1, 10, 0, 0))
+        self.assertEqual(
+            ProductStatsEngine.run(full=True).products_updated, 2
+        )
+        self.assertEqual(self.stats(self.a), (0, 0, 3, 3))
+    
+    def test_dashboard_is_paginated_and_sorted_by_stats(self):
+        """Test that the dashboard pages through products sorted by a precomputed stat"""
+        self.order(self.b, 4)
+        self.order(self.c, 1)
+        ProductStatsEngine.run()
+        self.client.login(username='testseller', password='testpass123')
+        
+        with override_settings(SELLER_DASHBOARD_PAGE_SIZE=2):
+            response = self.client.get(reverse('products:seller_dashboard'), {'sort': 'units_sold'})
+            self.assertEqual([product.name for product in response.context['page_obj']], ['Product B', 'Product C'])
+            self.assertEqual(response.context['summary']['revenue'], 50)
+            
+            response = self.client.get(reverse('products:seller_dashboard') + response.context['page_obj'].next_querystring)
+        self.assertEqual([product.name for product in response.context['page_obj']], ['Product A'])
+        self.assertEqual(response.context['page_obj'][0].units_sold, 0)
+
+
+class CategoryMembershipTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.skincare = Category.objects.create(name='Skincare')
+        self.makeup = Category.objects.create(name='Makeup')
+        self.gifts = Category.objects.create(name='Gifts')
+    
+    def create_product(self, name, category, is_active=True):
+        return Product.objects.create(
+            seller=self.seller,
+            category=category,
+            name=name,
+            description='Test description',
+            price=20.00,
+            quantity=5,
+            is_active=is_active
+        )
+    
+    def counts(self):
+        return dict(Category.objects.order_by('id').values_list('name', 'active_product_count'))
+    
+    def test_counts_follow_activation_and_category_changes(self):
+        """Test that category counters track approval, deactivation, moves and deletion"""
+        serum = self.create_product('Serum', self.skincare, is_active=False)
+        self.create_product('Lipstick', self.makeup)
+        self.assertEqual(self.counts(), {'Skincare': 0, 'Makeup': 1, 'Gifts': 0})
+        
+        serum.is_active = True
+        serum.save()
+        self.assertEqual(self.counts(), {'Skincare': 1, 'Makeup': 1, 'Gifts': 0})
+        
+        serum.category = self.makeup
+        serum.save()
+        self.assertEqual(self.counts(), {'Skincare': 0, 'Makeup': 2, 'Gifts': 0})
+        self.assertEqual(list(serum.category_links.values_list('category_id', flat=True)), [self.makeup.id])
+        
+        serum.delete()
+        self.assertEqual(self.counts(), {'Skincare': 0, 'Makeup': 1, 'Gifts': 0})
+    
+    def test_extra_categories_are_browsable_and_counted(self):
+        """Test that products listed in extra categories appear and count there"""
+        serum = self.create_product('Serum', self.skincare)
+        CategoryMembership.set_categories(serum, [str(self.gifts.id), str(self.skincare.id)])
+        self.assertEqual(self.counts(), {'Skincare': 1, 'Makeup': 0, 'Gifts': 1})
+        self.assertEqual(list(Product.objects.in_category(self.gifts.id)), [serum])
+        
+        serum.is_active = False
+        serum.save()
+        self.assertEqual(self.counts(), {'Skincare': 0, 'Makeup': 0, 'Gifts': 0})
+        self.assertEqual(list(Product.objects.in_category(self.gifts.id)), [])
+        
+        serum.is_active = True
+        serum.save()
+        CategoryMembership.set_categories(serum, [])
+        self.assertEqual(self.counts(), {'Skincare': 1, 'Makeup': 0, 'Gifts': 0})
+        
+        response = self.client.get(reverse('products:product_list'), {'category': self.skincare.id})
+        self.assertEqual([product.name for product in response.context['page_obj']], ['Serum'])
+    
+    def test_category_counts_read_the_counter(self):
+        """Test that category navigation reads counters instead of aggregating products"""
+        self.create_product('Serum', self.skincare)
+        self.create_product('Lipstick', self.makeup, is_active=False)
+        with self.assertNumQueries(1):
+            categories = [(c.name, c.product_count) for c in Category.objects.get_categories_with_product_counts()]
+        self.assertEqual(categories, [('Skincare', 1)])
+    
+    def test_reconcile_backfills_links_and_counts(self):
+        """Test that reconcile adds missing links and repairs drifted counters"""
+        serum = self.create_product('Serum', self.skincare)
+        ProductCategory.objects.filter(product=serum).delete()
+        Category.objects.filter(pk=self.makeup.pk).update(active_product_count=7)
+        
+        self.assertEqual(CategoryMembership.reconcile(), (1, 0, 1))
+        self.assertEqual(self.counts(), {'Skincare': 1, 'Makeup': 0, 'Gifts': 0})
+        self.assertEqual(CategoryMembership.reconcile(), (0, 0, 0))
+
+
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_PIPELINE_ASYNC=False,
+            IMAGE_PIPELINE_WORKERS=0,
+            IMAGE_PIPELINE_MEDIA_HOSTS=['testserver']
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.category = Category.objects.create(name='Skincare')
+        self.product = Product.objects.create(
+            seller=self.seller,
+            category=self.category,
+            name='Serum',
+            description='Test description',
+            price=20.00,
+            quantity=5,
+            is_active=True
+        )
+    
+    def source(self, name, size=(2000, 1000), color=(200, 40, 90)):
+        """Write a JPEG with EXIF metadata under MEDIA_ROOT and return its URL"""
+        from PIL import Image
+        
+        exif = Image.Exif()
+        exif[0x010F] = 'Secret Camera Co'  # Make
+        os.makedirs(os.path.join(self.media_root, 'uploads'), exist_ok=True)
+        Image.new('RGB', size, color).save(os.path.join(self.media_root, 'uploads', name), 'JPEG', exif=exif)
+        return f'http://testserver/media/uploads/{name}'
+    
+    def add_image(self, url, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image_url=url, **kwargs)
+        image.refresh_from_db()
+        return image
+    
+    def test_new_images_get_webp_and_jpeg_variants_without_metadata(self):
+        """Test that a new product image is resized into every variant with metadata stripped"""
+        from PIL import Image
+        
+        image = self.add_image(self.source('serum.jpg'), is_primary=True)
+        asset = image.asset
+        self.assertEqual(asset.status, ImageAsset.STATUS_READY)
+        self.assertEqual((asset.width, asset.height), (2000, 1000))
+        self.assertEqual([variant['width'] for variant in asset.variants], [160, 640, 1280])
+        
+        for variant in asset.variants:
+            for extension, pil_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+                with Image.open(os.path.join(self.media_root, variant[extension])) as rendered:
+                    self.assertEqual(rendered.format, pil_format)
+                    self.assertEqual(rendered.width, variant['width'])
+                    self.assertEqual(len(rendered.getexif()), 0)
+        self.assertEqual(image.src, f"/media/{asset.variants[-1]['jpeg']}")
+    
+    def test_small_sources_are_not_upscaled(self):
+        """Test that variants larger than the source collapse into one copy at the source size"""
+        image = self.add_image(self.source('tiny.jpg', size=(300, 200)))
+        self.assertEqual([variant['width'] for variant in image.asset.variants], [160, 300])
+    
+    def test_identical_sources_share_one_asset(self):
+        """Test that the same picture used twice is processed and stored once"""
+        first = self.add_image(self.source('a.jpg'))
+        second = self.add_image(self.source('b.jpg'))
+        self.assertEqual(first.asset_id, second.asset_id)
+        self.assertEqual(ImageAsset.objects.count(), 1)
+        
+        with mock.patch('apps.products.images.render_variants') as render:
+            ImagePipeline.process(second.pk)
+        render.assert_not_called()
+    
+    def test_product_pages_render_responsive_pictures(self):
+        """Test that product pages serve srcsets and fall back to the URL until processed"""
+        image = self.add_image(self.source('serum.jpg'), is_primary=True)
+        response = self.client.get(reverse('products:product_detail', args=[self.product.pk]))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, image.srcset_webp)
+        
+        ProductImage.objects.filter(pk=image.pk).update(asset=None)
+        cache.clear()
+        response = self.client.get(reverse('products:product_detail', args=[self.product.pk]))
+        self.assertNotContains(response, '<source type="image/webp"')
+        self.assertContains(response, f'src="{image.image_url}"')
+    
+    def test_unreadable_sources_are_skipped(self):
+        """Test that broken, private and out-of-tree sources never get an asset"""
+        with open(os.path.join(self.media_root, 'broken.jpg'), 'wb') as f:
+            f.write(b'not an image')
+        broken = self.add_image('http://testserver/media/broken.jpg')
+        self.assertEqual(broken.asset.status, ImageAsset.STATUS_FAILED)
+        
+        with self.assertRaises(ImageSourceError):
+            ImagePipeline.read_source('http://testserver/media/../secret.txt')
+        with self.assertRaises(ImageSourceError):
+            ImagePipeline.download('http://127.0.0.1/admin.png')
+        with self.assertRaises(ImageSourceError):
+            ImagePipeline.download('file:///etc/passwd')
+
+
+class ProductReviewPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(
+            username='testseller',
+            email='seller@example.com',
+            phone='',
+            password='testpass123',
+            user_type='seller'
+        )
+        self.product = Product.objects.create(
+            seller=seller,
+            category=Category.objects.create(name='Skincare'),
+            name='Vitamin C Serum',
+            description='Test description',
+            price=30.00,
+            quantity=10
+        )
+    
+    def add_reviews(self, count, start=0):
+        for i in range(start, start + count):
+            buyer = User.objects.create_user(username=f'buyer{i}', email=f'buyer{i}@example.com', phone='')
+            ProductReview.objects.create(product=self.product, user=buyer, rating=i % 5 + 1, comment=f'Review {i}')
+    
+    def test_detail_shows_first_chunk_and_summary(self):
+        """Test that the detail page renders one chunk of reviews and the rating summary"""
+        self.add_reviews(12)
+        response = self.client.get(reverse('products:product_detail', args=[self.product.id]))
+        
+        reviews_page = response.context['reviews_page']
+        self.assertEqual([review.comment for review in reviews_page], [f'Review {i}' for i in range(11, 1, -1)])
+        self.assertTrue(reviews_page.has_next)
+        self.assertContains(response, '2.8 out of 5')
+        self.assertContains(response, reverse('products:product_reviews', args=[self.product.id]))
+        
+        response = self.client.get(reverse('products:product_reviews', args=[self.product.id]) + reviews_page.next_querystring)
+        self.assertContains(response, 'Review 1<')
+        self.assertContains(response, 'Review 0<')
+        self.assertNotContains(response, 'Review 2<')
+        self.assertNotContains(response, 'More reviews')
+    
+    def test_detail_queries_do_not_grow_with_reviews(self):
+        """Test that the first detail page load takes the same queries for 2 or 30 reviews"""
+        url = reverse('products:product_detail', args=[self.product.id])
+        self.add_reviews(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        
+        self.add_reviews(28, start=2)
+        cache.clear()
+        with self.assertNumQueries(len(few)):
+            self.client.get(url)
+
+
+class RelatedProductsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', phone='')
+        category = Category.objects.create(name='Skincare')
+        self.a, self.b, self.c, self.d = [
+            Product.objects.create(
+                seller=self.buyer,
+                category=category,
+                name=f'Product {name}',
+                description='Test description',
+                price=10.00,
+                quantity=5
+            )
+            for name in 'ABCD'
+        ]
+    
+    def order(self, *products, status='pending'):
+        from apps.orders.models import Order, OrderItem
+        order = Order.objects.create(
+            user=self.buyer,
+            order_number=f'ORD-{Order.objects.count() + 1}',
+            total_amount=10 * len(products),
+            delivery_address='1 Test Street',
+            status=status
+        )
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=10, total_price=10)
+    
+    def view(self, product, session_key, days_ago=1):
+        from apps.analytics.models import ProductView
+        ProductView.objects.create(
+            product=product,
+            session_key=session_key,
+            created_at=timezone.now() - timezone.timedelta(days=days_ago)
+        )
+    
+    def neighbours(self, product):
+        return RelatedProducts.objects.get(product=product).product_ids
+    
+    def test_cooccurrence_counts_shared_baskets(self):
+        """Test that the co-occurrence matrix counts each basket once per product pair"""
+        counts = cooccurrence(np.array([1, 1, 1, 2, 2]), np.array([0, 1, 1, 1, 2]), 3).toarray()
+        self.assertEqual(counts.tolist(), [[1, 1, 0], [1, 2, 1], [0, 1, 1]])
+    
+    def test_co_purchases_are_ranked_and_runs_are_incremental(self):
+        """Test that products bought together become related and reruns only add new orders"""
+        self.order(self.a, self.b)
+        self.order(self.a, self.b, self.c)
+        self.order(self.a, self.d, status='cancelled')
+        self.order(self.a, self.d, status='cancelled')
+        RelatedProductsEngine.run()
+        
+        self.assertEqual(self.neighbours(self.a), [self.b.id])
+        self.assertFalse(RelatedProducts.objects.filter(product=self.d).exists())
+        
+        RelatedProductsEngine.run()
+        self.assertEqual(ProductAffinity.objects.get(product=self.a, other=self.b).order_count, 2)
+        
+        self.order(self.c, self.a)
+        run = RelatedProductsEngine.run()
+        self.assertEqual(run.orders_processed, 1)
+        self.assertEqual(set(self.neighbours(self.a)), {self.b.id, self.c.id})
+        self.assertEqual(self.neighbours(self.c), [self.a.id])
+    
+    def test_completed_view_sessions_relate_products(self):
+        """Test that products viewed in the same session on a past day become related"""
+        for session_key in ('s1', 's2'):
+            self.view(self.a, session_key)
+            self.view(self.d, session_key)
+            self.view(self.b, session_key, days_ago=0)  # today's sessions are still open
+        RelatedProductsEngine.run()
+        
+        self.assertEqual(self.neighbours(self.a), [self.d.id])
+        self.assertFalse(RelatedProducts.objects.filter(product=self.b).exists())
+    
+    def test_product_detail_shows_precomputed_neighbours(self):
+        """Test that product_detail shows neighbours and falls back to the category without them"""
+        url = reverse('products:product_detail', args=[self.a.id])
+        self.assertEqual(len(self.client.get(url).context['related_products']), 3)
+        
+        self.order(self.a, self.c)
+        self.order(self.a, self.c)
+        with self.captureOnCommitCallbacks(execute=True):
+            RelatedProductsEngine.run()
+        self.assertEqual(self.client.get(url).context['related_products'], [self.c])
+
+
+class ProductQueryPlanTests(TestCase):
+    """
+    EXPLAIN the pages the storefront views read and fail if any scans a table or sorts
+    """
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create_user(
+            username='seller', email='seller@example.com', phone='', password='testpass123', user_type='seller'
+        )
+        cls.category = Category.objects.create(name='Skincare')
+        Product.objects.bulk_create([
+            Product(
+                seller=cls.seller,
+                category=cls.category,
+                name=f'Product {i}',
+                description='Test description',
+                price=i % 50 + 1,
+                is_active=i % 5 != 0
+            )
+            for i in range(200)
+        ])
+        CategoryMembership.reconcile()  # bulk_create skips the signals that link products to categories
+    
+    def setUp(self):
+        cache.clear()
+    
+    def assertPagesUseIndexes(self, url, params=None):
+        with DatabaseOptimizer.capture_page_querysets() as querysets:
+            self.client.get(url, params)
+        self.assertTrue(querysets, f'{url} read no pages')
+        for queryset in querysets:
+            self.assertEqual(DatabaseOptimizer.plan_problems(queryset), [], DatabaseOptimizer.explain(queryset))
+    
+    def test_product_list_pages_use_indexes(self):
+        """Test that every product list sort, with and without a category, walks an index in order"""
+        # Relevance sorts the few hundred ranked search hits by score, so it is not checked here
+        for sort in ('newest', 'price_asc', 'price_desc', 'rating'):
+            for params in ({'sort': sort}, {'sort': sort, 'category': self.category.id}):
+                with self.subTest(**params):
+                    cache.clear()
+                    self.assertPagesUseIndexes(reverse('products:product_list'), params)
+    
+    def test_seller_and_review_pages_use_indexes(self):
+        """Test that the seller dashboard's newest products and a product's reviews walk an index"""
+        self.client.login(username='seller', password='testpass123')
+        self.assertPagesUseIndexes(reverse('products:seller_dashboard'))
+        product_id = Product.objects.filter(is_active=True).values_list('id', flat=True).first()
+        self.assertPagesUseIndexes(reverse('products:product_detail', args=[product_id]))
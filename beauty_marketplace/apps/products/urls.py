@@ -8,10 +8,13 @@ urlpatterns = [
     path('products/', views.product_list, name='product_list'),
     path('products/<int:product_id>/', views.product_detail, name='product_detail'),
     path('products/<int:product_id>/review/', views.add_review, name='add_review'),
+    path('products/<int:product_id>/reviews/', views.product_reviews, name='product_reviews'),
+    path('search/suggest/', views.search_suggestions, name='search_suggestions'),
     
     # Seller Dashboard
     path('seller/dashboard/', views.seller_dashboard, name='seller_dashboard'),
     path('seller/products/create/', views.create_product, name='create_product'),
+    path('seller/products/import/', views.import_products, name='import_products'),
     path('seller/products/<int:product_id>/edit/', views.edit_product, name='edit_product'),
     path('seller/products/<int:product_id>/delete/', views.delete_product, name='delete_product'),
 ]
@@ -1,35 +1,227 @@
+from collections import Counter
+from contextlib import contextmanager
+import hashlib
+import math
+import random
+import threading
+import time
+import uuid
+
 from django.core.cache import cache
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Namespaces collected by ProductCache.coalesce_invalidations(), per thread
+_invalidation_batch = threading.local()
+
+
+def _digest(*values):
+    """
+    Short, key-safe digest of arbitrary request values
+    """
+    return hashlib.md5(repr(values).encode('utf-8')).hexdigest()[:16]
+
+
+class CacheStats:
+    """
+    Hit, miss, stale and recompute counters for read-through lookups
+    
+    Events are counted in process memory and added to shared counters in the
+    cache at most every CACHE_STATS_FLUSH_INTERVAL seconds, so recording an
+    event costs no cache round trip.
+    """
+    
+    EVENTS = ('hit', 'miss', 'stale', 'recompute')
+    
+    _lock = threading.Lock()
+    _pending = Counter()
+    _last_flush = 0.0
+    
+    @staticmethod
+    def _key(name, event):
+        return f'cache_stats:{name}:{event}'
+    
+    @classmethod
+    def record(cls, name, event):
+        with cls._lock:
+            cls._pending[(name, event)] += 1
+            due = time.monotonic() - cls._last_flush >= settings.CACHE_STATS_FLUSH_INTERVAL
+        if due:
+            cls.flush()
+    
+    @classmethod
+    def flush(cls):
+        """
+        Add the counts recorded by this process to the shared counters
+        """
+        with cls._lock:
+            pending, cls._pending = cls._pending, Counter()
+            cls._last_flush = time.monotonic()
+        
+        for (name, event), count in pending.items():
+            key = cls._key(name, event)
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                if not cache.add(key, count, timeout=None):
+                    cache.incr(key, count)
+    
+    @classmethod
+    def get_stats(cls, names=None):
+        """
+        Return {name: {event: count}} from the shared counters
+        """
+        names = names or ProductCache.READ_THROUGH_CACHES
+        keys = {cls._key(name, event): (name, event) for name in names for event in cls.EVENTS}
+        counts = cache.get_many(list(keys))
+        stats = {name: dict.fromkeys(cls.EVENTS, 0) for name in names}
+        for key, (name, event) in keys.items():
+            stats[name][event] = counts.get(key, 0)
+        return stats
+    
+    @classmethod
+    def reset(cls, names=None):
+        names = names or ProductCache.READ_THROUGH_CACHES
+        with cls._lock:
+            cls._pending.clear()
+        cache.delete_many([cls._key(name, event) for name in names for event in cls.EVENTS])
+
 
 class ProductCache:
     """
     Utility class for caching product-related data
+    
+    Keys embed the version of the namespace they belong to ('list',
+    'category', 'popular', 'search' or 'product:<id>'). Invalidating a namespace is a
+    single INCR of its version; entries under the old version are never read
+    again and simply expire.
     """
     
+    NAMESPACE_LIST = 'list'
+    NAMESPACE_CATEGORY = 'category'
+    NAMESPACE_POPULAR = 'popular'
+    NAMESPACE_SEARCH = 'search'  # Ranked search results; only indexed text changes bump it
+    
+    # Names under which read-through lookups are counted by CacheStats
+    READ_THROUGH_CACHES = (
+        'product_list', 'product_detail', 'related_products', 'categories', 'home', 'search_local', 'search_shared'
+    )
+    
+    @staticmethod
+    def product_namespace(product_id):
+        """
+        Namespace for everything cached about a single product
+        """
+        return f'product:{product_id}'
+    
     @staticmethod
-    def get_product_list_cache_key(category_id=None, search_query=None, sort_by=None):
+    def _version_key(namespace):
+        return f'ns:{namespace}'
+    
+    @staticmethod
+    def _initial_version():
+        # Start from the clock so a version key that was evicted never
+        # comes back with a value that old entries were stored under
+        return int(time.time() * 1000)
+    
+    @staticmethod
+    def get_namespace_versions(*namespaces):
+        """
+        Return the current version of each namespace, in one cache round trip
+        """
+        keys = [ProductCache._version_key(namespace) for namespace in namespaces]
+        versions = cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                cache.add(key, ProductCache._initial_version(), timeout=settings.CACHE_NAMESPACE_VERSION_TTL)
+                versions[key] = cache.get(key)
+        return [versions[key] for key in keys]
+    
+    @staticmethod
+    def get_namespace_version(namespace):
+        """
+        Return the current version of a namespace
+        """
+        return ProductCache.get_namespace_versions(namespace)[0]
+    
+    @staticmethod
+    def bump_namespace(*namespaces):
+        """
+        Invalidate everything cached under the given namespaces
+        
+        The bump waits for the current transaction to commit, so a reader
+        cannot cache the pre-commit rows under the new version. Inside
+        coalesce_invalidations() the bumps are deferred and each namespace is
+        bumped once when the block exits.
+        """
+        pending = getattr(_invalidation_batch, 'pending', None)
+        if pending is not None:
+            pending.update(namespaces)
+            return
+        
+        transaction.on_commit(lambda: ProductCache._bump_now(namespaces))
+    
+    @staticmethod
+    def _bump_now(namespaces):
+        for namespace in namespaces:
+            key = ProductCache._version_key(namespace)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # No version yet; if another process created one first, bump it
+                if not cache.add(key, ProductCache._initial_version(), timeout=settings.CACHE_NAMESPACE_VERSION_TTL):
+                    cache.incr(key)
+        logger.debug(f"Bumped cache namespaces: {', '.join(namespaces)}")
+    
+    @staticmethod
+    @contextmanager
+    def coalesce_invalidations():
+        """
+        Collect invalidations made inside the block and apply each namespace bump once
+        """
+        if getattr(_invalidation_batch, 'pending', None) is not None:
+            yield  # Already coalescing in an outer block
+            return
+        
+        _invalidation_batch.pending = set()
+        try:
+            yield
+        finally:
+            pending = _invalidation_batch.pending
+            _invalidation_batch.pending = None
+            if pending:
+                ProductCache.bump_namespace(*sorted(pending))
+    
+    @staticmethod
+    def get_product_list_cache_key(category_id=None, search_query=None, sort_by=None,
+                                   min_price=None, max_price=None, cursor=None):
         """
         Generate a cache key for product lists
         """
-        key_parts = ['products']
+        version = ProductCache.get_namespace_version(ProductCache.NAMESPACE_LIST)
+        key_parts = ['products', f'v{version}']
         
         if category_id:
-            key_parts.append(f'category_{category_id}')
+            key_parts.append(f'category_{_digest(category_id)}')
         
         if search_query:
-            # Sanitize search query for cache key
-            safe_query = ''.join(c for c in search_query if c.isalnum() or c in ' -_')
-            key_parts.append(f'search_{safe_query}')
+            # Digest rather than sanitize, so queries differing only in punctuation don't collide
+            key_parts.append(f'search_{_digest(search_query)}')
         
         if sort_by:
             key_parts.append(f'sort_{sort_by}')
         
+        if min_price or max_price:
+            key_parts.append(f'price_{_digest(min_price, max_price)}')
+        
+        if cursor:
+            key_parts.append(f'cursor_{_digest(cursor)}')
+        
         return ':'.join(key_parts)
     
     @staticmethod
@@ -37,21 +229,147 @@ class ProductCache:
         """
         Generate a cache key for product details
         """
-        return f'product_detail:{product_id}'
+        # Details include the category name, so a category rename invalidates them too
+        product_version, category_version = ProductCache.get_namespace_versions(
+            ProductCache.product_namespace(product_id), ProductCache.NAMESPACE_CATEGORY
+        )
+        return f'product_detail:{product_id}:v{product_version}.{category_version}'
+    
+    @staticmethod
+    def get_related_products_cache_key(product_id, category_id):
+        """
+        Generate a cache key for the products shown alongside a product
+        """
+        # Any product change can alter a category's newest products
+        version = ProductCache.get_namespace_version(ProductCache.NAMESPACE_LIST)
+        return f'related_products:{product_id}:{category_id}:v{version}'
     
     @staticmethod
     def get_category_list_cache_key():
         """
         Generate a cache key for category lists
         """
-        return 'categories'
+        version = ProductCache.get_namespace_version(ProductCache.NAMESPACE_CATEGORY)
+        return f'categories:v{version}'
     
     @staticmethod
     def get_popular_products_cache_key():
         """
         Generate a cache key for popular products
         """
-        return 'popular_products'
+        version = ProductCache.get_namespace_version(ProductCache.NAMESPACE_POPULAR)
+        return f'popular_products:v{version}'
+    
+    @staticmethod
+    def _store(cache_key, value, timeout, compute_time=0.0):
+        """
+        Store a value with its logical expiry and the time it took to compute
+        
+        The entry physically outlives its expiry by CACHE_STALE_TTL so it can
+        still be served while one worker refreshes it.
+        """
+        entry = (value, time.time() + timeout, compute_time)
+        cache.set(cache_key, entry, timeout=timeout + settings.CACHE_STALE_TTL)
+    
+    @staticmethod
+    def _load_value(cache_key):
+        """
+        Return a stored value that has not expired, or None
+        """
+        entry = cache.get(cache_key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+    
+    @staticmethod
+    def _should_refresh(entry):
+        """
+        Decide whether an entry is due for recompute
+        
+        Besides expired entries, entries close to expiry are refreshed early
+        with a probability that grows as expiry nears and with the cost of the
+        recompute, so concurrent readers don't all expire at the same moment.
+        """
+        _, expires_at, compute_time = entry
+        # 1 - random() lies in (0, 1], so the log is defined and never positive
+        headroom = -compute_time * settings.CACHE_EARLY_REFRESH_BETA * math.log(1.0 - random.random())
+        return time.time() + headroom >= expires_at
+    
+    @staticmethod
+    def _recompute(cache_key, compute, timeout, name):
+        CacheStats.record(name, 'recompute')
+        started = time.monotonic()
+        value = compute()
+        ProductCache._store(cache_key, value, timeout, time.monotonic() - started)
+        return value
+    
+    @staticmethod
+    def get_or_compute(cache_key, compute, timeout, name):
+        """
+        Return the cached value for a key, computing and caching it if needed
+        
+        Only the worker holding the key's lock recomputes. Meanwhile other
+        workers serve the stale value if there is one, or wait up to
+        CACHE_LOCK_WAIT seconds for the new value before computing it
+        themselves. ``name`` selects the CacheStats counters.
+        """
+        entry = cache.get(cache_key)
+        if entry is not None and not ProductCache._should_refresh(entry):
+            CacheStats.record(name, 'hit')
+            return entry[0]
+        
+        lock_key = f'{cache_key}:lock'
+        token = uuid.uuid4().hex
+        
+        if entry is not None:
+            if not cache.add(lock_key, token, timeout=settings.CACHE_LOCK_TIMEOUT):
+                CacheStats.record(name, 'stale')
+                return entry[0]  # Someone else is refreshing it
+            try:
+                return ProductCache._recompute(cache_key, compute, timeout, name)
+            except Exception as e:
+                logger.error(f"Error refreshing cache key {cache_key}, serving stale value: {e}")
+                CacheStats.record(name, 'stale')
+                return entry[0]
+            finally:
+                ProductCache._release_lock(lock_key, token)
+        
+        CacheStats.record(name, 'miss')
+        deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+        while not cache.add(lock_key, token, timeout=settings.CACHE_LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                # The lock holder is too slow; don't hold the request up any longer
+                return ProductCache._recompute(cache_key, compute, timeout, name)
+            time.sleep(0.05)
+            entry = cache.get(cache_key)
+            if entry is not None:
+                return entry[0]
+        
+        try:
+            return ProductCache._recompute(cache_key, compute, timeout, name)
+        finally:
+            ProductCache._release_lock(lock_key, token)
+    
+    @staticmethod
+    def refresh(cache_key, compute, timeout, name):
+        """
+        Recompute and store a read-through value now, e.g. after the data behind it changed
+        """
+        return ProductCache._recompute(cache_key, compute, timeout, name)
+    
+    @staticmethod
+    def peek(cache_key):
+        """
+        Return the stored read-through value, even if expired, without computing it
+        """
+        entry = cache.get(cache_key)
+        return entry[0] if entry is not None else None
+    
+    @staticmethod
+    def _release_lock(lock_key, token):
+        # Leave the lock alone if it expired and another worker took it over
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
     
     @staticmethod
     def cache_product_list(products, category_id=None, search_query=None, sort_by=None):
@@ -59,7 +377,7 @@ class ProductCache:
         Cache a list of products
         """
         cache_key = ProductCache.get_product_list_cache_key(category_id, search_query, sort_by)
-        cache.set(cache_key, products, timeout=settings.CACHE_TTL_PRODUCT_LIST)
+        ProductCache._store(cache_key, products, settings.CACHE_TTL_PRODUCT_LIST)
         logger.info(f"Cached product list with key: {cache_key}")
     
     @staticmethod
@@ -68,7 +386,7 @@ class ProductCache:
         Retrieve cached product list
         """
         cache_key = ProductCache.get_product_list_cache_key(category_id, search_query, sort_by)
-        products = cache.get(cache_key)
+        products = ProductCache._load_value(cache_key)
         if products:
             logger.info(f"Retrieved cached product list with key: {cache_key}")
         return products
@@ -79,7 +397,7 @@ class ProductCache:
         Cache product detail data
         """
         cache_key = ProductCache.get_product_detail_cache_key(product_id)
-        cache.set(cache_key, product_data, timeout=settings.CACHE_TTL_PRODUCT_DETAIL)
+        ProductCache._store(cache_key, product_data, settings.CACHE_TTL_PRODUCT_DETAIL)
         logger.info(f"Cached product detail with key: {cache_key}")
     
     @staticmethod
@@ -88,7 +406,7 @@ class ProductCache:
         Retrieve cached product detail
         """
         cache_key = ProductCache.get_product_detail_cache_key(product_id)
-        product_data = cache.get(cache_key)
+        product_data = ProductCache._load_value(cache_key)
         if product_data:
             logger.info(f"Retrieved cached product detail with key: {cache_key}")
         return product_data
@@ -99,7 +417,7 @@ class ProductCache:
         Cache category list
         """
         cache_key = ProductCache.get_category_list_cache_key()
-        cache.set(cache_key, categories, timeout=settings.CACHE_TTL_CATEGORY_LIST)
+        ProductCache._store(cache_key, categories, settings.CACHE_TTL_CATEGORY_LIST)
         logger.info(f"Cached category list with key: {cache_key}")
     
     @staticmethod
@@ -108,7 +426,7 @@ class ProductCache:
         Retrieve cached category list
         """
         cache_key = ProductCache.get_category_list_cache_key()
-        categories = cache.get(cache_key)
+        categories = ProductCache._load_value(cache_key)
         if categories:
             logger.info(f"Retrieved cached category list with key: {cache_key}")
         return categories
@@ -119,7 +437,7 @@ class ProductCache:
         Cache popular products
         """
         cache_key = ProductCache.get_popular_products_cache_key()
-        cache.set(cache_key, products, timeout=settings.CACHE_TTL_POPULAR_PRODUCTS)
+        ProductCache._store(cache_key, products, settings.CACHE_TTL_POPULAR_PRODUCTS)
         logger.info(f"Cached popular products with key: {cache_key}")
     
     @staticmethod
@@ -128,7 +446,7 @@ class ProductCache:
         Retrieve cached popular products
         """
         cache_key = ProductCache.get_popular_products_cache_key()
-        products = cache.get(cache_key)
+        products = ProductCache._load_value(cache_key)
         if products:
             logger.info(f"Retrieved cached popular products with key: {cache_key}")
         return products
@@ -138,27 +456,17 @@ class ProductCache:
         """
         Invalidate product-related cache entries
         """
+        namespaces = [ProductCache.NAMESPACE_LIST, ProductCache.NAMESPACE_POPULAR]
+        
         # Invalidate product detail cache
         if product_id:
-            cache_key = ProductCache.get_product_detail_cache_key(product_id)
-            cache.delete(cache_key)
-            logger.info(f"Invalidated product detail cache with key: {cache_key}")
-        
-        # Invalidate product list caches (broad approach)
-        # In a production environment, you might want to be more selective
-        cache.delete_pattern('products:*')
-        logger.info("Invalidated product list caches")
-        
-        # Invalidate popular products cache
-        cache_key = ProductCache.get_popular_products_cache_key()
-        cache.delete(cache_key)
-        logger.info(f"Invalidated popular products cache with key: {cache_key}")
+            namespaces.append(ProductCache.product_namespace(product_id))
         
         # Invalidate category list cache if category changed
         if category_id:
-            cache_key = ProductCache.get_category_list_cache_key()
-            cache.delete(cache_key)
-            logger.info(f"Invalidated category list cache with key: {cache_key}")
+            namespaces.append(ProductCache.NAMESPACE_CATEGORY)
+        
+        ProductCache.bump_namespace(*namespaces)
 
 
 class SearchOptimizer:
@@ -169,37 +477,23 @@ class SearchOptimizer:
     @staticmethod
     def build_search_query(search_term):
         """
-        Build an optimized search query
+        Build a search filter backed by the cached search index results
         """
-        # Split search term into words
-        words = search_term.split()
-        
-        # Build Q objects for each word
-        queries = []
-        for word in words:
-            if len(word) >= 2:  # Only search for words with 2+ characters
-                queries.append(
-                    Q(name__icontains=word) |
-                    Q(description__icontains=word)
-                )
+        from .search import SearchResultCache
         
-        # Combine queries with AND logic
-        if queries:
-            search_query = queries[0]
-            for query in queries[1:]:
-                search_query &= query
-            return search_query
+        if not search_term or not search_term.strip():
+            return Q()  # Return empty query if no search term
         
-        return Q()  # Return empty query if no valid words
+        return Q(id__in=SearchResultCache.get_ids(search_term))
     
     @staticmethod
     def get_search_suggestions(search_term):
         """
-        Get search suggestions based on cached popular searches
+        Get search suggestions from the in-memory prefix index
         """
-        # In a real implementation, you would cache popular search terms
-        # For now, we'll return an empty list
-        return []
+        from .suggestions import SuggestionService
+        
+        return SuggestionService.suggest(search_term)
     
     @staticmethod
     def log_search_query(user, query, result_count):
@@ -216,37 +510,3 @@ class SearchOptimizer:
             )
         except Exception as e:
             logger.error(f"Error logging search query: {e}")
-
-
-class ImageOptimizer:
-    """
-    Utility class for optimizing image handling
-    """
-    
-    @staticmethod
-    def generate_thumbnail_url(image_url, size='medium'):
-        """
-        Generate thumbnail URL for different sizes
-        """
-        # In a real implementation, you would use an image processing library
-        # For now, we'll just return the original URL with size parameter
-        if '?' in image_url:
-            return f"{image_url}&size={size}"
-        else:
-            return f"{image_url}?size={size}"
-    
-    @staticmethod
-    def optimize_image_upload(image_file):
-        """
-        Optimize image upload (resize, compress, etc.)
-        """
-        # In a real implementation, you would use PIL or similar library
-        # For now, we'll just return the original file
-        return image_file
-
-
-# Configuration for cache timeouts (in seconds)
-CACHE_TTL_PRODUCT_LIST = 300  # 5 minutes
-CACHE_TTL_PRODUCT_DETAIL = 600  # 10 minutes
-CACHE_TTL_CATEGORY_LIST = 3600  # 1 hour
-CACHE_TTL_POPULAR_PRODUCTS = 1800  # 30 minutes
@@ -1,24 +1,89 @@
+import csv
+from decimal import Decimal
+
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.paginator import Paginator
-from django.db.models import Q
-from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import Count, DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import Http404, JsonResponse, QueryDict
 
-from .models import Product, Category, ProductReview
+from .models import Product, Category, ProductImage, ProductReview, ProductStatsRun, RelatedProducts
+from .categories import CategoryMembership
+from .facets import ProductFacets
+from .forms import ReviewForm
+from .imports import CatalogImporter, detect_format
+from .pagination import KeysetPaginator
+from .snapshots import HomePageSnapshot
+from .suggestions import SuggestionService
+from .utils import ProductCache
 from apps.accounts.models import User
 
+# Query parameters that select a product list page; anything else is left out of cached pages
+PRODUCT_LIST_PARAMS = ('category', 'search', 'min_price', 'max_price', 'sort', 'cursor')
+PRODUCT_LIST_SORTS = ('relevance', 'newest', 'price_asc', 'price_desc', 'rating')
+REVIEWS_PER_PAGE = 10
+# Dashboard orderings; each ends with a unique column for keyset pagination
+SELLER_DASHBOARD_SORTS = {
+    'newest': ('-created_at', '-id'),
+    'name': ('name', 'id'),
+    'units_sold': ('-units_sold', '-id'),
+    'revenue': ('-revenue', '-id'),
+    'views_7d': ('-views_7d', '-id'),
+    'views_30d': ('-views_30d', '-id'),
+    'rating': ('-avg_rating', '-review_count', '-id'),
+}
+
+
+def get_review_page(product_id, query_params=None):
+    """
+    One keyset-paginated chunk of a product's reviews, newest first
+    """
+    paginator = KeysetPaginator(
+        ProductReview.objects.get_reviews_for_product(product_id),
+        REVIEWS_PER_PAGE,
+        ('-created_at', '-id'),
+        cursor_param='reviews_cursor'
+    )
+    return paginator.get_page(query_params)
+
+
+def get_related_products(product):
+    """
+    The product's precomputed neighbours, or the newest products in its category if it has none yet
+    """
+    neighbour_ids = RelatedProducts.objects.filter(product_id=product.id).values_list('product_ids', flat=True).first()
+    if neighbour_ids:
+        neighbours = Product.objects.with_card_data().filter(id__in=neighbour_ids, is_active=True).in_bulk()
+        related = [neighbours[pk] for pk in neighbour_ids if pk in neighbours]
+        if related:
+            return related[:settings.RELATED_PRODUCTS_SHOWN]
+    
+    return list(Product.objects.with_card_data().filter(
+        category_id=product.category_id,
+        is_active=True
+    ).exclude(id=product.id).order_by('-created_at')[:settings.RELATED_PRODUCTS_SHOWN])
+
+
+def get_active_categories():
+    return ProductCache.get_or_compute(
+        ProductCache.get_category_list_cache_key(),
+        lambda: list(Category.objects.filter(is_active=True)),
+        settings.CACHE_TTL_CATEGORY_LIST,
+        name='categories'
+    )
+
 
 def home(request):
-    # Get featured products (for now, we'll just get the latest 6)
-    featured_products = Product.objects.filter(is_active=True).order_by('-created_at')[:6]
-    
-    # Get categories
-    categories = Category.objects.filter(is_active=True)
+    # Featured products, categories and ads come from a prebuilt snapshot
+    snapshot = HomePageSnapshot.get()
     
     context = {
-        'featured_products': featured_products,
-        'categories': categories,
+        'featured_products': snapshot['featured_products'],
+        'categories': snapshot['categories'],
+        'ad_slots': snapshot['ad_slots'],
     }
     
     return render(request, 'products/home.html', context)
@@ -30,48 +95,67 @@ def product_list(request):
     search = request.GET.get('search', '')
     min_price = request.GET.get('min_price', '')
     max_price = request.GET.get('max_price', '')
-    sort = request.GET.get('sort', 'newest')
-    
-    # Build queryset
-    products = Product.objects.filter(is_active=True)
-    
-    if category_id:
-        products = products.filter(category_id=category_id)
-    
-    if search:
-        products = products.filter(
-            Q(name__icontains=search) |
-            Q(description__icontains=search)
-        )
-    
-    if min_price:
-        products = products.filter(price__gte=min_price)
-    
-    if max_price:
-        products = products.filter(price__lte=max_price)
-    
-    # Apply sorting
-    if sort == 'price_asc':
-        products = products.order_by('price')
-    elif sort == 'price_desc':
-        products = products.order_by('-price')
-    elif sort == 'rating':
-        # In a real implementation, you would order by rating
-        products = products.order_by('-created_at')
-    else:  # newest
-        products = products.order_by('-created_at')
-    
-    # Paginate results
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
-    # Get categories for filter
-    categories = Category.objects.filter(is_active=True)
+    sort = request.GET.get('sort', 'relevance' if search else 'newest')
+    if sort not in PRODUCT_LIST_SORTS or (sort == 'relevance' and not search):
+        sort = 'newest'
+    
+    query_params = QueryDict(mutable=True)
+    for param in PRODUCT_LIST_PARAMS:
+        if request.GET.get(param):
+            query_params[param] = request.GET[param]
+    
+    def get_page():
+        # Build queryset (search results come from the index, ranked by relevance)
+        if search:
+            products = Product.objects.search_products(search)
+        else:
+            products = Product.objects.filter(is_active=True)
+        products = products.with_card_data()
+        
+        if category_id:
+            products = products.in_category(category_id)
+        
+        if min_price:
+            products = products.filter(price__gte=min_price)
+        
+        if max_price:
+            products = products.filter(price__lte=max_price)
+        
+        # Apply sorting (each ordering ends with a unique column for keyset pagination)
+        if sort == 'relevance':
+            ordering = ('-search_score', 'id')
+        elif sort == 'price_asc':
+            ordering = ('price', 'id')
+        elif sort == 'price_desc':
+            ordering = ('-price', '-id')
+        elif sort == 'rating':
+            ordering = ('-avg_rating', '-review_count', '-id')
+        else:  # newest
+            ordering = ('-created_at', '-id')
+        
+        # Paginate results with opaque cursors instead of page offsets
+        paginator = KeysetPaginator(products, 12, ordering, estimate_count=True)
+        return paginator.get_page(query_params)
+    
+    page_obj = ProductCache.get_or_compute(
+        ProductCache.get_product_list_cache_key(
+            category_id, search, sort, min_price, max_price, query_params.get('cursor')
+        ),
+        get_page,
+        settings.CACHE_TTL_PRODUCT_LIST,
+        name='product_list'
+    )
+    
+    # Get categories for filter, with facet counts for the current search and filters
+    facets = ProductFacets.get_counts(search, category_id, min_price, max_price)
+    categories = get_active_categories()
+    for category in categories:
+        category.facet_count = facets['categories'].get(category.id, 0)
     
     context = {
         'page_obj': page_obj,
         'categories': categories,
+        'price_facets': facets['price_buckets'],
         'category_filter': category_id,
         'search_query': search,
         'min_price_filter': min_price,
@@ -83,49 +167,102 @@ def product_list(request):
 
 
 def product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id, is_active=True)
-    
-    # Get related products (same category, excluding current product)
-    related_products = Product.objects.filter(
-        category=product.category,
-        is_active=True
-    ).exclude(id=product_id).order_by('-created_at')[:4]
-    
-    # Get reviews
-    reviews = product.reviews.all().order_by('-created_at')
+    def get_detail():
+        product = Product.objects.with_detail_data().filter(id=product_id, is_active=True).first()
+        if product is None:
+            return None  # Cached too; creating or activating the product bumps its namespace
+        
+        # Only the first chunk of reviews; the rest load on demand from product_reviews
+        return {'product': product, 'reviews_page': get_review_page(product.id)}
+    
+    detail = ProductCache.get_or_compute(
+        ProductCache.get_product_detail_cache_key(product_id),
+        get_detail,
+        settings.CACHE_TTL_PRODUCT_DETAIL,
+        name='product_detail'
+    )
+    if detail is None:
+        raise Http404("No Product matches the given query.")
+    product = detail['product']
+    
+    # Later review chunks (links for browsers without JavaScript) are not cached
+    reviews_page = detail['reviews_page']
+    if request.GET.get('reviews_cursor'):
+        reviews_page = get_review_page(product_id, request.GET)
+    
+    # Get related products (precomputed by rebuild_related_products)
+    related_products = ProductCache.get_or_compute(
+        ProductCache.get_related_products_cache_key(product_id, product.category_id),
+        lambda: get_related_products(product),
+        settings.CACHE_TTL_PRODUCT_LIST,
+        name='related_products'
+    )
     
     context = {
         'product': product,
         'related_products': related_products,
-        'reviews': reviews,
+        'reviews_page': reviews_page,
     }
     
     return render(request, 'products/product_detail.html', context)
 
 
+def product_reviews(request, product_id):
+    # HTML fragment with the next chunk of reviews, appended by the detail page
+    product = get_object_or_404(Product.objects.only('id'), id=product_id, is_active=True)
+    
+    context = {
+        'product': product,
+        'reviews_page': get_review_page(product.id, request.GET),
+    }
+    
+    return render(request, 'products/review_list.html', context)
+
+
+def search_suggestions(request):
+    # Served from the in-memory prefix index; never touches the database
+    query = request.GET.get('q', '')
+    suggestions = SuggestionService.suggest(query)
+    
+    return JsonResponse({'query': query, 'suggestions': suggestions})
+
+
 @login_required
 def add_review(request, product_id):
     product = get_object_or_404(Product, id=product_id, is_active=True)
     
     if request.method == 'POST':
-        rating = request.POST.get('rating')
-        comment = request.POST.get('comment')
+        form = ReviewForm(request.POST)
+        if not form.is_valid():
+            if 'rating' in form.errors:
+                messages.error(request, 'Please choose a rating from 1 to 5 stars.')
+            else:
+                messages.error(request, 'Please write a comment with your review.')
+            return redirect('products:product_detail', product_id=product_id)
         
-        # Check if user has already reviewed this product
-        review, created = ProductReview.objects.get_or_create(
-            product=product,
-            user=request.user,
-            defaults={'rating': rating, 'comment': comment}
-        )
+        rating = form.cleaned_data['rating']
+        comment = form.cleaned_data['comment']
         
-        if not created:
-            # Update existing review
-            review.rating = rating
-            review.comment = comment
-            review.save()
-            messages.success(request, 'Your review has been updated.')
-        else:
+        # The review and the product's rating aggregates (updated by signals)
+        # are written in the same transaction
+        with transaction.atomic():
+            # Check if user has already reviewed this product
+            review, created = ProductReview.objects.get_or_create(
+                product=product,
+                user=request.user,
+                defaults={'rating': rating, 'comment': comment}
+            )
+            
+            if not created:
+                # Update existing review
+                review.rating = rating
+                review.comment = comment
+                review.save()
+        
+        if created:
             messages.success(request, 'Your review has been added.')
+        else:
+            messages.success(request, 'Your review has been updated.')
         
         return redirect('products:product_detail', product_id=product_id)
     
@@ -138,11 +275,39 @@ def seller_dashboard(request):
         messages.error(request, 'You must be a seller to access this page.')
         return redirect('products:home')
     
-    # Get seller's products
-    products = Product.objects.filter(seller=request.user).order_by('-created_at')
+    sort = request.GET.get('sort', 'newest')
+    if sort not in SELLER_DASHBOARD_SORTS:
+        sort = 'newest'
+    
+    query_params = QueryDict(mutable=True)
+    for param in ('sort', 'cursor'):
+        if request.GET.get(param):
+            query_params[param] = request.GET[param]
+    
+    # Sales and view numbers come from the precomputed ProductStats rows
+    products = Product.objects.with_card_data().filter(seller=request.user).annotate(
+        units_sold=Coalesce('stats__units_sold', 0),
+        revenue=Coalesce('stats__revenue', Value(Decimal('0.00')), output_field=DecimalField()),
+        views_7d=Coalesce('stats__views_7d', 0),
+        views_30d=Coalesce('stats__views_30d', 0),
+    )
+    paginator = KeysetPaginator(products, settings.SELLER_DASHBOARD_PAGE_SIZE, SELLER_DASHBOARD_SORTS[sort])
+    page_obj = paginator.get_page(query_params)
+    
+    summary = Product.objects.filter(seller=request.user).aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+        pending=Count('id', filter=Q(is_active=False)),
+        revenue=Sum('stats__revenue'),
+    )
     
     context = {
-        'products': products,
+        'page_obj': page_obj,
+        'summary': summary,
+        'sort': sort,
+        'stats_updated_at': ProductStatsRun.objects.order_by('-finished_at').values_list(
+            'finished_at', flat=True
+        ).first(),
     }
     
     return render(request, 'products/seller_dashboard.html', context)
@@ -161,29 +326,34 @@ def create_product(request):
         quantity = request.POST.get('quantity')
         category_id = request.POST.get('category')
         
-        # Create product
-        product = Product.objects.create(
-            seller=request.user,
-            name=name,
-            description=description,
-            price=price,
-            quantity=quantity,
-            category_id=category_id,
-            is_active=False  # Product needs admin approval
-        )
-        
-        # Handle image uploads (simplified for now)
-        # In a real implementation, you would handle file uploads properly
-        image_urls = request.POST.getlist('image_urls')
-        for i, image_url in enumerate(image_urls):
-            if image_url:
-                from .models import ProductImage
-                ProductImage.objects.create(
-                    product=product,
-                    image_url=image_url,
-                    is_primary=(i == 0),
-                    sort_order=i
-                )
+        # Signals from the product and its images invalidate caches once, at the end
+        with ProductCache.coalesce_invalidations():
+            # Create product
+            product = Product.objects.create(
+                seller=request.user,
+                name=name,
+                description=description,
+                price=price,
+                quantity=quantity,
+                category_id=category_id,
+                is_active=False  # Product needs admin approval
+            )
+            
+            # Handle image uploads (simplified for now)
+            # In a real implementation, you would handle file uploads properly
+            image_urls = request.POST.getlist('image_urls')
+            for i, image_url in enumerate(image_urls):
+                if image_url:
+                    from .models import ProductImage
+                    ProductImage.objects.create(
+                        product=product,
+                        image_url=image_url,
+                        is_primary=(i == 0),
+                        sort_order=i
+                    )
+            
+            # Extra categories the product is also listed in
+            CategoryMembership.set_categories(product, request.POST.getlist('categories'))
         
         messages.success(request, 'Product created successfully and is pending approval.')
         return redirect('products:seller_dashboard')
@@ -198,33 +368,63 @@ def create_product(request):
     return render(request, 'products/create_product.html', context)
 
 
+@login_required
+def import_products(request):
+    if request.user.user_type != 'seller':
+        messages.error(request, 'You must be a seller to access this page.')
+        return redirect('products:home')
+    
+    report = None
+    if request.method == 'POST':
+        upload = request.FILES.get('file')
+        file_format = detect_format(upload.name) if upload else None
+        
+        if upload is None:
+            messages.error(request, 'Please choose a file to import.')
+        elif file_format is None:
+            messages.error(request, 'Please upload a .csv or .jsonl file.')
+        else:
+            try:
+                report = CatalogImporter(request.user).run(upload, file_format)
+            except (UnicodeDecodeError, csv.Error):
+                messages.error(request, 'The file could not be read. Please upload UTF-8 encoded CSV or JSONL.')
+            else:
+                if report.products_created:
+                    messages.success(
+                        request, f'{report.products_created} products imported and pending approval.'
+                    )
+                if report.rows_failed:
+                    messages.warning(request, f'{report.rows_failed} rows were rejected.')
+    
+    context = {
+        'report': report,
+        'max_images': settings.CATALOG_IMPORT_MAX_IMAGES,
+    }
+    
+    return render(request, 'products/import_products.html', context)
+
+
 @login_required
 def edit_product(request, product_id):
     product = get_object_or_404(Product, id=product_id, seller=request.user)
     
     if request.method == 'POST':
-        product.name = request.POST.get('name')
-        product.description = request.POST.get('description')
-        product.price = request.POST.get('price')
-        product.quantity = request.POST.get('quantity')
-        product.category_id = request.POST.get('category')
-        product.save()
-        
-        # Handle image updates (simplified for now)
-        # In a real implementation, you would handle file uploads properly
-        image_urls = request.POST.getlist('image_urls')
-        # Clear existing images
-        product.images.all().delete()
-        # Add new images
-        for i, image_url in enumerate(image_urls):
-            if image_url:
-                from .models import ProductImage
-                ProductImage.objects.create(
-                    product=product,
-                    image_url=image_url,
-                    is_primary=(i == 0),
-                    sort_order=i
-                )
+        # Signals from the product and its images invalidate caches once, at the end
+        with ProductCache.coalesce_invalidations():
+            product.name = request.POST.get('name')
+            product.description = request.POST.get('description')
+            product.price = request.POST.get('price')
+            product.quantity = request.POST.get('quantity')
+            product.category_id = request.POST.get('category')
+            product.save()
+            
+            # Handle image updates (simplified for now)
+            # In a real implementation, you would handle file uploads properly
+            # Only added, removed and reordered images are written
+            ProductImage.objects.sync_for_product(product, request.POST.getlist('image_urls'))
+            
+            # Extra categories the product is also listed in
+            CategoryMembership.set_categories(product, request.POST.getlist('categories'))
         
         messages.success(request, 'Product updated successfully.')
         return redirect('products:seller_dashboard')
@@ -234,7 +434,11 @@ def edit_product(request, product_id):
     
     context = {
         'product': product,
+        'images': product.images.order_by('sort_order', 'id'),
         'categories': categories,
+        'extra_category_ids': set(
+            product.category_links.exclude(category_id=product.category_id).values_list('category_id', flat=True)
+        ),
     }
     
     return render(request, 'products/edit_product.html', context)
@@ -245,7 +449,9 @@ def delete_product(request, product_id):
     product = get_object_or_404(Product, id=product_id, seller=request.user)
     
     if request.method == 'POST':
-        product.delete()
+        # Deleting cascades to images and reviews; invalidate caches once
+        with ProductCache.coalesce_invalidations():
+            product.delete()
         messages.success(request, 'Product deleted successfully.')
         return redirect('products:seller_dashboard')
     
@@ -78,6 +78,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'apps.orders.context_processors.cart_summary',
             ],
         },
     },
@@ -171,6 +172,92 @@ CACHES = {
     }
 }
 
+# Product cache settings (seconds)
+CACHE_TTL_PRODUCT_LIST = 300
+CACHE_TTL_PRODUCT_DETAIL = 600
+CACHE_TTL_CATEGORY_LIST = 3600
+CACHE_TTL_POPULAR_PRODUCTS = 1800
+CACHE_STALE_TTL = 60  # how long past expiry an entry may be served while it is refreshed
+CACHE_NAMESPACE_VERSION_TTL = 86400  # lifetime of a namespace version key; an expired one only causes cache misses
+CACHE_EARLY_REFRESH_BETA = 1.0  # higher values refresh entries earlier before they expire
+CACHE_LOCK_TIMEOUT = 10  # longest a worker may hold the recompute lock for a key
+CACHE_LOCK_WAIT = 2  # how long a cold miss waits for another worker's recompute
+CACHE_STATS_FLUSH_INTERVAL = 10  # seconds between writes of hit/miss counters to the cache
+
+# Search settings
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+SEARCH_MAX_RESULTS = 1000  # ranked candidates returned by the search index
+SEARCH_STATS_TTL = 300  # seconds to cache corpus size and average document length
+SEARCH_RESULT_CACHE_TTL = 300  # seconds to cache ranked results per normalized query
+SEARCH_RESULT_LRU_SIZE = 500  # normalized queries whose results each worker keeps in memory
+
+# Facet settings
+FACET_CACHE_TTL = 60  # seconds to cache sidebar counts per normalized filter
+FACET_PRICE_BUCKETS = (10, 25, 50, 100)  # upper bounds; the last bucket is open-ended
+
+# Search suggestion settings
+SUGGEST_LIMIT = 10  # suggestions returned per prefix
+SUGGEST_REFRESH_INTERVAL = 60  # seconds between checks for a newer published index
+SUGGEST_QUERY_WINDOW_DAYS = 30  # age of search queries counted towards popularity
+SUGGEST_MAX_QUERIES = 5000  # most frequent search queries included in the index
+
+# Home page settings
+HOME_FEATURED_PRODUCTS = 6  # newest active products featured on the home page
+HOME_AD_LOCATION = 'home'  # AdvertisementSlot.page_location of slots shown on the home page
+
+# Catalog import settings
+CATALOG_IMPORT_BATCH_SIZE = 1000  # rows validated and written per transaction
+CATALOG_IMPORT_MAX_ERRORS = 100  # row errors kept for the report; later ones are only counted
+CATALOG_IMPORT_MAX_IMAGES = 10  # image URLs allowed per imported product
+
+# Seller dashboard settings
+SELLER_DASHBOARD_PAGE_SIZE = 25  # products per dashboard page
+PRODUCT_STATS_VIEW_DAYS = 30  # days of daily view counts kept for the dashboard view windows
+PRODUCT_STATS_OVERLAP = 600  # seconds each stats run re-reads before the previous run, for late commits
+
+# Product image pipeline settings
+IMAGE_VARIANTS = {'thumb': 160, 'medium': 640, 'large': 1280}  # longest edge in pixels per variant
+IMAGE_QUALITY = 82  # WebP and JPEG encoder quality
+IMAGE_PIPELINE_ASYNC = True  # process new images on background threads; False processes them on commit
+IMAGE_PIPELINE_DISPATCHERS = 2  # threads fetching sources and recording results
+IMAGE_PIPELINE_WORKERS = 2  # processes resizing and encoding; 0 encodes on the dispatcher thread
+IMAGE_PIPELINE_MAX_BYTES = 20 * 1024 * 1024  # largest source image fetched
+IMAGE_PIPELINE_TIMEOUT = 10  # seconds allowed to download a source image
+IMAGE_PIPELINE_MEDIA_HOSTS = []  # hosts whose /media/ URLs are read straight from MEDIA_ROOT
+
+# Related product settings
+RELATED_PRODUCTS_SHOWN = 4  # related products on the detail page
+RELATED_PRODUCTS_STORED = 20  # neighbours kept per product, so inactive ones can be skipped
+RELATED_VIEW_WEIGHT = 0.25  # a shared browsing session counts this much of a shared order
+RELATED_MIN_SUPPORT = 2  # baskets two products must share before they are related
+
+# Order settings
+ORDER_NUMBER_HOST_ID = env.int('ORDER_NUMBER_HOST_ID', default=None)  # 0-65535, distinct per host; required unless DEBUG, which hashes the host name
+ORDER_STATUS_BATCH_SIZE = 1000  # orders locked and updated per transaction in a bulk status change
+ORDER_STATUS_MAX_ERRORS = 100  # rejected rows listed in a bulk status change report
+
+# Cart settings
+CART_REDIS_URL = env('CART_REDIS_URL', default='redis://127.0.0.1:6379/2')  # empty keeps carts in process memory
+CART_TTL = 30 * 86400  # seconds an untouched cart stays in Redis; it is reloaded from the database after that
+CART_WRITE_BEHIND_DELAY = 300  # seconds a changed cart waits before flush_carts saves it to the database
+CART_FLUSH_BATCH_SIZE = 500  # carts written per flush_carts batch
+CART_CHECKOUT_LOCK_TIMEOUT = 30  # longest a checkout may hold a buyer's cart
+
+# Stock reservation settings
+STOCK_HOLD_TTL = 15 * 60  # seconds a buyer's stock holds last after their last cart change
+STOCK_RECONCILE_BATCH_SIZE = 500  # product counters checked against the database per query
+
+# Payment settings
+PAYMENT_GATEWAY = env('PAYMENT_GATEWAY', default=None)  # PaymentGateway class path; required, development and tests use the local one
+PAYMENT_QUEUE_ASYNC = True  # charge on background threads; False charges on commit, in the request
+PAYMENT_QUEUE_WORKERS = 4  # threads calling the gateway
+PAYMENT_MAX_ATTEMPTS = 5  # attempts before a payment fails and its order is cancelled
+PAYMENT_RETRY_BASE_DELAY = 2  # seconds before the first retry; doubles with each attempt
+PAYMENT_RETRY_MAX_DELAY = 300  # longest wait between attempts
+PAYMENT_CLAIM_TIMEOUT = 60  # seconds an attempt owns a payment before process_payments may retry it
+PAYMENT_STATUS_POLL_INTERVAL = 2  # seconds between order page checks while a payment is pending
+
 # Session settings
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 SESSION_CACHE_ALIAS = 'default'
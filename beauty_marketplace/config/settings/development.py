@@ -15,6 +15,9 @@ DATABASES = {
     'default': env.db(default='sqlite:///db.sqlite3')
 }
 
+# Payments for development: approves every charge without taking money
+PAYMENT_GATEWAY = env('PAYMENT_GATEWAY', default='apps.orders.payments.LocalGateway')
+
 # Email backend for development
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
@@ -1,3 +1,5 @@
+from django.core.exceptions import ImproperlyConfigured
+
 from .base import *
 
 # SECURITY WARNING: keep the secret key used in production secret!
@@ -15,6 +17,16 @@ DATABASES = {
     'default': env.db(),
 }
 
+# Payments for production: a real gateway, never the local one that approves every charge
+PAYMENT_GATEWAY = env('PAYMENT_GATEWAY')
+if PAYMENT_GATEWAY == 'apps.orders.payments.LocalGateway':
+    raise ImproperlyConfigured('PAYMENT_GATEWAY must be a real gateway in production.')
+
+# Order numbers: each host needs its own id, a hash of the host name can collide
+ORDER_NUMBER_HOST_ID = env.int('ORDER_NUMBER_HOST_ID')
+if not 0 <= ORDER_NUMBER_HOST_ID < 1 << 16:
+    raise ImproperlyConfigured('ORDER_NUMBER_HOST_ID must be between 0 and 65535.')
+
 # Email backend for production
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = env('EMAIL_HOST')
@@ -13,6 +13,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'test_db.sqlite3',
+        # A file instead of the in-memory default, where writers from other threads
+        # fail at once instead of waiting for the lock (see CheckoutConcurrencyTests)
+        'TEST': {'NAME': BASE_DIR / 'test_db_test.sqlite3'},
     }
 }
 
@@ -30,6 +33,16 @@ CACHES = {
     }
 }
 
+# Carts for testing: in-process store instead of Redis
+CART_REDIS_URL = None
+
+# Payments for testing: charged on commit, in the test's thread, by the local gateway
+PAYMENT_GATEWAY = 'apps.orders.payments.LocalGateway'
+PAYMENT_QUEUE_ASYNC = False
+
+# Order numbers for testing: the test runner turns DEBUG off, so give the host an id
+ORDER_NUMBER_HOST_ID = 0
+
 # Logging for testing
 LOGGING = {
     'version': 1,